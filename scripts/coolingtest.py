@@ -30,6 +30,7 @@ def main():
     # to run the saved one use this line:
     # coolmesh: domain.DomainMC = domain.DomainMC.LoadFile("save")
     coolmesh: domain.DomainMC = domain.DomainMC.LoadFile("coolmesh")
+    coolmesh.SetNozzle(outputData) # hot gas side uses the real throat and lip radius
 
     mmapmesh = domain.DomainMMAP(coolmesh)
 
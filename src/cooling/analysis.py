@@ -1,128 +1,275 @@
+from collections.abc import Sequence
+from dataclasses import replace
 import matplotlib.pyplot as plt
-import joblib
 import multiprocessing as mp
-from alive_progress import alive_bar
+import numpy as np
 
-from cooling.domain import DomainMC, DomainMMAP, SparseDomain
-from cooling import material, calc_cell
+from cooling.convergence import ConvergenceController, ConvergenceCriteria, ResumeCheckpoint, WriteCheckpoint
+from cooling.decomposition import BlockSolver
+from cooling.domain import DomainMC, DomainMMAP
+from cooling.network import ThermalNetwork
+from cooling.multigrid import MultigridSolver
+from cooling.transient import LocalError, TransientResult, TransientSettings, TransientSolver, WriteSnapshots
 
-def AnalyzeMC(domain: DomainMMAP, MAX_CORES: int = mp.cpu_count() - 1, tol: float = 1e-2, convPlot: bool = True):
-    calcPoints = []
-    with alive_bar(domain.vpoints*domain.hpoints, title="Finding calculation points") as bar:
-        for row in range(domain.vpoints):
-            for col in range(domain.hpoints):
-                if domain.material[row, col] not in material.MaterialType.STATIC_TEMP:
-                    calcPoints.append((row, col))
-                bar()
+CHANGE_TOL = 1e-2 # largest relative temperature change of a Picard iteration the direct solvers stop at by default
+SOR_RESIDUAL = 1e-4 # relative residual SOR stops at by default. An over-relaxed sweep changes the temperatures by
+                    # little long before they converge, so SOR is not stopped on the change
 
+def AnalyzeMC(domain: DomainMMAP, MAX_CORES: int = mp.cpu_count() - 1, tol: float | None = None, convPlot: bool = True, method: str = 'sor', **kwargs):
+    # method 'sor' relaxes the resistor network with red-black SOR, see AnalyzeMCSOR. 'direct' solves it with a sparse
+    # factorization, 'multigrid' with multigrid preconditioned GMRES and 'blocks' with GMRES over blocks of the grid
+    # solved side by side on MAX_CORES workers (blockCells active cells each), see AnalyzeMCDirect. kwargs go to the solver,
+    # both take criteria (a ConvergenceCriteria, otherwise tol alone is the relative residual for 'sor' and the largest
+    # relative temperature change of an iteration for the others, None for SOR_RESIDUAL and CHANGE_TOL),
+    # checkpoint (mesh path the progress is saved to, None for no checkpoints), checkpointEvery and resume (start from
+    # the checkpoint when it was taken on this mesh)
+    if method == 'sor':
+        return AnalyzeMCSOR(domain, MAX_CORES, tol, convPlot, **kwargs)
+    if method == 'direct':
+        return AnalyzeMCDirect(domain, MAX_CORES, tol, convPlot, **kwargs)
+    if method == 'multigrid':
+        return AnalyzeMCDirect(domain, MAX_CORES, tol, convPlot, multigrid=True, **kwargs)
+    if method == 'blocks':
+        return AnalyzeMCDirect(domain, MAX_CORES, tol, convPlot, blocks=True, **kwargs)
+    raise ValueError(f"Unknown analysis method {method}")
+
+def AnalyzeMCSparse(domain: DomainMC, MAX_CORES: int = mp.cpu_count() - 1, tol: float | None = None, convPlot: bool = True, method: str = 'sor', **kwargs):
+    # same solve for an in memory domain, results are copied back into it
+    with DomainMMAP(domain) as mmapDomain:
+        history = AnalyzeMC(mmapDomain, MAX_CORES, tol, convPlot, method, **kwargs)
+        domain.grid.temperature[:] = mmapDomain.memmaps["temperature"]
+        domain.grid.pressure[:] = mmapDomain.memmaps["pressure"]
+    return history
+
+def AnalyzeMCSOR(domain: DomainMMAP, MAX_CORES: int = mp.cpu_count() - 1, tol: float | None = None, convPlot: bool = True, omega: float = 1.8, updateEvery: int = 25, maxSweeps: int = 20000,
+                 criteria: ConvergenceCriteria | None = None, checkpoint: str | None = "save", checkpointEvery: int = 10, resume: bool = False):
+    # red-black SOR on the wall cells with the coolant marched down its circuits between sweeps. The resistors are
+    # re-evaluated every updateEvery sweeps, and once more before stopping when a sweep meets the criteria, so the
+    # result is converged with its own resistors. A checkpoint is taken every checkpointEvery resistor updates
+    network = ThermalNetwork(domain, MAX_CORES)
+    print(f"Relaxing {network.size} active cells")
+    temperature, pressure = network.Load(domain)
+    criteria = Criteria(criteria, tol, maxSweeps, residual=True)
     if convPlot:
-        plt.ion()
-        convergePlot, ax = plt.subplots()
-        ax.set_title("Convergence")
-        ax.set_xlabel("Iteration")
-        ax.set_ylabel("Max % Difference")
-        ax.grid(True)
-
-    diffArr = []
-
-    with joblib.Parallel(n_jobs=MAX_CORES, return_as='generator') as parallel:
-        diff = tol + 1
-        numRows = domain.vpoints
-        i = 0
-        while diff > tol:
-            i += 1
-            diff = 0
-            with alive_bar(len(calcPoints), title=f"Analyzing iteration {i}") as bar:
-                outputs = parallel(
-                    joblib.delayed(CalcCell)(domain, row, col) for row, col in calcPoints
-                )
-
-                for output in outputs:
-                    for row, col, tp in output:
-                        diff = max(diff, abs(domain.temperature[row, col].magnitude - tp[0].to(domain.units["temperature"]).magnitude)/domain.temperature[row, col].magnitude)
-                        domain.setMEM(row, col, 'temperature', tp[0])
-                        domain.setMEM(row, col, 'pressure', tp[1])
-                    bar()
-
-            print(f"Max diff: {diff*100}%")
-            diffArr.append(diff*100)
-            if convPlot:
-                # del convergeP
-                ax.clear()
-                ax.grid(True)
-                iarr = max(0, i - 15)
-                ax.plot(range(iarr, i), diffArr[iarr:], 'k-')
-                # convergeP = ax.plot(range(i), diffArr, 'r-')
-                ax.autoscale(axis='y')
-                
-                convergePlot.canvas.draw()
-                convergePlot.canvas.flush_events()
-
-            if i % 10 == 0:
-                print("saving progress")
-                mesh = domain.toDomain()
-                mesh.DumpFile("save")
-            
-            if i == 2:
-                break
-
-def AnalyzeMCSparse(domain: DomainMC, MAX_CORES: int = mp.cpu_count() - 1, tol: float = 1e-2, convPlot: bool = True):
-    calcPoints = []
-    with alive_bar(domain.vpoints*domain.hpoints, title="Finding calculation points") as bar:
-        for row in range(domain.vpoints):
-            for col in range(domain.hpoints):
-                if domain.array[row, col].material not in material.MaterialType.STATIC_TEMP:
-                    calcPoints.append((row, col))
-                bar()
+        convergePlot, ax = ConvergencePlot("Residual L2 [BTU/hr]")
+
+    history = []
+    updates = 0
+    sweep = 0
+    state = ResumeCheckpoint(checkpoint, domain) if resume and checkpoint is not None else None
+    if state is not None:
+        temperature, pressure = network.Load(domain)
+    if state is not None and state["method"] == "sor":
+        sweep, updates, history = state["iteration"], state["updates"], [tuple(h) for h in state["history"]]
+
+    controller = ConvergenceController(criteria, network)
+    status = None
+    fresh = True # resistors are evaluated before the first sweep
+    while status is None:
+        if sweep % updateEvery == 0 or fresh:
+            WriteBack(domain, network, temperature, pressure)
+            print(f"Evaluating resistors {updates + 1}")
+            network.Update(domain)
+            updates += 1
+            fresh = True
+            if checkpoint is not None and updates % checkpointEvery == 0:
+                WriteCheckpoint(checkpoint, domain, {"method": "sor", "iteration": sweep, "updates": updates, "history": history})
+
+        sweep += 1
+        diff = network.Relax(temperature, pressure, omega)
+        record = controller.Measure(sweep, network, temperature, pressure, diff)
+        history.append((record.residualL2, record.residualLinf))
+        print(f"Sweep {sweep}: residual L2 {record.residualL2:.4g} BTU/hr, Linf {record.residualLinf:.4g} BTU/hr, max diff {diff*100:.4g}%")
+        if convPlot:
+            UpdateConvergencePlot(convergePlot, ax, [h[0] for h in history])
+
+        status = controller.Check(record, current=fresh)
+        fresh = not fresh and controller.Satisfied(record) # met with old resistors, check against new ones
 
+    controller.Report(status)
+    WriteBack(domain, network, temperature, pressure)
+    if checkpoint is not None:
+        WriteCheckpoint(checkpoint, domain, {"method": "sor", "iteration": sweep, "updates": updates, "history": history, "status": status})
+    network.close()
+    return history
+
+def AnalyzeMCDirect(domain: DomainMMAP, MAX_CORES: int = mp.cpu_count() - 1, tol: float | None = None, convPlot: bool = True, maxIter: int = 50, multigrid: bool = False,
+                    blocks: bool = False, blockCells: int | None = None, criteria: ConvergenceCriteria | None = None, checkpoint: str | None = "save", checkpointEvery: int = 1, resume: bool = False):
+    # Picard iteration, the resistors are evaluated at the current temperatures and pressures, then the temperature and
+    # coolant pressure fields they imply are solved for directly. The criteria are checked right after the resistors
+    # are evaluated, so the residual is the one of the last solution with its own resistors. multigrid swaps the sparse
+    # LU for GMRES with a multigrid V-cycle, for meshes too fine to factor. blocks swaps it for GMRES preconditioned by
+    # direct solves of blocks of the grid on MAX_CORES workers, see cooling.decomposition
+    if multigrid and blocks:
+        raise ValueError("Pick one of multigrid and blocks")
+    network = ThermalNetwork(domain, MAX_CORES)
+    linearSolver = None
+    if multigrid:
+        linearSolver = MultigridSolver.ForNetwork(network)
+    elif blocks:
+        linearSolver = BlockSolver.ForNetwork(network, MAX_CORES, blockCells)
+    print(f"Solving {network.size} active cells")
+    if multigrid:
+        print(f"Multigrid levels: {[aggregate.size for aggregate in linearSolver.aggregates]}")
+    elif blocks:
+        print(f"{len(linearSolver.blocks)} blocks of {min(block.owned for block in linearSolver.blocks)} to {max(block.owned for block in linearSolver.blocks)} active cells on {len(linearSolver.assignment)} workers")
+    temperature, pressure = network.Load(domain)
+    criteria = Criteria(criteria, tol, maxIter)
     if convPlot:
-        plt.ion()
-        convergePlot, ax = plt.subplots()
-        ax.set_title("Convergence")
-        ax.set_xlabel("Iteration")
-        ax.set_ylabel("Max % Difference")
-        ax.grid(True)
-
-    diffArr = []
-
-    with joblib.Parallel(n_jobs=MAX_CORES, return_as='generator') as parallel:
-        diff = tol + 1
-        i = 0
-        while diff > tol:
-            i += 1
-            diff = 0
-            with alive_bar(len(calcPoints), title=f"Analyzing iteration {i}") as bar:
-                outputs = parallel(
-                    joblib.delayed(CalcCell)(SparseDomain(domain, (row, col)), row, col) for row, col in calcPoints
-                )
-
-                for output in outputs:
-                    for row, col, tp in output:
-                        diff = max(diff, abs(domain.array[row, col].temperature.magnitude - tp[0].magnitude)/domain.array[row, col].temperature.magnitude)
-                        domain.array[row,col].temperature = tp[0]
-                        domain.array[row,col].pressure = tp[1]
-                    bar()
-
-            print(f"Max diff: {diff*100}%")
-            diffArr.append(diff*100)
-            if convPlot:
-                # del convergeP
-                ax.clear()
-                ax.grid(True)
-                iarr = max(0, i - 15)
-                ax.plot(range(iarr, i), diffArr[iarr:], 'k-')
-                # convergeP = ax.plot(range(i), diffArr, 'r-')
-                ax.autoscale(axis='y')
-                
-                convergePlot.canvas.draw()
-                convergePlot.canvas.flush_events()
-
-            if i % 10 == 0:
-                print("saving progress")
-                domain.DumpFile("save")
-
-            if i == 2:
-                break
-
-def CalcCell(domain: DomainMMAP | SparseDomain, row: int, col: int):
-    return [(row, col, calc_cell.Cell(domain, row, col))]
\ No newline at end of file
+        convergePlot, ax = ConvergencePlot("Max % Difference")
+
+    history = []
+    iteration = 0
+    diff = np.inf
+    state = ResumeCheckpoint(checkpoint, domain) if resume and checkpoint is not None else None
+    if state is not None:
+        temperature, pressure = network.Load(domain)
+    if state is not None and state["method"] == "direct":
+        iteration, diff, history = state["iteration"], state["temperatureChange"], state["history"]
+
+    controller = ConvergenceController(criteria, network)
+    while True:
+        print(f"Evaluating resistors {iteration + 1}")
+        network.Update(domain)
+
+        # imbalance of the last solution once its own resistors are used
+        record = controller.Measure(iteration, network, temperature, pressure, diff)
+        print(f"Residual L2: {record.residualL2:.4g} BTU/hr, Linf: {record.residualLinf:.4g} BTU/hr, relative: {record.relativeResidual:.3g}")
+        status = controller.Check(record)
+        if status is not None:
+            break
+
+        Told = temperature
+        temperature = network.SolveTemperature(temperature, linearSolver)
+        if multigrid:
+            print(f"Multigrid {linearSolver.krylov} iterations: {linearSolver.iterations}")
+        elif blocks:
+            print(f"Block GMRES iterations: {linearSolver.iterations}")
+        pressure = network.SolvePressure(pressure)
+        WriteBack(domain, network, temperature, pressure)
+        iteration += 1
+
+        diff = np.max(np.abs(temperature - Told)/Told, initial=0)
+        print(f"Max diff: {diff*100}%")
+        history.append(diff*100)
+        if convPlot:
+            UpdateConvergencePlot(convergePlot, ax, history)
+        if checkpoint is not None and iteration % checkpointEvery == 0:
+            WriteCheckpoint(checkpoint, domain, {"method": "direct", "iteration": iteration, "temperatureChange": diff, "history": history})
+
+    controller.Report(status)
+    if checkpoint is not None:
+        WriteCheckpoint(checkpoint, domain, {"method": "direct", "iteration": iteration, "temperatureChange": diff, "history": history, "status": status})
+    network.close()
+    if blocks:
+        linearSolver.close()
+    return history
+
+def AnalyzeMCTransient(domain: DomainMMAP, duration: float, snapshots: Sequence[float] = (), settings: TransientSettings | None = None,
+                       initialTemperature: float | None = None, output: str | None = "transient", MAX_CORES: int = mp.cpu_count() - 1):
+    # wall temperatures over a burn of duration seconds, starting from the temperatures in the domain (or every active
+    # cell at initialTemperature in degR). The temperature at every time in snapshots is kept in the result and written
+    # to the output mesh as it is reached, the domain ends up holding the field at duration. See cooling.transient
+    settings = TransientSettings() if settings is None else settings
+    network = ThermalNetwork(domain, MAX_CORES)
+    solver = TransientSolver(network, settings)
+    print(f"Stepping {network.size} active cells through {duration} s")
+    temperature, pressure = network.Load(domain)
+    if initialTemperature is not None:
+        temperature[:] = initialTemperature
+        WriteBack(domain, network, temperature, pressure)
+    isWall = ~network.isCoolant
+
+    result = TransientResult()
+    pending = sorted(s for s in snapshots if 0 <= s <= duration)
+    t = 0.0
+    dt = settings.dt
+    report = duration/10
+    previous, previousStep = None, None
+    calm = 0
+    while pending and pending[0] <= 0:
+        pending.pop(0)
+        Snapshot(result, domain, settings, output, 0.0, network.Grid(domain, "temperature", temperature))
+    while duration - t > 1e-9*duration:
+        step = min(dt, duration - t)
+        refreshed = solver.isStale(temperature)
+        if refreshed:
+            WriteBack(domain, network, temperature, pressure)
+            solver.Refresh(domain, temperature, step)
+            pressure = network.SolvePressure(pressure)
+        elif step != solver.dt:
+            solver.Resize(step)
+        Told = temperature
+        T = solver.Step(temperature)
+        # the kink new resistors put in the path is no truncation error, a step right after a refresh is not redone
+        error = LocalError(T, Told, previous, step/previousStep if previous is not None else 0)
+        if error > settings.tolerance and step > settings.dtMin and (not refreshed or previous is None):
+            dt = max(step/2, settings.dtMin)
+            calm = 0
+            continue
+
+        # snapshots inside the step are interpolated, the step size is never cut to land on them
+        while pending and pending[0] <= t + step:
+            snapshot = network.Grid(domain, "temperature", Told + (pending[0] - t)/step*(T - Told))
+            Snapshot(result, domain, settings, output, pending.pop(0), snapshot)
+        temperature = T
+        previous, previousStep = Told, step
+        t += step
+        result.history.append((t, step, np.max(T[isWall], initial=0)))
+        # doubling the step quadruples the error, so it is doubled after a few steps below a quarter of the tolerance.
+        # The step size only takes powers of two of the first one and the resistors are not refreshed for every change
+        calm = calm + 1 if error < settings.tolerance/4 else 0
+        if calm >= 3:
+            dt = min(2*dt, settings.dtMax)
+            calm = 0
+        if t >= report:
+            print(f"t = {t:.4g} s, dt = {step:.3g} s, hottest wall {result.history[-1][2]:.0f} degR")
+            report += duration/10
+
+    for last in pending: # the end of the run when the steps added up to a hair short of it
+        Snapshot(result, domain, settings, output, last, network.Grid(domain, "temperature", temperature))
+    WriteBack(domain, network, temperature, pressure)
+    network.close()
+    print(f"Reached {t:.4g} s in {len(result.history)} steps, {solver.refreshes} resistor updates and {solver.factorizations} factorizations, hottest wall {np.max(temperature[isWall]):.0f} degR")
+    return result
+
+def Snapshot(result: TransientResult, domain: DomainMMAP, settings: TransientSettings, output: str | None, time: float, temperature: np.ndarray):
+    result.times.append(time)
+    result.temperatures.append(temperature)
+    print(f"Snapshot at {time:.4g} s")
+    if output is not None:
+        WriteSnapshots(output, domain, result, settings)
+
+def Criteria(criteria: ConvergenceCriteria | None, tol: float | None, maxIterations: int, residual: bool = False):
+    # the old tol and iteration limit arguments stand in for whatever criteria leaves out. tol is the largest relative
+    # temperature change of an iteration, or the relative residual when residual is set
+    if criteria is None and residual:
+        return ConvergenceCriteria(temperatureChange=None, residual=SOR_RESIDUAL if tol is None else tol, maxIterations=maxIterations)
+    if criteria is None:
+        return ConvergenceCriteria(temperatureChange=CHANGE_TOL if tol is None else tol, maxIterations=maxIterations)
+    if criteria.maxIterations is None:
+        return replace(criteria, maxIterations=maxIterations)
+    return criteria
+
+def WriteBack(domain: DomainMMAP, network: ThermalNetwork, temperature: np.ndarray, pressure: np.ndarray):
+    # active cell temperatures and pressures into the domain, the rest of the grid is never written
+    domain.StageMEM(network.rows, network.cols, 'temperature', temperature)
+    domain.StageMEM(network.rows, network.cols, 'pressure', pressure)
+    written = domain.CommitMEM()
+    print(f"Wrote {written/1024:.1f} kB ({domain.bytesWritten/1024:.1f} kB total)")
+
+def ConvergencePlot(ylabel: str):
+    plt.ion()
+    convergePlot, ax = plt.subplots()
+    ax.set_title("Convergence")
+    ax.set_xlabel("Iteration")
+    ax.set_ylabel(ylabel)
+    ax.grid(True)
+    return convergePlot, ax
+
+def UpdateConvergencePlot(convergePlot, ax, history: list):
+    ax.clear()
+    ax.grid(True)
+    ax.semilogy(range(1, len(history) + 1), history, 'k-')
+    convergePlot.canvas.draw()
+    convergePlot.canvas.flush_events()
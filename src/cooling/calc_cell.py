@@ -1,20 +1,39 @@
 import numpy as np
 import pint
 
-from cooling import cooling2d, domain
+from cooling import cooling2d, domain, kernels
 from cooling.material import DomainMaterial, MaterialType
 import general.design as DESIGN
 from general.units import Direction, unitReg, Q_
 
+RESISTANCE_UNIT = unitReg.hour * unitReg.degR / unitReg.BTU
+# built once, comparing against a fresh Quantity per face cost more than the resistor itself
+R_MAX = Q_(kernels.R_MAX, RESISTANCE_UNIT)
+R_MIN = Q_(kernels.R_MIN, RESISTANCE_UNIT)
+R_ADIABATIC = Q_(kernels.R_ADIABATIC, RESISTANCE_UNIT)
+R_OPEN = Q_(1e10, RESISTANCE_UNIT)
+
 class ResistorSet:
-    R: list[pint.Quantity] = [Q_(0, unitReg.hour * unitReg.degR / unitReg.BTU) for _ in range(4)]
-    T: list[pint.Quantity] = [Q_(0, unitReg.degR) for _ in range(4)]
+    R: list[pint.Quantity]
+    T: list[pint.Quantity]
+
+    def __init__(self):
+        # per instance, a face left unset (domain edge) has to read as 0 and not as the last cell's value
+        self.R = [Q_(0, RESISTANCE_UNIT) for _ in range(4)]
+        self.T = [Q_(0, unitReg.degR) for _ in range(4)]
+
+    def isUsed(self, i: int):
+        return not (self.R[i] > R_MAX or self.R[i] <= R_MIN)
+
+    def getConductances(self):
+        # 1/R per face in BTU/(hr*degR), 0 for the faces getSums skips
+        return [1/self.R[i].to(RESISTANCE_UNIT).magnitude if self.isUsed(i) else 0.0 for i in range(4)]
 
     def getSums(self):
         TRsum = Q_(0, str((self.T[0]/self.R[0]).units))
         Rsum = Q_(0, str(1/self.R[0].units))
         for i in range(4):
-            if self.R[i] > Q_(2e8, unitReg.hour * unitReg.degR / unitReg.BTU) or self.R[i] <= Q_(2e-31, unitReg.hour * unitReg.degR / unitReg.BTU):
+            if not self.isUsed(i):
                 continue
             TRsum += self.T[i] / self.R[i]
             Rsum += 1/self.R[i]
@@ -28,7 +47,7 @@ class ResistorSet:
     def getQin(self, Tprev: pint.Quantity):
         Qsum = Q_(0, str((self.T[0]/self.R[0]).units))
         for i in range(4):
-            if self.R[i] > Q_(2e8, unitReg.hour * unitReg.degR / unitReg.BTU) or self.R[i] <= Q_(2e-31, unitReg.hour * unitReg.degR / unitReg.BTU):
+            if not self.isUsed(i):
                 continue
             Qsum += (self.T[i] - Tprev)/self.R[i]
         return Qsum
@@ -41,13 +60,14 @@ def getConductivity(domain: domain.DomainMMAP, row: int, col: int):
         return cooling2d.conduction_rp1(domain.temperature[row,col].to(unitReg.degR))
 
 def ConductionResistor(domain: domain.DomainMMAP, sink: tuple[int, int], source: tuple[int, int]): # sink is to, source is from
-    L = Q_(domain.xstep, unitReg.inch).to(unitReg.foot)
+    L = Q_(domain.xsteps[sink[1]], unitReg.inch).to(unitReg.foot)
     k = getConductivity(domain, sink[0], sink[1])
     if source[0] == sink[0]: # same row, horizontal conduction
         # conductionArea = (2 * np.pi * Q_(domain.r[sink], unitReg.inch).to(unitReg.foot) ) * Q_(domain.rstep, unitReg.inch).to(unitReg.foot)
-        ro = Q_(domain.r[sink] + domain.rstep/2, unitReg.inch).to(unitReg.foot)
-        ri = Q_(domain.r[sink] - domain.rstep/2, unitReg.inch).to(unitReg.foot)
+        ro = Q_(domain.r[sink] + domain.rsteps[sink[0]]/2, unitReg.inch).to(unitReg.foot)
+        ri = Q_(domain.r[sink] - domain.rsteps[sink[0]]/2, unitReg.inch).to(unitReg.foot)
         conductionArea = np.pi*np.abs(ro**2 - ri**2)
+        L = Q_((domain.xsteps[sink[1]] + domain.xsteps[source[1]])/2, unitReg.inch).to(unitReg.foot) # center to center
         return L / (conductionArea * k)
     elif source[1] == sink[1]: # same column, vertical conduction
         ri = Q_(min(domain.r[source], domain.r[sink]), unitReg.inch).to(unitReg.foot)
@@ -55,16 +75,18 @@ def ConductionResistor(domain: domain.DomainMMAP, sink: tuple[int, int], source:
         return np.log(ro / ri) / (2 * np.pi * L * k)
 
 def ConductionHalfResistor(domain: domain.DomainMMAP, sink: tuple[int, int], source: tuple[int, int], sinkSide: bool = True):
-    L = Q_(domain.xstep, unitReg.inch).to(unitReg.foot)
+    L = Q_(domain.xsteps[sink[1]], unitReg.inch).to(unitReg.foot)
     k = getConductivity(domain, sink[0], sink[1]) if sinkSide else getConductivity(domain, source[0], source[1])
     if source[0] == sink[0]: # same row, horizontal conduction
         # conductionArea = (2 * np.pi * Q_(domain.r[sink], unitReg.inch).to(unitReg.foot)) * Q_(domain.rstep, unitReg.inch).to(unitReg.foot)
-        ro = Q_(domain.r[sink] + domain.rstep/2, unitReg.inch).to(unitReg.foot)
-        ri = Q_(domain.r[sink] - domain.rstep/2, unitReg.inch).to(unitReg.foot)
+        ro = Q_(domain.r[sink] + domain.rsteps[sink[0]]/2, unitReg.inch).to(unitReg.foot)
+        ri = Q_(domain.r[sink] - domain.rsteps[sink[0]]/2, unitReg.inch).to(unitReg.foot)
         conductionArea = np.pi*np.abs(ro**2 - ri**2)
+        L = Q_(domain.xsteps[sink[1] if sinkSide else source[1]], unitReg.inch).to(unitReg.foot) # the half's own cell
         return (L / 2) / (conductionArea * k)
     elif source[1] == sink[1]: # same column, vertical conduction
-        rwall = (domain.r[sink] + domain.r[source]) / 2
+        # the face is the sink's edge towards the source
+        rwall = domain.r[sink] + (domain.rsteps[sink[0]]/2 if domain.r[source] > domain.r[sink] else -domain.rsteps[sink[0]]/2)
         ri = Q_(min(domain.r[source] if not sinkSide else rwall, domain.r[sink] if sinkSide else rwall), unitReg.inch).to(unitReg.foot)
         ro = Q_(max(domain.r[source] if not sinkSide else rwall, domain.r[sink] if sinkSide else rwall), unitReg.inch).to(unitReg.foot)
         return np.log(ro / ri) / (2 * np.pi * L * k)
@@ -82,15 +104,16 @@ def ConvectionHalfResistor(domain: domain.DomainMMAP, sink: tuple[int, int], sou
         # print(convectionCoeff, area)
         # print(domain.flowHeight[convectionCell])
     else:
-        convectionCoeff = cooling2d.combustion_convection(domain.temperature[convectionCell].to(unitReg.degR), domain.velocity[convectionCell].to(unitReg.foot/unitReg.second))
+        wallCell = source if sinkSide else sink
+        convectionCoeff = cooling2d.combustion_convection(domain.temperature[convectionCell].to(unitReg.degR), domain.velocity[convectionCell].to(unitReg.foot/unitReg.second), domain.temperature[wallCell].to(unitReg.degR), cooling2d.BartzEvaluator.ForDomain(domain))
         area = CombustionConvectionArea(domain, convectionCell[0], convectionCell[1], isHoriz, sinkTop, sinkSide)
     
     return 1 / (convectionCoeff * area)
 
 def CoolantConvectionArea(domain: domain.DomainMMAP, row: int, col: int, isHoriz: bool, sinkTop: bool, sinkSide: bool):
     wallPoint = (row, col)# if domain.material[row, col] in MaterialType.COOLANT_WALL else tuple(domain.previousFlow[row, col])
-    innerRadius = Q_(domain.r[wallPoint] - domain.rstep/2, unitReg.inch).to(unitReg.foot)
-    outerRadius = Q_(domain.r[wallPoint] + domain.rstep/2, unitReg.inch).to(unitReg.foot)
+    innerRadius = Q_(domain.r[wallPoint] - domain.rsteps[row]/2, unitReg.inch).to(unitReg.foot)
+    outerRadius = Q_(domain.r[wallPoint] + domain.rsteps[row]/2, unitReg.inch).to(unitReg.foot)
     landRadius = innerRadius
 
     theta = getCoolingArcAngle(landRadius)
@@ -98,17 +121,17 @@ def CoolantConvectionArea(domain: domain.DomainMMAP, row: int, col: int, isHoriz
         return (outerRadius**2 - innerRadius**2) * theta/2 * DESIGN.NumberofChannels
     else:
         outer = (sinkTop ^ sinkSide)               
-        xstep = Q_(domain.xstep, unitReg.inch).to(unitReg.foot)           
+        xstep = Q_(domain.xsteps[col], unitReg.inch).to(unitReg.foot)           
         return (2 * np.pi * outerRadius * theta * DESIGN.NumberofChannels) * xstep if outer else (2 * np.pi * innerRadius * theta * DESIGN.NumberofChannels) * xstep
 
 def CombustionConvectionArea(domain: domain.DomainMMAP, row: int, col: int, isHoriz: bool, sinkTop: bool, sinkSide: bool):
-    innerRadius = Q_(domain.r[row, col] - domain.rstep/2, unitReg.inch).to(unitReg.foot)
-    outerRadius = Q_(domain.r[row, col] + domain.rstep/2, unitReg.inch).to(unitReg.foot)
+    innerRadius = Q_(domain.r[row, col] - domain.rsteps[row]/2, unitReg.inch).to(unitReg.foot)
+    outerRadius = Q_(domain.r[row, col] + domain.rsteps[row]/2, unitReg.inch).to(unitReg.foot)
     if isHoriz:
         return np.pi * (outerRadius**2 - innerRadius**2)
     else:
         outer = (sinkTop ^ sinkSide)
-        xstep = Q_(domain.xstep, unitReg.inch).to(unitReg.foot)
+        xstep = Q_(domain.xsteps[col], unitReg.inch).to(unitReg.foot)
         return 2 * np.pi * outerRadius * xstep if outer else 2 * np.pi * innerRadius * xstep
     
 def getCoolingArcAngle(innerRadius: pint.Quantity):
@@ -137,55 +160,48 @@ def CalculateCoreResistors(domain: domain.DomainMMAP, row: int, col: int):
 
 def CombineResistors(resSet: ResistorSet):
     for i in range(4):
-        if resSet.R[i] > Q_(1e10, unitReg.hour * unitReg.degR / unitReg.BTU):
+        if resSet.R[i] > R_OPEN:
             resSet.T[i] = Q_(0, unitReg.degR)
-            resSet.R[i] = Q_(1, unitReg.hour * unitReg.degR / unitReg.BTU)
+            resSet.R[i] = Q_(1, RESISTANCE_UNIT)
     return resSet.getTnew()
 
-def GetResistor(domain: domain.DomainMMAP, sink: tuple[int, int], source: tuple[int, int]):
-    if domain.material[source] in MaterialType.SOLID:
-        sourceR = ConductionHalfResistor(domain, sink, source, False)
-        # print("half solid")
-    elif domain.material[source] in MaterialType.FLUID:
-        sourceR = ConvectionHalfResistor(domain, sink, source)
-        # print("half fluid")
-    elif domain.material[source] in MaterialType.ADIABATIC:
-        # print("half free")
-        sourceR = Q_(2e31, unitReg.hour * unitReg.degR / unitReg.BTU)
-    else:
-        raise ValueError("Material not recognized")
-    
-    if domain.material[sink] in MaterialType.SOLID:
-        sinkR = ConductionHalfResistor(domain, sink, source, True)
-        # print("half solid")
-    elif domain.material[sink] in MaterialType.FLUID:
-        sinkR = ConvectionHalfResistor(domain, sink, source)
-        # print("half fluid")
-    elif domain.material[sink] in MaterialType.ADIABATIC:
-        # print("half free")
-        sinkR = Q_(2e31, unitReg.hour * unitReg.degR / unitReg.BTU)
-    else:
-        raise ValueError("Material not recognized")
-    
+def HalfResistor(domain: domain.DomainMMAP, sink: tuple[int, int], source: tuple[int, int], halfMaterial: int, sinkSide: bool):
+    if halfMaterial in MaterialType.SOLID:
+        return ConductionHalfResistor(domain, sink, source, sinkSide)
+    elif halfMaterial in MaterialType.FLUID:
+        return ConvectionHalfResistor(domain, sink, source)
+    elif halfMaterial in MaterialType.ADIABATIC:
+        return R_ADIABATIC
+    raise ValueError("Material not recognized")
+
+def GetResistor(domain: domain.DomainMMAP, sink: tuple[int, int], source: tuple[int, int], sinkMaterial: int | None = None, sourceMaterial: int | None = None):
+    # callers that already hold the materials (the per face codes from AssignBorders) pass them in to skip the lookups
+    sourceMaterial = domain.material[source] if sourceMaterial is None else sourceMaterial
+    sinkMaterial = domain.material[sink] if sinkMaterial is None else sinkMaterial
+
+    sourceR = HalfResistor(domain, sink, source, sourceMaterial, False)
+    sinkR = HalfResistor(domain, sink, source, sinkMaterial, True)
     return sourceR + sinkR
 
 def CalculateBorderResistors(domain: domain.DomainMMAP, row: int, col: int):
     resSet = ResistorSet()
+    sinkMaterial = domain.material[row, col]
+    faces = domain.faceMaterial[row, col]
 
     if col > 0: # left
-        resSet.R[Direction.LEFT] = GetResistor(domain, (row, col), (row, col-1))
+        resSet.R[Direction.LEFT] = GetResistor(domain, (row, col), (row, col-1), sinkMaterial, faces[Direction.LEFT])
         resSet.T[Direction.LEFT] = domain.temperature[row, col-1]
 
     if row > 0: # upper
-        resSet.R[Direction.UPPER] = GetResistor(domain, (row, col), (row-1, col))
+        resSet.R[Direction.UPPER] = GetResistor(domain, (row, col), (row-1, col), sinkMaterial, faces[Direction.UPPER])
         resSet.T[Direction.UPPER] = domain.temperature[row-1, col]
 
     if row < domain.vpoints - 1: # bottom
-        resSet.R[Direction.LOWER] = GetResistor(domain, (row, col), (row+1, col))
+        resSet.R[Direction.LOWER] = GetResistor(domain, (row, col), (row+1, col), sinkMaterial, faces[Direction.LOWER])
         resSet.T[Direction.LOWER] = domain.temperature[row+1, col]
 
     if col < domain.hpoints - 1: # right
-        resSet.R[Direction.RIGHT] = GetResistor(domain, (row, col), (row, col+1))
+        resSet.R[Direction.RIGHT] = GetResistor(domain, (row, col), (row, col+1), sinkMaterial, faces[Direction.RIGHT])
         resSet.T[Direction.RIGHT] = domain.temperature[row, col+1]
 
     # print(resSet.R, resSet.T)
@@ -206,7 +222,7 @@ def CalculateCell(domain: domain.DomainMMAP, row: int, col: int):
     if domain.material[row,col] in MaterialType.STATIC_TEMP:
         return domain.temperature[row,col]
     
-    if domain.r[row,col] - domain.rstep/2 <= 0:
+    if domain.r[row,col] - domain.rsteps[row]/2 <= 0:
         return domain.temperature[row,col]
     
     if domain.material[row,col] in MaterialType.WALL:
@@ -221,6 +237,28 @@ def CalculateCell(domain: domain.DomainMMAP, row: int, col: int):
         return CalculateCoolant(domain, row, col)
     raise ValueError("Material not recognized")
 
+def isFixed(domain: domain.DomainMMAP, row: int, col: int):
+    return domain.material[row,col] in MaterialType.STATIC_TEMP or domain.r[row,col] - domain.rsteps[row]/2 <= 0
+
+def CellCoefficients(domain: domain.DomainMMAP, row: int, col: int):
+    # CalculateCell written as a linear equation in the neighbor temperatures, with the resistors frozen at the current
+    # state: face conductances in Direction order, the coolant mdot*cp tying a wall coolant cell to its upstream cell and
+    # the coolant pressure drop. Units are BTU/(hr*degR) and psi
+    mat = domain.material[row,col]
+    if mat == DomainMaterial.COOLANT_BULK:
+        return [0.0]*4, 0.0, 0.0
+
+    if mat in MaterialType.WALL and not domain.border[row,col]:
+        return CalculateCoreResistors(domain, row, col).getConductances(), 0.0, 0.0
+    resSet = CalculateBorderResistors(domain, row, col)
+    if mat in MaterialType.WALL:
+        return resSet.getConductances(), 0.0, 0.0
+
+    previousFlow = tuple(domain.previousFlow[row, col])
+    deltaL = Q_(np.sqrt((domain.x[row, col] - domain.x[previousFlow])**2 + (domain.r[row, col] - domain.r[previousFlow])**2), unitReg.inch).to(unitReg.foot)
+    capacityRate, DeltaP = cooling2d.coolant_flow_terms(domain.temperature[row, col], domain.pressure[row, col], domain.area[row, col], domain.hydraulicDiameter[row, col], deltaL)
+    return resSet.getConductances(), capacityRate.magnitude, float(np.squeeze(DeltaP.to(unitReg.psi).magnitude))
+
 def Cell(d: domain.DomainMMAP, row: int, col: int):
     out = CalculateCell(d, row, col)
     if isinstance(out, tuple):
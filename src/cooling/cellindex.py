@@ -0,0 +1,110 @@
+import bisect
+import math
+import numpy as np
+
+from cooling.grading import CellEdges
+from general.units import Direction
+
+# Point location, segment traversal and face neighbors over the cells of a domain. Meshes are tensor products, uniform
+# or graded (see grading), so the cell tree factors into one sorted array of cell edges per axis: a point is found
+# with one bisection per axis, a segment is cut at every grid line it crosses and each piece lies in one cell, and the
+# neighbor across a face is one row or column over. Uniform axes skip the bisection and divide, which is what
+# CoordsToCell always did, rounding down so the cell before the first is off the mesh too.
+
+# (row, col) step to the neighbor across each face, indexed by Direction
+FACE_OFFSETS = np.zeros((4, 2), dtype=int)
+FACE_OFFSETS[Direction.LEFT] = (0, -1)
+FACE_OFFSETS[Direction.UPPER] = (-1, 0)
+FACE_OFFSETS[Direction.LOWER] = (1, 0)
+FACE_OFFSETS[Direction.RIGHT] = (0, 1)
+
+CORNER_TOL = 1e-9 # fraction of a segment under which a row and a column crossing are the same corner
+
+class AxisIndex:
+    # cells along one axis, the first centered on first. Rows run towards smaller r, so that axis is kept as -r and
+    # every position is multiplied by sign on the way in
+    def __init__(self, first: float, steps: np.ndarray, sign: int = 1):
+        steps = np.asarray(steps, dtype=float)
+        self.sign = sign
+        self.size = steps.size
+        self.start = sign*first
+        self.edges = CellEdges(self.start, steps)
+        self.edgeList = self.edges.tolist()
+        self.step = float(steps[0]) if np.ptp(steps) == 0 else None
+
+    def Locate(self, position: float) -> int:
+        # cell index of a position, out of range (below 0 or at size and past) off the mesh
+        p = self.sign*position
+        if self.step is not None:
+            return math.floor((p - self.start + self.step/2)/self.step)
+        return bisect.bisect_right(self.edgeList, p) - 1
+
+    def LocateArray(self, positions: np.ndarray) -> np.ndarray:
+        p = self.sign*np.asarray(positions, dtype=float)
+        if self.step is not None:
+            return np.floor((p - self.start + self.step/2)/self.step).astype(np.int64)
+        return np.searchsorted(self.edges, p, side='right') - 1
+
+    def Crossings(self, a: float, b: float) -> np.ndarray:
+        # fraction along a to b at which every cell edge strictly between them is crossed
+        a, b = self.sign*a, self.sign*b
+        if a == b:
+            return np.zeros(0)
+        lo, hi = min(a, b), max(a, b)
+        edges = self.edges[bisect.bisect_right(self.edgeList, lo):bisect.bisect_left(self.edgeList, hi)]
+        return (edges - a)/(b - a)
+
+    def Bounds(self, index: int) -> tuple[float, float]:
+        lo, hi = self.sign*self.edgeList[index], self.sign*self.edgeList[index + 1]
+        return min(lo, hi), max(lo, hi)
+
+class CellIndex:
+    def __init__(self, x0: float, xsteps: np.ndarray, r0: float, rsteps: np.ndarray):
+        self.cols = AxisIndex(x0, xsteps)
+        self.rows = AxisIndex(r0, rsteps, sign=-1)
+        self.shape = (self.rows.size, self.cols.size)
+
+    def Locate(self, x: float, r: float) -> tuple[int, int]:
+        return (self.rows.Locate(r), self.cols.Locate(x))
+
+    def LocateArray(self, x: np.ndarray, r: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return self.rows.LocateArray(r), self.cols.LocateArray(x)
+
+    def OnMesh(self, rows, cols):
+        return (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+
+    def Box(self, row: int, col: int) -> tuple[float, float, float, float]:
+        # xmin, xmax, rmin, rmax of a cell
+        return (*self.cols.Bounds(col), *self.rows.Bounds(row))
+
+    def Contains(self, point: tuple[float, float], row: int, col: int) -> bool:
+        # edges count as inside, like isInCell did
+        xmin, xmax, rmin, rmax = self.Box(row, col)
+        return xmin <= point[0] <= xmax and rmin <= point[1] <= rmax
+
+    def Traverse(self, point1: tuple[float, float], point2: tuple[float, float]) -> list[tuple[int, int]]:
+        # every cell the segment passes through, in order from point1, each once. Pieces off the mesh are dropped.
+        # The end points are located like Locate does, an end on a cell edge also brings in the cell Locate puts it in.
+        # Crossings closer than CORNER_TOL are merged, a segment through a corner would otherwise pick up a cell beside
+        # it on the rounding of the edges
+        (x1, r1), (x2, r2) = point1, point2
+        crossings = np.sort(np.concatenate([self.cols.Crossings(x1, x2), self.rows.Crossings(r1, r2)]))
+        crossings = crossings[(np.diff(crossings, prepend=0.0) > CORNER_TOL) & (crossings < 1 - CORNER_TOL)]
+        t = np.concatenate([[0.0], crossings, [1.0]])
+        t = np.concatenate([[0.0], (t[:-1] + t[1:])/2, [1.0]])
+        rows, cols = self.LocateArray(x1 + t*(x2 - x1), r1 + t*(r2 - r1))
+        new = np.ones(t.size, dtype=bool)
+        new[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        keep = new & self.OnMesh(rows, cols)
+        return list(zip(rows[keep].tolist(), cols[keep].tolist()))
+
+    def Neighbor(self, row: int, col: int, direction: Direction) -> tuple[int, int] | None:
+        # the cell across one face, None on the mesh boundary
+        nRow, nCol = row + FACE_OFFSETS[direction, 0], col + FACE_OFFSETS[direction, 1]
+        return (int(nRow), int(nCol)) if self.OnMesh(nRow, nCol) else None
+
+    def NeighborTable(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        # flat grid index of the neighbor across every face of the cells in Direction order, -1 off the mesh
+        nRows = rows[:, np.newaxis] + FACE_OFFSETS[:, 0]
+        nCols = cols[:, np.newaxis] + FACE_OFFSETS[:, 1]
+        return np.where(self.OnMesh(nRows, nCols), nRows*self.shape[1] + nCols, -1)
@@ -0,0 +1,137 @@
+from dataclasses import dataclass
+import hashlib
+import time
+import numpy as np
+
+from cooling import mesh_file
+from cooling.domain import DomainMMAP
+from cooling.network import ThermalNetwork
+
+# When to stop the nonlinear iteration of AnalyzeMC. Every criterion left as None is not checked, the run converges
+# once all the others hold with the resistors evaluated at the state they are checked on, or stops when it runs out of
+# iterations or wall clock time.
+#
+# Checkpoints go to a mesh directory. The first one writes the whole mesh, later ones only swap in the temperature and
+# pressure fields and the iteration state under the "checkpoint" header metadata, so resuming a killed run costs two
+# field reads.
+
+@dataclass
+class ConvergenceCriteria:
+    temperatureChange: float | None = 1e-2 # largest relative temperature change of an iteration
+    residual: float | None = None # energy imbalance L2 over the L2 of the heat passing through the cells
+    outletTemperature: float | None = None # largest relative change of a coolant outlet temperature
+    outletPressure: float | None = None # largest change of a coolant outlet pressure, psi
+    maxIterations: int | None = None
+    wallClock: float | None = None # seconds
+
+@dataclass
+class ConvergenceRecord:
+    iteration: int
+    residualL2: float
+    residualLinf: float
+    relativeResidual: float
+    temperatureChange: float
+    outletTemperature: np.ndarray
+    outletPressure: np.ndarray
+    outletTemperatureChange: float = np.inf
+    outletPressureChange: float = np.inf
+
+class ConvergenceController:
+    def __init__(self, criteria: ConvergenceCriteria, network: ThermalNetwork):
+        self.criteria = criteria
+        self.outlets = network.circuits.Outlets()
+        self.records: list[ConvergenceRecord] = []
+        self.start = time.perf_counter()
+
+    def Elapsed(self):
+        return time.perf_counter() - self.start
+
+    def Measure(self, iteration: int, network: ThermalNetwork, temperature: np.ndarray, pressure: np.ndarray, temperatureChange: float):
+        # temperature and pressure of the active cells
+        residual = network.Residual(temperature)
+        residualL2 = np.linalg.norm(residual)
+        heatFlow = np.linalg.norm(network.HeatFlow(temperature))
+        record = ConvergenceRecord(iteration, residualL2, np.max(np.abs(residual), initial=0), residualL2/heatFlow if heatFlow > 0 else 0.0,
+                                   temperatureChange, temperature[self.outlets].copy(), pressure[self.outlets].copy())
+        if self.records:
+            last = self.records[-1]
+            record.outletTemperatureChange = np.max(np.abs(record.outletTemperature - last.outletTemperature)/last.outletTemperature, initial=0)
+            record.outletPressureChange = np.max(np.abs(record.outletPressure - last.outletPressure), initial=0)
+        self.records.append(record)
+        return record
+
+    def Unmet(self, record: ConvergenceRecord):
+        # names of the criteria the record does not satisfy yet
+        criteria = self.criteria
+        checks = {
+            "temperature change": (record.temperatureChange, criteria.temperatureChange),
+            "residual": (record.relativeResidual, criteria.residual),
+            "outlet temperature": (record.outletTemperatureChange, criteria.outletTemperature),
+            "outlet pressure": (record.outletPressureChange, criteria.outletPressure),
+        }
+        return [name for name, (value, tol) in checks.items() if tol is not None and not value <= tol]
+
+    def Satisfied(self, record: ConvergenceRecord):
+        return not self.Unmet(record)
+
+    def Check(self, record: ConvergenceRecord, current: bool = True):
+        # 'converged', 'iterations' or 'wall clock' once the run should stop, None to keep going. current says the
+        # resistors were evaluated at the state the record measured, only then does meeting the criteria count
+        if current and self.Satisfied(record):
+            return "converged"
+        if self.criteria.maxIterations is not None and record.iteration >= self.criteria.maxIterations:
+            return "iterations"
+        if self.criteria.wallClock is not None and self.Elapsed() >= self.criteria.wallClock:
+            return "wall clock"
+        return None
+
+    def Report(self, status: str):
+        record = self.records[-1] if self.records else None
+        if status == "converged":
+            print(f"Converged in {record.iteration} iterations, {self.Elapsed():.1f} s")
+        elif record is None:
+            print(f"Stopped on {status} before the first iteration")
+        else:
+            print(f"Stopped on {status} after {record.iteration} iterations, {self.Elapsed():.1f} s, not met: {', '.join(self.Unmet(record))}")
+
+def MeshFingerprint(domain: DomainMMAP):
+    # identifies the mesh a checkpoint was taken on, the shape, cell sizes, material layout and flow directions
+    grid = domain.grid
+    digest = hashlib.sha1(repr((grid.shape, domain.x0, domain.r0, domain.width, domain.height)).encode())
+    for array in (grid.material, grid.previousFlow, domain.xsteps, domain.rsteps):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+def CheckpointState(path: str, domain: DomainMMAP):
+    # iteration state of the checkpoint at path when it was taken on this mesh, otherwise None
+    path = mesh_file.MeshPath(path)
+    if not mesh_file.isMesh(path):
+        return None
+    state = mesh_file.ReadHeader(path).get("metadata", {}).get("checkpoint")
+    if state is None or state.get("mesh") != MeshFingerprint(domain):
+        return None
+    return state
+
+def WriteCheckpoint(path: str, domain: DomainMMAP, state: dict):
+    # the temperature and pressure fields the domain holds, write the solution back first
+    path = mesh_file.MeshPath(path)
+    fingerprint = MeshFingerprint(domain)
+    if CheckpointState(path, domain) is None:
+        print(f"Writing checkpoint mesh {path}")
+        domain.toDomain().DumpFile(path)
+    mesh_file.UpdateMesh(path, {"temperature": domain.memmaps["temperature"], "pressure": domain.memmaps["pressure"]},
+                         {"checkpoint": dict(state, mesh=fingerprint, time=time.time())})
+
+def ResumeCheckpoint(path: str, domain: DomainMMAP):
+    # loads the checkpointed temperature and pressure into the domain, returns the iteration state or None when there
+    # is no checkpoint of this mesh at path
+    state = CheckpointState(path, domain)
+    if state is None:
+        print(f"No checkpoint of this mesh at {mesh_file.MeshPath(path)}, starting from the domain")
+        return None
+    grid, _, _ = mesh_file.ReadMesh(mesh_file.MeshPath(path), 'r')
+    domain.memmaps["temperature"][:] = grid.fields["temperature"]
+    domain.memmaps["pressure"][:] = grid.fields["pressure"]
+    domain.FlushMEM()
+    print(f"Resuming from checkpoint at iteration {state['iteration']}")
+    return state
@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+import numpy as np
+
+from cooling.material import DomainMaterial
+
+# Coolant cells only depend on their upstream previousFlow cell and the walls around them, so a circuit can be solved in
+# one pass from its COOLANT_INLET down the channel. Cells are grouped by their distance from the inlet, every cell of
+# a group only needs the groups before it, so each group is updated at once.
+
+class CoolantCircuits:
+    def __init__(self, network):
+        # network is the ThermalNetwork the coolant cells belong to, cells are held as its active cell indices
+        coolant = np.nonzero(network.isCoolant)[0]
+        upstream = network.upstream[coolant]
+        parent = np.where(upstream < network.size, upstream, -1)
+        position = np.full(network.size, -1)
+        position[coolant] = np.arange(coolant.size)
+
+        depth = np.where(parent < 0, 1, 0) # cells fed by a fixed cell (the inlet) start a circuit
+        root = np.where(parent < 0, network.slotFlat[upstream], -1)
+        parentPos = np.where(parent >= 0, position[np.maximum(parent, 0)], -1)
+        if np.any((parent >= 0) & (parentPos < 0)):
+            raise ValueError("Coolant cell flows from a cell that is not coolant")
+
+        while np.any(depth == 0):
+            ready = (depth == 0) & (depth[parentPos] > 0)
+            if not np.any(ready):
+                raise ValueError("previousFlow of the coolant cells forms a loop")
+            depth[ready] = depth[parentPos[ready]] + 1
+            root[ready] = root[parentPos[ready]]
+
+        order = np.argsort(depth, kind='stable')
+        self.cells = coolant[order]
+        self.depth = depth[order]
+        self.inlet = root[order] # flat grid index of the inlet each cell is fed from
+        self.bounds = np.searchsorted(self.depth, np.arange(1, self.depth.max(initial=0) + 2))
+
+    def Levels(self):
+        for start, stop in zip(self.bounds[:-1], self.bounds[1:]):
+            yield self.cells[start:stop]
+
+    def Circuits(self):
+        # active cell indices of every circuit in flow order, keyed by the flat grid index of its inlet
+        return {int(inlet): self.cells[self.inlet == inlet] for inlet in np.unique(self.inlet)}
+
+    def Outlets(self):
+        # active cell index of the last cell of every circuit, in the order of Circuits
+        inlets, last = np.unique(self.inlet[::-1], return_index=True)
+        return self.cells[self.cells.size - 1 - last]
+
+    def March(self, network, T: np.ndarray, P: np.ndarray):
+        # heatcoolant energy balance and pressure drop in flow order with the network's current resistors, in place on
+        # the state vectors of ThermalNetwork.State
+        for cells in self.Levels():
+            bulk = network.isBulk[cells]
+            wall = cells[~bulk]
+            upstream = network.upstream[wall]
+            G = network.G[wall]
+            capacityRate = network.capacityRate[wall]
+            TG = (G * T[network.neighbors[wall]]).sum(axis=1)
+            T[wall] = (TG + capacityRate * T[upstream]) / (G.sum(axis=1) + capacityRate)
+            P[wall] = P[upstream] - network.pressureDrop[wall]
+
+            bulk = cells[bulk]
+            T[bulk] = T[network.upstream[bulk]]
+            P[bulk] = P[network.upstream[bulk]]
+
+@dataclass
+class FlowPath:
+    # one coolant circuit as laid down by AssignCoolantFlow. Wall cells are in flow order, the bulk cells riding on wall
+    # cell i are bulkCells[bulkStart[i]:bulkStart[i+1]]. Lengths in inch, areas in inch**2 like the grid
+    upperWall: bool
+    wallCells: np.ndarray
+    bulkStart: np.ndarray
+    bulkCells: np.ndarray
+    arcLength: np.ndarray
+    hydraulicDiameter: np.ndarray
+    area: np.ndarray
+
+    ARRAYS = ("wallCells", "bulkStart", "bulkCells", "arcLength", "hydraulicDiameter", "area")
+
+    @staticmethod
+    def FromGrid(grid, wallCells: list[tuple[int, int]], upperWall: bool):
+        wallCells = np.array(list(dict.fromkeys(wallCells)), dtype=np.int32).reshape(-1, 2)
+        rows, cols = wallCells[:, 0], wallCells[:, 1]
+        steps = np.hypot(np.diff(grid.x[rows, cols]), np.diff(grid.r[rows, cols]))
+        arcLength = np.concatenate([[0], np.cumsum(steps)])
+
+        position = np.full(grid.shape, -1, dtype=np.int64)
+        position[rows, cols] = np.arange(rows.size)
+        bulkRows, bulkCols = np.nonzero(grid.material == DomainMaterial.COOLANT_BULK)
+        upstream = grid.previousFlow[bulkRows, bulkCols]
+        wallOf = position[upstream[:, 0], upstream[:, 1]]
+        onPath = wallOf >= 0
+        order = np.argsort(wallOf[onPath], kind='stable')
+        bulkCells = np.stack([bulkRows[onPath], bulkCols[onPath]], axis=1)[order].astype(np.int32)
+        bulkStart = np.searchsorted(wallOf[onPath][order], np.arange(rows.size + 1))
+
+        return FlowPath(upperWall, wallCells, bulkStart, bulkCells, arcLength, grid.hydraulicDiameter[rows, cols].copy(), grid.area[rows, cols].copy())
+
+    def Bulk(self, i: int):
+        return self.bulkCells[self.bulkStart[i]:self.bulkStart[i + 1]]
+
+    def SameCircuit(self, other: "FlowPath"):
+        # other is this circuit laid down again, on the same wall from the same inlet cell or through the same wall cells
+        if self.upperWall != other.upperWall or len(self.wallCells) == 0 or len(other.wallCells) == 0:
+            return False
+        if np.array_equal(self.wallCells[0], other.wallCells[0]):
+            return True
+        return not set(map(tuple, self.wallCells.tolist())).isdisjoint(map(tuple, other.wallCells.tolist()))
+
+    def Profile(self, field: np.ndarray):
+        # values of a grid field along the wall cells, e.g. pressure against arcLength for the pressure drop
+        return field[self.wallCells[:, 0], self.wallCells[:, 1]]
+
+    def ToArrays(self, prefix: str):
+        return {f"{prefix}.{name}": getattr(self, name) for name in self.ARRAYS}
+
+    @staticmethod
+    def FromArrays(arrays: dict[str, np.ndarray], prefix: str, upperWall: bool):
+        return FlowPath(upperWall, *(np.asarray(arrays[f"{prefix}.{name}"]) for name in FlowPath.ARRAYS))
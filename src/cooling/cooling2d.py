@@ -1,7 +1,8 @@
+from functools import lru_cache
 import numpy as np
-from scipy.optimize import fsolve
 
 from fluids.fluid import get_fluid_properties
+from fluids import friction
 from general.units import Q_, unitReg
 import general.design as DESIGN
 from general.design import exhaustGas
@@ -36,25 +37,30 @@ mdotperchannel = Fuel_Total / NumberofChannels
 # @unitReg.wraps((unitReg.degR, unitReg.psi), (unitReg.degR, unitReg.degR, None, unitReg.psi, unitReg.psi, unitReg.inch**2, unitReg.inch, unitReg.inch))
 def heatcoolant(Tprev, Tcell, resSet, Pprev, Pcell, channelArea, channelHydroD, DeltaL):
     TRsum, Rsum = resSet.getSums()
-    (mu, cp, _, _, rho, _, _, _, _) = get_fluid_properties(fuelname, Tcell, Pcell)
-    A_c = channelArea # Cooling channel cross-sectional area, height should be variable in the future
-    D_h = channelHydroD   # Hydraulic diameter
-    Re_D = mdotperchannel*D_h/mu/A_c    # Reynolds number
-    DeltaL = Q_(DeltaL, unitReg.inch)   # Step size
-
-    f_func = lambda f: -2*np.log10(epsilon/D_h/3.7 + 2.51/(Re_D*np.sqrt(f))) - 1/np.sqrt(f)
-    f = fsolve(f_func, 0.05)    # Darcy friction factor
-    DeltaP = (f*DeltaL/D_h*rho*(mdotperchannel/rho/A_c)**2/2).to(unitReg.psi)   # Pressure drop
+    capacityRate, DeltaP = coolant_flow_terms(Tcell, Pcell, channelArea, channelHydroD, DeltaL)
 
     Tprev = Tprev.to(unitReg.degR)
     Pcell = Pcell.to(unitReg.psi)
     Pprev = Pprev.to(unitReg.psi)
 
-    Tnew = ((TRsum + Tprev*mdotperchannel*cp)/(mdotperchannel*cp + Rsum)).to(unitReg.degR)
+    Tnew = ((TRsum + Tprev*capacityRate)/(capacityRate + Rsum)).to(unitReg.degR)
     Pnew = Pprev - DeltaP
 
     return Tnew, Pnew
 
+def coolant_flow_terms(Tcell, Pcell, channelArea, channelHydroD, DeltaL):
+    # mdot*cp carried from the upstream cell and the pressure drop over DeltaL, properties at the cell state
+    (mu, cp, _, _, rho, _, _, _, _) = get_fluid_properties(fuelname, Tcell, Pcell)
+    A_c = channelArea # Cooling channel cross-sectional area, height should be variable in the future
+    D_h = channelHydroD   # Hydraulic diameter
+    Re_D = mdotperchannel*D_h/mu/A_c    # Reynolds number
+    DeltaL = Q_(DeltaL, unitReg.inch)   # Step size
+
+    f = friction.DarcyFrictionScalar(Re_D.to('dimensionless').magnitude, (epsilon/D_h).to('dimensionless').magnitude)    # Darcy friction factor
+    DeltaP = (f*DeltaL/D_h*rho*(mdotperchannel/rho/A_c)**2/2).to(unitReg.psi)   # Pressure drop
+
+    return (mdotperchannel*cp).to(unitReg.BTU / unitReg.hour / unitReg.degR), DeltaP
+
 
 
 
@@ -91,51 +97,69 @@ def calculate_nozzle_area(A_star, M, gamma):
     A = A_star * ((gamma + 1) / 2) ** (- (gamma + 1) / (2 * (gamma - 1))) * (1 + (gamma - 1) / 2 * M**2) ** ((gamma + 1) / (2 * (gamma - 1))) * (1 / M)
     return A
 
-
-
-def combustion_convection(Node_Temp, Velocity):
-    Node_Temp = Q_(Node_Temp.magnitude, unitReg.degR)
-    Velocity = Q_(Velocity.magnitude, unitReg.foot / unitReg.second)
-    gamma = exhaustGas.SimpleHarmonicGamma(Node_Temp).g
-    Temp = temperature_stagnation.to(unitReg.degR)
-    sonic_velocity = np.sqrt((gamma * R_gas * Node_Temp)).to(unitReg.foot / unitReg.second)
-    Mach = Velocity / sonic_velocity
-
-    # Define constants and convert variables with units
-    mu = viscosity_stagnation.to(unitReg.pound / (unitReg.foot * unitReg.second))  # Dynamic viscosity at stagnation conditions
-    c_p = specific_heat_stagnation.to(unitReg.BTU / (unitReg.pound * unitReg.degR))  # Specific heat at stagnation conditions
-    Pr = Prandtl_stagnation  # Prandtl number (dimensionless)
-    P_0 = pressure_stagnation.to(unitReg.pound_force / unitReg.ft**2)  # Convert pressure to lbf/ft²
-    c_star = cstar.to(unitReg.foot / unitReg.second)  # Characteristic velocity in ft/s
-    A_star = DESIGN.chokeArea.to(unitReg.ft**2)  # Convert throat area to ft²
-
-    #TODO make this section use the actual R_e and R_t
-    R_E = Q_(3.5, unitReg.inch).to(unitReg.ft)  # Convert to feet
-    R_T = Q_(3.0, unitReg.inch).to(unitReg.ft)  # Convert to feet
-    P_T = 2 * np.pi * (R_T + R_E)  # Perimeter in feet
-    D_star = (4 * A_star / P_T).to(unitReg.ft)  # Throat diameter as hydraulic diameter in feet
-
-    # Calculate the nozzle area at the location of interest and convert to ft²
-    A = calculate_nozzle_area(A_star, Mach, gamma).to(unitReg.ft**2)
-    r_c = Q_(0.1, unitReg.inch).to(unitReg.ft)  # Throat radius of curvature in feet#TODO make it way more accurate
-
-    # Local wall and gas stagnation temperatures
-    T_wg = Node_Temp.to(unitReg.degR)  # Hot side wall temperature
-    T_0g = Temp  # Hot gas stagnation temperature
-    omega = 0.6  # for diatomic gases
-
-    # Calculate sigma correction factor
-    sigma = 1 / ((0.5 * T_wg / T_0g * (1 + (gamma - 1) / 2 * Mach**2) + 0.5)**(0.8 - 0.2 * omega) *
-                 (1 + (gamma - 1) / 2 * Mach**2)**(0.2 * omega))
-
-    g_c = Q_(32.174, unitReg.pound * unitReg.ft / (unitReg.pound_force * unitReg.s**2))  # Gravity constant to convert lbf to lbm
-
-    h_g = (0.026 / D_star**0.2 * mu**0.2 / Pr**0.6 * c_p * (P_0 / (c_star * g_c))**0.8 *
-           (D_star / r_c)**0.1 * (A_star / A)**0.9 * sigma)
-
-    # Return h_g in the desired heat transfer coefficient units
-    return h_g.to(unitReg.BTU / (unitReg.foot**2) / unitReg.hour / unitReg.degR)
-
+# Bartz hot gas film coefficient
+GAS_R = R_gas.to(unitReg.foot**2 / unitReg.second**2 / unitReg.degR).magnitude
+GAS_STAG_TEMP = temperature_stagnation.to(unitReg.degR).magnitude
+LEGACY_RADII = (3.0, 3.5) # inch, throat and lip radius assumed before meshes carried the nozzle's
+
+class BartzEvaluator:
+    def __init__(self, radiusThroat: Q_, radiusLip: Q_, throatCurvature: Q_ = Q_(0.1, unitReg.inch)):
+        # every term that only depends on the design, built once with units
+        mu = viscosity_stagnation.to(unitReg.pound / (unitReg.foot * unitReg.second))
+        c_p = specific_heat_stagnation.to(unitReg.BTU / (unitReg.pound * unitReg.degR))
+        Pr = Prandtl_stagnation
+        P_0 = pressure_stagnation.to(unitReg.pound_force / unitReg.ft**2)
+        c_star = cstar.to(unitReg.foot / unitReg.second)
+        A_star = DESIGN.chokeArea.to(unitReg.ft**2)
+        P_T = 2 * np.pi * (radiusThroat + radiusLip)
+        D_star = (4 * A_star / P_T).to(unitReg.ft) # annular throat as a hydraulic diameter
+        r_c = throatCurvature.to(unitReg.ft)
+        g_c = Q_(32.174, unitReg.pound * unitReg.ft / (unitReg.pound_force * unitReg.s**2))
+        group = 0.026 / D_star**0.2 * mu**0.2 / Pr**0.6 * c_p * (P_0 / (c_star * g_c))**0.8 * (D_star / r_c)**0.1
+        self.radiusThroat = radiusThroat.to(unitReg.inch).magnitude
+        self.radiusLip = radiusLip.to(unitReg.inch).magnitude
+        self.group = group.to(unitReg.BTU / (unitReg.foot**2) / unitReg.hour / unitReg.degR).magnitude
+
+    @staticmethod
+    def FromNozzle(outputData: dict):
+        return BartzFor(outputData["radiusThroat"].to(unitReg.inch).magnitude, outputData["radiusLip"].to(unitReg.inch).magnitude)
+
+    @staticmethod
+    def ForDomain(domain):
+        nozzle = getattr(domain, 'nozzle', {})
+        if "radiusThroat" not in nozzle:
+            return LegacyBartz()
+        return BartzFor(nozzle["radiusThroat"], nozzle["radiusLip"])
+
+    def __call__(self, wallTemperature, velocity, gasTemperature):
+        # h_g in BTU/(ft**2 hr degR) for arrays of hot wall temperature and local gas temperature in degR and gas
+        # velocity in ft/s. The gas temperature sets gamma and the Mach number, the wall temperature the sigma correction
+        Tw = np.asarray(wallTemperature, dtype=float)
+        Tg = np.asarray(gasTemperature, dtype=float)
+        gamma = DESIGN.exhaustGas.HarmonicGammaArray(Tg)
+        Mach = velocity / np.sqrt(gamma*GAS_R*Tg)
+        stretch = 1 + (gamma - 1)/2*Mach**2
+        areaRatio = Mach * ((gamma + 1)/2)**((gamma + 1)/(2*(gamma - 1))) * stretch**(-(gamma + 1)/(2*(gamma - 1))) # A*/A
+        omega = 0.6 # for diatomic gases
+        sigma = 1 / ((0.5*Tw/GAS_STAG_TEMP*stretch + 0.5)**(0.8 - 0.2*omega) * stretch**(0.2*omega))
+        return self.group * areaRatio**0.9 * sigma
+
+@lru_cache
+def BartzFor(radiusThroat: float, radiusLip: float):
+    return BartzEvaluator(Q_(radiusThroat, unitReg.inch), Q_(radiusLip, unitReg.inch))
+
+@lru_cache
+def LegacyBartz():
+    print(f"Mesh has no nozzle radii, Bartz uses a {LEGACY_RADII[0]} in throat and {LEGACY_RADII[1]} in lip radius")
+    return BartzFor(*LEGACY_RADII)
+
+def combustion_convection(Node_Temp, Velocity, Wall_Temp=None, bartz=None):
+    # Bartz at one cell, Node_Temp is the gas temperature and Wall_Temp the hot wall temperature (Node_Temp when not
+    # given). bartz is the BartzEvaluator of the nozzle, BartzEvaluator.ForDomain picks the one of a mesh
+    bartz = LegacyBartz() if bartz is None else bartz
+    Wall_Temp = Node_Temp if Wall_Temp is None else Wall_Temp
+    h_g = bartz(Wall_Temp.to(unitReg.degR).magnitude, Velocity.to(unitReg.foot / unitReg.second).magnitude, Node_Temp.to(unitReg.degR).magnitude)
+    return Q_(h_g, unitReg.BTU / (unitReg.foot**2) / unitReg.hour / unitReg.degR)
 
 
 
@@ -165,13 +189,8 @@ def internal_flow_convection(Node_Temp, Node_Pressure, channelArea, channelHydro
     Re_D = (m_dot_c/A_c)*D_h/mu   # Reynolds number
     # Re_D = Re_D.to(unitReg.inch / unitReg.inch)
     # Darcy Friction Factor
-    if Re_D < 2300:
-        f = 64/Re_D # Laminar flow
-    else:
-        f_func = lambda f: -2*np.log10(epsilon/D_h/3.7 + 2.51/(Re_D*np.sqrt(f))) - 1/np.sqrt(f)
-        f = fsolve(f_func, 0.05)  # Turbulent flow
+    f = friction.DarcyFrictionScalar(Re_D.to('dimensionless').magnitude, (epsilon/D_h).to('dimensionless').magnitude)   # laminar below Re 2300, Colebrook above
     # Convection coefficient (Gnielinski)
-    f = f[0]
     if Pr >= 0.5 and Pr <= 2000 and Re_D >= 3000 and Re_D <= 5000000:   # Check that properties fit restrictions for Gnielinski
         Nu_D = f/8*(Re_D - 1000)*Pr / (1 + 12.7*(f/8)**0.5 * (Pr**(2/3) - 1))   # Nusselt number of fully developed flow
     elif Pr >= 0.7 and Pr <= 16700 and Re_D >= 10000:    # Use Sieder & Tate otherwise
@@ -234,8 +253,7 @@ def film_cooling(m_dot_g, m_dot_c, A_c, P, u_g, u_c, P_cc, c_p_g, mu_g, Pr_g,
     G_g = rho_g*u_g # Combustion gas mass velocity
     G_mean = G_g*(u_g - u_c)/u_g    # Mean mass velocity
     Re_g = G_mean*D_h/mu_g # Combustion gas Reynolds number
-    lambda_func = lambda Lambda: 1.930*np.log10(Re_g*np.sqrt(Lambda)) - 0.537 - 1/np.sqrt(Lambda)
-    Lambda = fsolve(lambda_func, 0.1) # Friction factor
+    Lambda = friction.SmoothPipe(Q_(Re_g).to('dimensionless').magnitude) # Friction factor
     e_t = 0.1   # RMS turbulence fraction Must be found from testing data?
     K_t = 1 + 4*e_t # Corrective turbulence factor
     St = Lambda/2/(1.20 + 11.8*np.sqrt(Lambda/2)*(Pr_g - 1)*(Pr_g)**(-1/3))  # Stanton number
@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, gmres, splu
+
+from cooling.network import ThermalNetwork
+from cooling.parallel import WorkerGroup
+
+# The temperature system split into rectangular blocks of the grid for workers to solve side by side. The blocks are
+# cut by recursive bisection so each holds the same number of active cells, the free cells of the bounding box cost
+# nothing. Every block owns its cells and carries a halo of the cells one face (or one upstream link) away. A halo
+# exchange hands every block the current residual, the block solves its cells and halo directly with a factorization
+# kept since the resistors were evaluated and returns the correction of its owned cells (restricted additive Schwarz).
+# Plain exchanges only pass information one block per exchange and stall on the coolant circuits that run the length
+# of the nozzle, so the exchanges precondition GMRES on the whole system, which stays in the calling process.
+
+BISECT_SLACK = 0.02 # share of the cells a cut across the longer side may be off before the other side is tried
+
+@dataclass
+class SubdomainBlock:
+    box: tuple[int, int, int, int] # first row, row past the last, first column, column past the last
+    cells: np.ndarray # network indices, the owned cells first and their halo after them
+    owned: int
+
+def Bisect(rows: np.ndarray, cols: np.ndarray, box: tuple[int, int, int, int], share: float):
+    # the grid line across box that puts closest to share of the cells before it. The line across the longer side
+    # keeps the halos short and is taken unless whole rows or columns of cells throw it off by more than
+    # BISECT_SLACK. None when no line separates the cells
+    r0, r1, c0, c1 = box
+    target = share*rows.size
+    cuts = []
+    for axis, values in [(0, rows), (1, cols)] if r1 - r0 >= c1 - c0 else [(1, cols), (0, rows)]:
+        ordered = np.sort(values)
+        positions = np.unique(ordered)[1:]
+        if positions.size == 0:
+            continue
+        before = np.searchsorted(ordered, positions, side='left')
+        best = int(np.argmin(np.abs(before - target)))
+        cuts.append((abs(before[best] - target), axis, int(positions[best])))
+    if not cuts:
+        return None
+    miss, axis, position = cuts[0]
+    if miss > BISECT_SLACK*rows.size:
+        miss, axis, position = min(cuts)
+    return axis, position
+
+def BalancedBoxes(rows: np.ndarray, cols: np.ndarray, count: int):
+    # count boxes tiling the cells at rows, cols with about the same number of cells each, fewer when there are not
+    # enough cells to go around
+    boxes = []
+    stack = [(np.arange(rows.size), (int(rows.min()), int(rows.max()) + 1, int(cols.min()), int(cols.max()) + 1), count)]
+    while stack:
+        select, box, count = stack.pop()
+        cut = Bisect(rows[select], cols[select], box, (count//2)/count) if count > 1 and select.size > 1 else None
+        if cut is None:
+            boxes.append(box)
+            continue
+        axis, position = cut
+        r0, r1, c0, c1 = box
+        first = (rows if axis == 0 else cols)[select] < position
+        if axis == 0:
+            firstBox, secondBox = (r0, position, c0, c1), (position, r1, c0, c1)
+        else:
+            firstBox, secondBox = (r0, r1, c0, position), (r0, r1, position, c1)
+        stack.append((select[~first], secondBox, count - count//2))
+        stack.append((select[first], firstBox, count//2))
+    return boxes
+
+def Couplings(network: ThermalNetwork):
+    # which active cells the equation of every active cell reads, faces and upstream
+    slots = np.concatenate([network.neighbors, network.upstream[:, np.newaxis]], axis=1)
+    rowIndex = np.repeat(np.arange(network.size), slots.shape[1])
+    use = slots.ravel() < network.size
+    return sparse.csr_matrix((np.ones(np.count_nonzero(use)), (rowIndex[use], slots.ravel()[use])), shape=(network.size, network.size))
+
+def Decompose(network: ThermalNetwork, count: int):
+    couplings = Couplings(network)
+    blocks = []
+    for box in BalancedBoxes(network.rows, network.cols, count):
+        r0, r1, c0, c1 = box
+        owned = np.nonzero((network.rows >= r0) & (network.rows < r1) & (network.cols >= c0) & (network.cols < c1))[0]
+        halo = np.setdiff1d(couplings[owned].indices, owned)
+        blocks.append(SubdomainBlock(box, np.concatenate([owned, halo]), owned.size))
+    return blocks
+
+def Assign(blocks: list[SubdomainBlock], workers: int):
+    # block indices of every worker, the largest block goes to the least loaded worker first
+    assignment = [[] for _ in range(workers)]
+    load = np.zeros(workers)
+    for i in sorted(range(len(blocks)), key=lambda i: -blocks[i].cells.size):
+        worker = int(np.argmin(load))
+        assignment[worker].append(i)
+        load[worker] += blocks[i].cells.size
+    return assignment
+
+class BlockFactors:
+    def __init__(self, blocks: list[SubdomainBlock], matrices: list[sparse.csc_matrix]):
+        self.blocks = blocks
+        self.lus = [splu(matrix) for matrix in matrices]
+
+    def Apply(self, residual: np.ndarray, correction: np.ndarray):
+        # every block solves its cells and halo for the residual and keeps the owned part
+        for block, lu in zip(self.blocks, self.lus):
+            correction[block.cells[:block.owned]] = lu.solve(residual[block.cells])[:block.owned]
+
+_worker = {} # the factors of the blocks of this worker process and the exchange buffers
+
+def WorkerFactor(blocks: list[SubdomainBlock], matrices: list[sparse.csc_matrix], folder: str, size: int):
+    _worker["factors"] = BlockFactors(blocks, matrices)
+    _worker["residual"] = np.memmap(os.path.join(folder, "residual.bin"), dtype=np.float64, mode='r', shape=(size,))
+    _worker["correction"] = np.memmap(os.path.join(folder, "correction.bin"), dtype=np.float64, mode='r+', shape=(size,))
+
+def WorkerApply():
+    _worker["factors"].Apply(_worker["residual"], _worker["correction"])
+
+class BlockSolver:
+    # linearSolver for ThermalNetwork.SolveTemperature. Without blockCells there is one block per worker, otherwise
+    # enough blocks of about blockCells active cells, spread over the workers by size. workers 1 solves the blocks in
+    # process
+    def __init__(self, network: ThermalNetwork, workers: int = 1, blockCells: int | None = None, rtol: float = 1e-8, maxiter: int = 500):
+        count = max(workers, -(-network.size // blockCells)) if blockCells else workers
+        self.blocks = Decompose(network, count)
+        self.assignment = Assign(self.blocks, min(workers, len(self.blocks)))
+        self.rtol = rtol
+        self.maxiter = maxiter
+        self.iterations = 0
+
+        self.group = None
+        if len(self.assignment) > 1:
+            self.folder = tempfile.mkdtemp(prefix="cooling_blocks_")
+            self.residual = np.memmap(os.path.join(self.folder, "residual.bin"), dtype=np.float64, mode='w+', shape=(network.size,))
+            self.correction = np.memmap(os.path.join(self.folder, "correction.bin"), dtype=np.float64, mode='w+', shape=(network.size,))
+            self.group = WorkerGroup(len(self.assignment))
+
+    @staticmethod
+    def ForNetwork(network: ThermalNetwork, workers: int = 1, blockCells: int | None = None, **kwargs):
+        return BlockSolver(network, workers, blockCells, **kwargs)
+
+    def Setup(self, A: sparse.csr_matrix):
+        A = A.tocsr()
+        matrices = [A[block.cells][:, block.cells].tocsc() for block in self.blocks]
+        if self.group is None:
+            self.factors = BlockFactors(self.blocks, matrices)
+            return
+        self.group.Run(WorkerFactor, [([self.blocks[i] for i in assigned], [matrices[i] for i in assigned], self.folder, A.shape[0])
+                                      for assigned in self.assignment])
+
+    def Exchange(self, residual: np.ndarray):
+        if self.group is None:
+            correction = np.zeros_like(residual)
+            self.factors.Apply(residual, correction)
+            return correction
+        self.residual[:] = residual
+        self.group.Run(WorkerApply, [()]*len(self.assignment))
+        return np.array(self.correction)
+
+    def Solve(self, A: sparse.csr_matrix, rhs: np.ndarray, x0: np.ndarray | None = None):
+        self.Setup(A)
+        M = LinearOperator(A.shape, matvec=self.Exchange)
+        self.iterations = 0
+
+        def Count(*args):
+            self.iterations += 1
+
+        x, info = gmres(A, rhs, x0=x0, M=M, rtol=self.rtol, restart=30, maxiter=self.maxiter, callback=Count, callback_type='pr_norm')
+        if info > 0:
+            print(f"Block GMRES stopped at {self.iterations} iterations without reaching {self.rtol}")
+        elif info < 0:
+            raise ValueError("Block GMRES broke down")
+        return x
+
+    def __call__(self, A: sparse.csr_matrix, rhs: np.ndarray, x0: np.ndarray | None = None):
+        return self.Solve(A, rhs, x0)
+
+    def close(self):
+        if self.group is not None:
+            self.group.close()
+            self.group = None
+            del self.residual, self.correction
+            shutil.rmtree(self.folder, ignore_errors=True)
@@ -1,22 +1,26 @@
+from collections.abc import MutableMapping, Sequence
 from dataclasses import dataclass
 from enum import Enum
-import random
+import mmap
 import shutil
-import string
 import tempfile
 import time
 import numpy as np
 import pint
 import matplotlib.pyplot as plt
-from scipy.optimize import fsolve
 from typing import Any
 import multiprocessing as mp
 from icecream import ic
 import joblib
-from alive_progress import alive_bar, alive_it
+from alive_progress import alive_bar
 
 from cooling.material import DomainMaterial, MaterialType
 from cooling import material
+from cooling.grid import DomainGrid, GridPoints, GRID_FIELDS
+from cooling import mesh_file
+from cooling import grading
+from cooling.cellindex import CellIndex
+from cooling.coolant import FlowPath
 from fluids import gas
 from fluids.gas import Gas
 from general.units import Q_, unitReg
@@ -51,21 +55,25 @@ class DomainPoint:
         return s
 
 class DomainMC:
-    array: np.ndarray
+    grid: DomainGrid
     x0: float
     r0: float
     width: float
     height: float
-    xstep: float
-    rstep: float
+    xstep: float # finest column width
+    rstep: float # finest row height
+    xsteps: np.ndarray # width of every column, equal on uniform meshes
+    rsteps: np.ndarray # height of every row
+    graded: bool
+    cells: CellIndex
     hpoints: int
     vpoints: int
+    flowPaths: list[FlowPath]
+    nozzle: dict[str, float] # radiusThroat and radiusLip of the nozzle the mesh was cut from, inch
 
     def __init__(self, x0, r0, width, height, ds = .1):        
         hpoints = int(width/ds) + 1
         vpoints = int(height/ds) + 1
-        
-        self.array = np.empty((vpoints, hpoints), dtype=DomainPoint)
 
         self.x0 = x0
         self.r0 = r0
@@ -73,112 +81,163 @@ class DomainMC:
         self.height = height
         self.hpoints = hpoints
         self.vpoints = vpoints
-        self.xstep = width/(hpoints-1)
-        self.rstep = height/(vpoints-1)
+        self.SetSteps(*DomainMC.UniformSteps(width, height, (vpoints, hpoints)))
         print("Creating domain")
-        with alive_bar(vpoints*hpoints) as bar:
-            for i in range(vpoints):
-                for j in range(hpoints):
-                    self.array[i,j] = DomainPoint(x0 + j*self.xstep, r0 - i*self.rstep, Q_(self.xstep*self.rstep, unitReg.inch**2))
-                    bar()
+        self.flowPaths = []
+        self.nozzle = {}
+        self.grid = DomainGrid(vpoints, hpoints)
+        self.grid.x[:] = x0 + np.arange(hpoints)*self.xstep
+        self.grid.r[:] = (r0 - np.arange(vpoints)*self.rstep)[:, np.newaxis]
+        self.grid.area[:] = self.xstep*self.rstep
         print("Domain created")
 
-    def DefineMaterials(self, cowl: np.ndarray, coolant: np.ndarray, chamber: np.ndarray, plug: np.ndarray, max_cores = mp.cpu_count() - 1):
-        MAX_CORES = max_cores
-        print(f"using {MAX_CORES} cores")
-        tic = time.perf_counter()
+    @staticmethod
+    def Graded(x0, r0, width, height, fine: float, coarse: float, contours: Sequence[np.ndarray] = (), boxes: Sequence[tuple[float, float, float, float]] = (), growth: float = grading.GROWTH, pad: float = 0.0):
+        # the box of DomainMC(x0, r0, width, height) with cells of size fine normal to the walls of the contours (the
+        # cooling channels, the chamber wall) and inside the (xmin, xmax, rmin, rmax) boxes (the throat arc, the lip),
+        # growing by growth per cell up to coarse away from them
+        xZones, rZones = grading.WallZones(contours, fine, pad)
+        xBoxes, rBoxes = grading.BoxZones(boxes, fine)
+        rZones = np.vstack([rZones, rBoxes])
+        # rows run down from r0, the r axis is laid out on -r
+        xsteps = grading.GradedSteps(x0, width, fine, coarse, np.vstack([xZones, xBoxes]), growth)
+        rsteps = grading.GradedSteps(-r0, height, fine, coarse, np.stack([-rZones[:, 1], -rZones[:, 0], rZones[:, 2]], axis=1), growth)
+        return DomainMC.FromSteps(x0, r0, xsteps, rsteps)
 
-        print("Starting processes")
-        with joblib.Parallel(n_jobs=MAX_CORES, verbose=100, return_as='generator') as parallel:
+    @staticmethod
+    def FromSteps(x0, r0, xsteps: np.ndarray, rsteps: np.ndarray):
+        # a domain with the given column widths and row heights, the first cell centered on x0, r0
+        xOffsets = grading.CenterOffsets(np.asarray(xsteps, dtype=float))
+        rOffsets = grading.CenterOffsets(np.asarray(rsteps, dtype=float))
+        domain = DomainMC.__new__(DomainMC)
+        domain.x0 = x0
+        domain.r0 = r0
+        domain.width = float(xOffsets[-1])
+        domain.height = float(rOffsets[-1])
+        domain.hpoints = len(xsteps)
+        domain.vpoints = len(rsteps)
+        domain.SetSteps(xsteps, rsteps)
+        print(f"Creating domain of {domain.vpoints} x {domain.hpoints} cells")
+        domain.flowPaths = []
+        domain.nozzle = {}
+        domain.grid = DomainGrid(domain.vpoints, domain.hpoints)
+        domain.grid.x[:] = x0 + xOffsets
+        domain.grid.r[:] = (r0 - rOffsets)[:, np.newaxis]
+        domain.grid.area[:] = np.outer(domain.rsteps, domain.xsteps)
+        print("Domain created")
+        return domain
 
-            with alive_bar(self.vpoints*self.hpoints) as bar:
-                print("Starting processes")
+    @staticmethod
+    def UniformSteps(width, height, shape: tuple[int, int]):
+        vpoints, hpoints = shape
+        return np.full(hpoints, width/(hpoints-1)), np.full(vpoints, height/(vpoints-1))
+
+    def SetSteps(self, xsteps: np.ndarray, rsteps: np.ndarray):
+        self.xsteps = np.array(xsteps, dtype=float)
+        self.rsteps = np.array(rsteps, dtype=float)
+        self.xstep = float(self.xsteps.min())
+        self.rstep = float(self.rsteps.min())
+        self.graded = bool(np.ptp(self.xsteps) > 0 or np.ptp(self.rsteps) > 0)
+        # cell edges, rEdges runs down from the top of the first row like the rows do
+        self.xEdges = grading.CellEdges(self.x0, self.xsteps)
+        self.rEdges = -grading.CellEdges(-self.r0, self.rsteps)
+        self.cells = CellIndex(self.x0, self.xsteps, self.r0, self.rsteps)
+
+    @property
+    def array(self):
+        return GridPoints(self.grid)
 
-                outputs = parallel(joblib.delayed(EvalMaterialProcess2)(i, self.hpoints, i, (self.x0, self.xstep, self.r0, self.rstep), (self.width, self.height), cowl, chamber, plug) for i in range(self.vpoints))
-                print(outputs)
+    @staticmethod
+    def FromGrid(grid: DomainGrid, x0, r0, width, height, flowPaths: list[FlowPath] | None = None, nozzle: dict[str, float] | None = None, steps: tuple[np.ndarray, np.ndarray] | None = None):
+        domain = DomainMC.__new__(DomainMC)
+        domain.flowPaths = [] if flowPaths is None else flowPaths
+        domain.nozzle = {} if nozzle is None else dict(nozzle)
+        domain.x0 = x0
+        domain.r0 = r0
+        domain.width = width
+        domain.height = height
+        domain.vpoints, domain.hpoints = grid.shape
+        domain.SetSteps(*(steps if steps is not None else DomainMC.UniformSteps(width, height, grid.shape)))
+        domain.grid = grid
+        return domain
 
-                print("Assinging outputs")
-                for out in outputs:
-                    for i, j, mat in out:
-                        self.array[i,j].material = mat
-                        bar()
-            
-            try:
-                shutil.rmtree('./.work')
-            except OSError as e:
-                print("Error: %s - %s." % (e.filename, e.strerror))
+    def DefineMaterials(self, cowl: np.ndarray, coolant: np.ndarray, chamber: np.ndarray, plug: np.ndarray, max_cores = mp.cpu_count() - 1, method: str = 'exact'):
+        # max_cores is kept for old scripts, the classification is vectorized and runs on one core
+        # method 'exact' reproduces isIntersect cell by cell, 'scanline' fills whole runs of cells per row and settles
+        # the cells along the contours with isIntersect, so both give the same materials. 'scanline' returns the
+        # fraction of every cell covered by each material contour, {DomainMaterial: (rows, cols)}, 'exact' None
+        tic = time.perf_counter()
+        coverage = None
+
+        # the coolant contour is not classified, the channels are cut into the cowl and plug later by the flow assignment
+        contours = [(cowl, DomainMaterial.COWL), (chamber, DomainMaterial.CHAMBER), (plug, DomainMaterial.PLUG)]
+        if method == 'exact':
+            print("Classifying cell centers")
+            self.grid.material[:] = material.ClassifyPoints(self.grid.x, self.grid.r, contours, (self.width, self.height))
+        elif method == 'scanline':
+            if self.graded:
+                raise ValueError("Scanline rasterization needs a uniform mesh, use method='exact' on graded meshes")
+            print("Rasterizing contours")
+            self.grid.material[:], coverage = material.RasterizeMaterials(contours, self.x0, self.xstep, self.hpoints, self.grid.r[:, 0], self.rstep, (self.width, self.height))
+        else:
+            raise ValueError(f"Unknown material method {method}")
 
-        print("Parallel computation done")
         print("assigning borders")
         self.AssignBorders()
         toc = time.perf_counter()
         print("material defined")
         print(f"Time to define materials: {toc - tic}")
+        return coverage
 
     def ShowMaterialPlot(self, fig: plt.Figure):
-        xarr = np.array([[point.x for point in row] for row in self.array])
-        rarr = np.array([[point.r for point in row] for row in self.array])
-        matarr = np.array([[(point.material.value) for point in row] for row in self.array])
+        xarr = self.grid.x
+        rarr = self.grid.r
+        matarr = self.grid.material
 
-        # extent = [xarr[0,0]-self.xstep, xarr[-1,-1]+self.xstep, rarr[-1,-1]-self.rstep, rarr[0,0]+self.rstep]
-        extent = [xarr[0,0]-self.xstep/2, xarr[-1,-1]+self.xstep/2, rarr[-1,-1]-self.rstep/2, rarr[0,0]+self.rstep/2]
         ax = fig.axes[0]
         # contf = ax.contourf(xarr, rarr, matarr, levels=[0, 1, 4] , colors=['white', 'blue', 'red'])
         # contf = ax.contourf(xarr, rarr, matarr)
-        ax.imshow(matarr, extent=extent, origin='upper', cmap='jet')
-        xcells = np.linspace(self.x0 - self.xstep/2, self.x0 + self.width + self.xstep/2, self.hpoints+1)
-        rcells = np.linspace(self.r0 + self.rstep/2, self.r0 - self.height - self.rstep/2, self.vpoints+1)
-        xl, rl = np.meshgrid(xcells, rcells)
+        ax.pcolormesh(self.xEdges, self.rEdges, matarr, cmap='jet')
+        xl, rl = np.meshgrid(self.xEdges, self.rEdges)
         # ax.plot(xl, rl, 'k', linewidth=0.25)
         # ax.plot(np.transpose(xl), np.transpose(rl), 'k', linewidth=0.25)  
-          
-        for i in range(self.vpoints):
-            for j in range(self.hpoints):
-                flow = self.array[i,j].previousFlow
-                if flow[0] != 0:
-                    if self.array[i,j].material == DomainMaterial.COOLANT_WALL:
-                        # ax.plot([self.array[i,j].x, self.array[flow].x], [self.array[i,j].r, self.array[flow].r], '-b', linewidth=1)
-                        ax.quiver(self.array[flow].x, self.array[flow].r, self.array[i,j].x - self.array[flow].x, self.array[i,j].r - self.array[flow].r, scale=1, scale_units='xy', angles='xy', color='b', width=0.002)
-                    else:
-                        # ax.plot([self.array[i,j].x, self.array[flow].x], [self.array[i,j].r, self.array[flow].r], '-k', linewidth=1)     
-                        ax.quiver(self.array[flow].x, self.array[flow].r, self.array[i,j].x - self.array[flow].x, self.array[i,j].r - self.array[flow].r, scale=1, scale_units='xy', angles='xy', color='k', width=0.002)   
 
+        rows, cols = np.nonzero(self.grid.previousFlow[:, :, 0] != 0)
+        flowRows = self.grid.previousFlow[rows, cols, 0]
+        flowCols = self.grid.previousFlow[rows, cols, 1]
+        xFrom, rFrom = xarr[flowRows, flowCols], rarr[flowRows, flowCols]
+        dx, dr = xarr[rows, cols] - xFrom, rarr[rows, cols] - rFrom
+        isWall = matarr[rows, cols] == DomainMaterial.COOLANT_WALL
+        ax.quiver(xFrom[isWall], rFrom[isWall], dx[isWall], dr[isWall], scale=1, scale_units='xy', angles='xy', color='b', width=0.002)
+        ax.quiver(xFrom[~isWall], rFrom[~isWall], dx[~isWall], dr[~isWall], scale=1, scale_units='xy', angles='xy', color='k', width=0.002)
 
     def ShowStatePlot(self, fig: plt.Figure, state: str):
         print("state plot!")
-        xarr = np.array([[point.x for point in row] for row in self.array])
-        print("xarr done!")
-        rarr = np.array([[point.r for point in row] for row in self.array])
-        print("rarr done!")
-        
-        matarr = np.array([[point.getState(state) for point in row] for row in self.array])
-        print("matarr done!")
+        if state not in GRID_FIELDS:
+            raise AttributeError(f"DomainPoint has no attribute {state}")
+        xarr = self.grid.x
+        rarr = self.grid.r
+        matarr = self.grid.fields[state]
 
         ax = fig.axes[0]
         contf = ax.contourf(xarr, rarr, matarr, 100, cmap='jet')
         fig.colorbar(contf, ax=ax)
-        xcells = np.linspace(self.x0 - self.xstep/2, self.x0 + self.width + self.xstep/2, self.hpoints+1)
-        rcells = np.linspace(self.r0 + self.rstep/2, self.r0 - self.height - self.rstep/2, self.vpoints+1)
-        xl, rl = np.meshgrid(xcells, rcells)
+        xl, rl = np.meshgrid(self.xEdges, self.rEdges)
         print(np.min(matarr), np.max(matarr))
         print("done!")
         # ax.plot(xl, rl, 'k', linewidth=0.25)
         # ax.plot(np.transpose(xl), np.transpose(rl), 'k', linewidth=0.25)
 
     def ShowBorderPlot(self, fig: plt.Figure):
-        xarr = np.array([[point.x for point in row] for row in self.array])
-        rarr = np.array([[point.r for point in row] for row in self.array])
-        matarr = np.array([[int(point.border) for point in row] for row in self.array])
+        xarr = self.grid.x
+        rarr = self.grid.r
+        matarr = self.grid.border.astype(int)
 
-        # extent = [xarr[0,0]-self.xstep, xarr[-1,-1]+self.xstep, rarr[-1,-1]-self.rstep, rarr[0,0]+self.rstep]
-        extent = [xarr[0,0]-self.xstep/2, xarr[-1,-1]+self.xstep/2, rarr[-1,-1]-self.rstep/2, rarr[0,0]+self.rstep/2]
         ax = fig.axes[0]
         # contf = ax.contourf(xarr, rarr, matarr, levels=[0, 1, 4] , colors=['white', 'blue', 'red'])
         # contf = ax.contourf(xarr, rarr, matarr)
-        ax.imshow(matarr, extent=extent, origin='upper', cmap='jet')
-        xcells = np.linspace(self.x0 - self.xstep/2, self.x0 + self.width + self.xstep/2, self.hpoints+1)
-        rcells = np.linspace(self.r0 + self.rstep/2, self.r0 - self.height - self.rstep/2, self.vpoints+1)
-        xl, rl = np.meshgrid(xcells, rcells)
+        ax.pcolormesh(self.xEdges, self.rEdges, matarr, cmap='jet')
+        xl, rl = np.meshgrid(self.xEdges, self.rEdges)
         # ax.plot(xl, rl, 'k', linewidth=0.25)
         # ax.plot(np.transpose(xl), np.transpose(rl), 'k', linewidth=0.25)
 
@@ -186,6 +245,7 @@ class DomainMC:
         inputPoints = len(coolant.upperContour)
         previousWall = (0,0)
         previousFlow = (0,0)
+        wallCells = []
         with alive_bar(inputPoints - 1) as bar:
             for i in range(inputPoints - 1):
                 dist1 = np.sqrt((coolant.lowerContour[i].x - coolant.lowerContour[i+1].x)**2 + (coolant.lowerContour[i].r - coolant.lowerContour[i+1].r)**2)
@@ -225,34 +285,42 @@ class DomainMC:
                     perim = (Q_(rl[j], unitReg.inch)*channelSectorAngle + Q_(ru[j], unitReg.inch)*channelSectorAngle)/(2*np.pi) + 2*h
                     hydroD = 4*channelArea/perim
 
+                    pressure = initialPressure.to(self.grid.units["pressure"]).magnitude
+                    flowHeight = h.to(self.grid.units["flowHeight"]).magnitude
+                    hydraulicDiameter = hydroD.to(self.grid.units["hydraulicDiameter"]).magnitude
+                    area = channelArea.to(self.grid.units["area"]).magnitude
+
                     for row, col in cells:
-                        if (i==0 and j==0) or self.array[row, col].material == DomainMaterial.COOLANT_INLET:
-                            self.array[row,col].material = DomainMaterial.COOLANT_INLET
-                            self.array[row, col].pressure = initialPressure
-                            self.array[row, col].flowHeight = h
-                            self.array[row, col].hydraulicDiameter = hydroD
-                            self.array[row, col].area = channelArea
+                        if (i==0 and j==0) or self.grid.material[row, col] == DomainMaterial.COOLANT_INLET:
+                            self.grid.material[row,col] = DomainMaterial.COOLANT_INLET
+                            self.grid.pressure[row, col] = pressure
+                            self.grid.flowHeight[row, col] = flowHeight
+                            self.grid.hydraulicDiameter[row, col] = hydraulicDiameter
+                            self.grid.area[row, col] = area
 
                         if row == wallPoint[0] and col == wallPoint[1]:
                             if row != previousWall[0] or col != previousWall[1]:
                                 previousFlow = previousWall
-                            self.array[row, col].material = DomainMaterial.COOLANT_WALL if self.array[row, col].material != DomainMaterial.COOLANT_INLET else DomainMaterial.COOLANT_INLET
-                            self.array[row, col].previousFlow = previousFlow
+                                wallCells.append((row, col))
+                            self.grid.material[row, col] = DomainMaterial.COOLANT_WALL if self.grid.material[row, col] != DomainMaterial.COOLANT_INLET else DomainMaterial.COOLANT_INLET
+                            self.grid.previousFlow[row, col] = previousFlow
                             previousWall = (row, col)
                         else:
-                            if self.array[row, col].material in [DomainMaterial.COOLANT_WALL, DomainMaterial.COOLANT_INLET, DomainMaterial.COOLANT_BULK]:
+                            if self.grid.material[row, col] in [DomainMaterial.COOLANT_WALL, DomainMaterial.COOLANT_INLET, DomainMaterial.COOLANT_BULK]:
                                 continue
-                            self.array[row, col].material = DomainMaterial.COOLANT_BULK
-                            self.array[row, col].previousFlow = wallPoint
+                            self.grid.material[row, col] = DomainMaterial.COOLANT_BULK
+                            self.grid.previousFlow[row, col] = wallPoint
 
-                        self.array[row, col].pressure = initialPressure
-                        self.array[row, col].flowHeight = h
-                        self.array[row, col].hydraulicDiameter = hydroD
-                        self.array[row, col].area = channelArea
+                        self.grid.pressure[row, col] = pressure
+                        self.grid.flowHeight[row, col] = flowHeight
+                        self.grid.hydraulicDiameter[row, col] = hydraulicDiameter
+                        self.grid.area[row, col] = area
                 bar()
                 
         print("done")
 
+        self.AddFlowPath(FlowPath.FromGrid(self.grid, wallCells, upperWall))
+
         print("assigning borders")
         self.AssignBorders()
         print("done")
@@ -275,17 +343,18 @@ class DomainMC:
 
         for j in range(jStart, self.hpoints):
             for i in range(iStart, self.vpoints):
-                if self.array[i,j].material != DomainMaterial.CHAMBER:
+                if self.grid.material[i,j] != DomainMaterial.CHAMBER:
                     break
                 if self.lineInCell(startPointU, startPointL, i, j):
                     jStart = j if i == iStart else jStart
                     continue
-                self.array[i,j].temperature = exhaust.stagTemp
-                self.array[i,j].velocity = Q_(1, unitReg.foot/unitReg.sec)
-                self.array[i,j].hydraulicDiameter = 2*(chamberWallRadius - plugBase)
+                self.grid.set('temperature', (i, j), exhaust.stagTemp)
+                self.grid.set('velocity', (i, j), Q_(1, unitReg.foot/unitReg.sec))
+                self.grid.set('hydraulicDiameter', (i, j), 2*(chamberWallRadius - plugBase))
             if self.lineInCell(startPointU, startPointL, i, j):
                 break
 
+        stations = [] # cells, A/A* and hydraulic diameter of every station, the flow is solved for all of them at the end
         with alive_bar(originX.size) as bar:
             print(f"Assinging straight flow")
             for oX, oR in zip(originX, originR):
@@ -298,18 +367,9 @@ class DomainMC:
 
                 area = np.pi/np.sin(phi) * (startPointU[1]**2 - startPointL[1]**2)
 
-                AAstar = Q_(area, unitReg.inch**2)/Astar
-                mach = fsolve(lambda M: gas.Isentropic1DExpansion(M, exhaust.gammaTyp) - AAstar, .25)[0]
-                temperature = (gas.StagTempRatio(mach, exhaust) * exhaust.stagTemp)
-                velocity = mach * np.sqrt(exhaust.getVariableGamma(mach) * exhaust.Rgas * temperature)
+                AAstar = (Q_(area, unitReg.inch**2)/Astar).to(unitReg.dimensionless).magnitude
                 hydroD = Q_(2*np.sqrt((startPointU[0] - startPointL[0])**2 + (startPointU[1] - startPointL[1])**2), unitReg.inch)
-
-                cells = self.cellsOnLine(startPointL, startPointU)
-                for i,j in cells:
-                    if self.array[i,j].material == DomainMaterial.CHAMBER:
-                        self.array[i,j].temperature = temperature
-                        self.array[i,j].velocity = velocity
-                        self.array[i,j].hydraulicDiameter = hydroD
+                stations.append((self.cellsOnLine(startPointL, startPointU), AAstar, hydroD))
                 bar()
 
 
@@ -346,21 +406,9 @@ class DomainMC:
 
                 area = np.pi/np.sin(angle) * (upperPoint[1]**2 - lowerPoint[1]**2)
 
-                AAstar = Q_(area, unitReg.inch**2)/Astar
-                if AAstar < 1:
-                    mach = 1
-                else:
-                    mach = fsolve(lambda M: gas.Isentropic1DExpansion(M, exhaust.gammaTyp) - AAstar, .25)[0]
-                temperature = (gas.StagTempRatio(mach, exhaust) * exhaust.stagTemp)
-                velocity = mach * np.sqrt(exhaust.getVariableGamma(mach) * exhaust.Rgas * temperature)
+                AAstar = (Q_(area, unitReg.inch**2)/Astar).to(unitReg.dimensionless).magnitude # below 1 is taken as the throat
                 hydroD = Q_(2*np.sqrt((upperPoint[0] - lowerPoint[0])**2 + (upperPoint[1] - lowerPoint[1])**2), unitReg.inch)
-
-                cells = self.cellsOnLine(lowerPoint, upperPoint)
-                for i,j in cells:
-                    if self.array[i,j].material == DomainMaterial.CHAMBER:
-                        self.array[i,j].temperature = temperature
-                        self.array[i,j].velocity = velocity
-                        self.array[i,j].hydraulicDiameter = hydroD
+                stations.append((self.cellsOnLine(lowerPoint, upperPoint), AAstar, hydroD))
 
             ii = ii1
 
@@ -369,139 +417,221 @@ class DomainMC:
                 ii1 = 0
             prevAngle = curAngle
             curAngle = np.pi/2 + np.arctan2(chamber[ii1].r - chamber[ii].r, chamber[ii1].x - chamber[ii].x)
-        
+
+        self.AssignChamberStations(stations, exhaust)
         toc = time.perf_counter()
         print(f"Time to assign chamber temps: {toc - tic}")
         
+    def AssignChamberStations(self, stations: list[tuple[list, float, Q_]], exhaust: Gas):
+        # subsonic flow at every station from its A/A* in one array call, then the cells in the order they were swept
+        if not stations:
+            return
+        mach = gas.MachFromAreaRatio(np.array([AAstar for _, AAstar, _ in stations]), exhaust.gammaTyp)
+        gamma = exhaust.getVariableGammaArray(mach)
+        temperature = gas.IsentropicTempRatio(mach, gamma) * exhaust.stagTemp
+        velocity = mach * np.sqrt(gamma * exhaust.Rgas * temperature)
+        for (cells, _, hydroD), T, V in zip(stations, temperature, velocity):
+            self.SetChamberCells(cells, T, V, hydroD)
+
+    def SetChamberCells(self, cells: list[tuple[int, int]], temperature: Q_, velocity: Q_, hydroD: Q_):
+        if not cells:
+            return
+        rows, cols = np.transpose(cells)
+        isChamber = self.grid.material[rows, cols] == DomainMaterial.CHAMBER
+        index = (rows[isChamber], cols[isChamber])
+        self.grid.set('temperature', index, temperature)
+        self.grid.set('velocity', index, velocity)
+        self.grid.set('hydraulicDiameter', index, hydroD)
+
     def AssignBorders(self):
-        finalI = self.vpoints - 1
-        finalJ = self.hpoints - 1
-
-        with alive_bar(self.vpoints*self.hpoints) as bar:
-            for i in range(self.vpoints):
-                for j in range(self.hpoints):
-                    lowI = max(i - 1, 0)
-                    lowJ = max(j - 1, 0)
-                    highI = min(i + 1, finalI)
-                    highJ = min(j + 1, finalJ)
-                    checks = [self.array[lowI, j].material, self.array[highI, j].material, self.array[i, lowJ].material, self.array[i, highJ].material]
-                    self.array[i, j].border = not(checks[0] == checks[1] and checks[1] == checks[2] and checks[2] == checks[3])
-                    bar()
+        self.grid.border[:], self.grid.faceMaterial[:] = material.FindBorders(self.grid.material)
 
     def cellsOnLine(self, point1, point2):
-        linedx = point2[0] - point1[0]
-        linedr = point2[1] - point1[1]
-        cellsx = int(linedx / self.xstep)
-        cellsr = int(linedr / self.rstep)
-
-        cellsLine = max(int(np.sqrt(cellsx**2 + cellsr**2) * 1.5),10)
-        x = np.linspace(point1[0], point2[0], cellsLine)
-        r = np.linspace(point1[1], point2[1], cellsLine)
-
-        return [self.CoordsToCell(xp, rp) for xp, rp in zip(x,r)]    
+        # every cell on the mesh the segment crosses, in order from point1
+        return self.cells.Traverse(point1, point2)
 
     def isInCell(self, point, row, col):
-        xmin = self.array[row, col].x - self.xstep/2
-        xmax = self.array[row, col].x + self.xstep/2
-        ymin = self.array[row, col].r - self.rstep/2
-        ymax = self.array[row, col].r + self.rstep/2
-        return xmin <= point[0] and point[0] <= xmax and ymin <= point[1] and point[1] <= ymax
+        return self.cells.Contains(point, row, col)
         
     def lineInCell(self, point1, point2, row, col, res = -1):
         m = (point2[1] - point1[1]) / (point2[0] - point1[0])
         a = -m
         b = 1
         c = m*point1[0] - point1[1]
-        x0 = self.array[row, col].x
-        y0 = self.array[row, col].r
+        x0 = self.grid.x[row, col]
+        y0 = self.grid.r[row, col]
 
         x = (b*(b*x0 - a*y0) - a*c)/(a**2 + b**2)
         y = (a*(-b*x0 + a*y0) - b*c)/(a**2 + b**2)
         return self.isInCell((x,y), row, col)
     
     def ChamberStartCell(self):
-        for i in range(self.vpoints):
-            for j in range(self.hpoints):
-                if self.array[i,j].material == DomainMaterial.CHAMBER:
-                    return (i, j)
+        chamberCells = np.argwhere(self.grid.material == DomainMaterial.CHAMBER)
+        if chamberCells.size > 0:
+            return tuple(chamberCells[0])
 
     def CoordsToCell(self, x, r):
-        dx = x - self.x0 + self.xstep/2
-        dr = self.r0 - r + self.rstep/2
-        i = int((dr/self.rstep))
-        j = int((dx/self.xstep))
-        return (i, j)
+        return self.cells.Locate(x, r)
+
+    def AddFlowPath(self, path: FlowPath):
+        # running AssignCoolantFlow again for a circuit replaces its path in place instead of adding a second one the
+        # coolant march would apply on top of the first
+        index = next((i for i, old in enumerate(self.flowPaths) if old.SameCircuit(path)), len(self.flowPaths))
+        if index < len(self.flowPaths):
+            print(f"Replacing flow path {index}")
+            self.grid.flowPath[self.grid.flowPath[..., 0] == index] = -1
+            self.flowPaths[index] = path
+        else:
+            self.flowPaths.append(path)
+        self.grid.flowPath[path.wallCells[:, 0], path.wallCells[:, 1]] = np.stack([np.full(len(path.wallCells), index), np.arange(len(path.wallCells))], axis=1)
+        wallOfBulk = np.repeat(np.arange(len(path.wallCells)), np.diff(path.bulkStart))
+        self.grid.flowPath[path.bulkCells[:, 0], path.bulkCells[:, 1]] = np.stack([np.full(len(path.bulkCells), index), wallOfBulk], axis=1)
+
+    def FlowPathAt(self, row: int, col: int):
+        # the flow path through a coolant cell and the wall cell position along it, None for other cells
+        index, position = self.grid.flowPath[row, col]
+        return None if index < 0 else (self.flowPaths[index], position)
+
+    def Geometry(self):
+        return {"x0": self.x0, "r0": self.r0, "width": self.width, "height": self.height, "xstep": self.xstep, "rstep": self.rstep}
+
+    def MeshExtras(self):
+        # arrays and metadata stored next to the grid fields in a mesh
+        arrays = {}
+        for i, path in enumerate(self.flowPaths):
+            arrays.update(path.ToArrays(f"flowPath{i}"))
+        arrays.update(xsteps=self.xsteps, rsteps=self.rsteps)
+        return arrays, {"flowPaths": [{"upperWall": bool(path.upperWall)} for path in self.flowPaths], "nozzle": self.nozzle}
+
+    def SetNozzle(self, outputData: dict):
+        # keeps the throat and lip radius from plug.CreateRaoContour with the mesh, the hot gas film coefficient uses them
+        self.nozzle = {name: float(outputData[name].to(unitReg.inch).magnitude) for name in ("radiusThroat", "radiusLip")}
+
+    @staticmethod
+    def ReadSteps(path: str, header: dict):
+        # column widths and row heights stored with the mesh, None for meshes written before graded meshes
+        if "xsteps" not in header.get("arrays", {}):
+            return None
+        arrays = mesh_file.ReadArrays(path, header, 'r')
+        return np.array(arrays["xsteps"]), np.array(arrays["rsteps"])
+
+    @staticmethod
+    def ReadFlowPaths(path: str, header: dict, mode: str):
+        arrays = mesh_file.ReadArrays(path, header, mode)
+        return [FlowPath.FromArrays(arrays, f"flowPath{i}", entry["upperWall"]) for i, entry in enumerate(header.get("metadata", {}).get("flowPaths", []))]
 
     def DumpFile(self, filename):
-        joblib.dump(self, filename + '.msh.z', compress=True)
+        mesh_file.WriteMesh(mesh_file.MeshPath(filename), self.grid, self.Geometry(), *self.MeshExtras())
 
     @staticmethod
-    def LoadFile(filename):
+    def LoadFile(filename, mode: str = 'c'):
+        # opens filename.mesh when it exists, otherwise falls back to the old joblib filename.msh.z
         print("Loading file")
+        path = mesh_file.MeshPath(filename)
+        if mesh_file.isMesh(path):
+            grid, geometry, header = mesh_file.ReadMesh(path, mode)
+            flowPaths = DomainMC.ReadFlowPaths(path, header, mode)
+            return DomainMC.FromGrid(grid, geometry["x0"], geometry["r0"], geometry["width"], geometry["height"], flowPaths, header.get("metadata", {}).get("nozzle"), DomainMC.ReadSteps(path, header))
+        return DomainMC.LoadLegacyFile(filename)
+
+    @staticmethod
+    def LoadLegacyFile(filename):
         loaded: DomainMC = joblib.load(filename + '.msh.z')
+        loaded.__dict__.setdefault('flowPaths', [])
+        loaded.__dict__.setdefault('nozzle', {})
+        if 'xsteps' not in loaded.__dict__:
+            loaded.SetSteps(*DomainMC.UniformSteps(loaded.width, loaded.height, (loaded.vpoints, loaded.hpoints)))
+        legacyArray = loaded.__dict__.pop('array', None)
+        if legacyArray is not None:
+            print("Converting DomainPoint array to grid")
+            loaded.grid = DomainGrid.FromPoints(legacyArray)
+            loaded.AssignBorders()
+        elif 'faceMaterial' in loaded.grid.AddMissingFields():
+            loaded.AssignBorders()
         # DomainMC.ConvertUnits(loaded)
         return loaded
+
+    @staticmethod
+    def ImportLegacyFile(filename):
+        # rewrites filename.msh.z as filename.mesh and returns the mesh opened from the new file
+        print(f"Importing {filename}.msh.z")
+        DomainMC.LoadLegacyFile(filename).DumpFile(filename)
+        return DomainMC.LoadFile(filename)
     
     @staticmethod
     def ConvertUnits(domain):
         print("Converting units")
-        attributes = list(domain.array[0,0].__dict__.keys())
-        for attr in attributes:
-            testAttr = domain.array[0,0].__getattribute__(attr)
-            if isinstance(testAttr, pint.Quantity):
-                with alive_bar(domain.vpoints*domain.hpoints) as bar:
-                    print(f"Converting {attr}")
-                    unit = str(testAttr.units)
-                    t = [[domain.array[i,j].__getattribute__(attr).magnitude for i in range(domain.vpoints)] for j in range(domain.hpoints)]
-                    for i in range(domain.vpoints):
-                        for j in range(domain.hpoints):
-                            domain.array[i,j].__setattr__(attr, Q_(t[j][i], unit))
-                            bar()
+        domain.grid.ConvertUnits()
         return domain
     
 class DomainMMAP(DomainMC):
     attributes: list = []
-    memmaps: dict
+    memmaps: MutableMapping
 
     units: dict
 
-    workingFolder = tempfile.mkdtemp()
-    prefix = str(''.join(random.choices(string.ascii_letters, k=4)))
+    workingFolder: str
+    ownsFolder: bool
 
-    def __init__(self, domain: DomainMC):
-        self.x0 = domain.x0
-        self.r0 = domain.r0
-        self.width = domain.width
-        self.height = domain.height
-        self.hpoints = domain.hpoints
-        self.vpoints = domain.vpoints
-        self.xstep = domain.xstep
-        self.rstep = domain.rstep
+    staged: dict[str, tuple[list, list, list]]
+    bytesWritten: int
+
+    def __init__(self, domain: DomainMC, workingFolder: str | None = None):
+        # the working folder holds the fields as a mesh directory, pass one to keep it around between runs and reopen
+        # it later with DomainMMAP.OpenMesh, otherwise a temporary folder is made and removed by close()
+        ownsFolder = workingFolder is None
+        if ownsFolder:
+            workingFolder = tempfile.mkdtemp(prefix="cooling_mmap_")
 
         print("Loading domain")
-        self.attributes = list(DomainPoint(0, 0, 0).__dict__.keys())
-        self.memmaps = {}
-        self.units = {}
+        mesh_file.WriteMesh(workingFolder, domain.grid, domain.Geometry(), *domain.MeshExtras())
+        self.OpenFolder(workingFolder, ownsFolder)
 
-        for attr in alive_it(self.attributes):
-            print(f"Transferring {attr}")
-            testAttr = domain.array[0,0].__getattribute__(attr)
-            dtype = 'float64'
-            if isinstance(testAttr, pint.Quantity):
-                self.units[attr] = str(testAttr.units)
-                t = [[domain.array[i,j].__getattribute__(attr).to(testAttr.units).magnitude for j in range(domain.hpoints)] for i in range(domain.vpoints)]
-            elif isinstance(testAttr, Enum):
-                t = [[domain.array[i,j].__getattribute__(attr).value for j in range(domain.hpoints)] for i in range(domain.vpoints)]
-                dtype = 'int'
-            elif isinstance(testAttr, tuple):
-                t = [[[a for a in domain.array[i,j].__getattribute__(attr)] for j in range(domain.hpoints)] for i in range(domain.vpoints)]
-                dtype = 'int'
-            else:
-                t = [[domain.array[i,j].__getattribute__(attr) for j in range(domain.hpoints)] for i in range(domain.vpoints)]
-            shape = (domain.vpoints, domain.hpoints) if not isinstance(testAttr, tuple) else (domain.vpoints, domain.hpoints, len(testAttr))
-            self.memmaps[attr] = np.memmap(f'{self.workingFolder}/{self.prefix}_{attr}.dat', dtype=dtype, mode='w+', shape=shape)
-            self.memmaps[attr][:] = t[:]
-            del t
+    @staticmethod
+    def OpenMesh(path: str, mode: str = 'r+'):
+        # works on the fields of an existing mesh directory in place, nothing is copied and nothing is removed on close.
+        # mode 'r' attaches read only, like the workers of parallel.CellPool
+        opened = DomainMMAP.__new__(DomainMMAP)
+        opened.OpenFolder(mesh_file.MeshPath(path) if not mesh_file.isMesh(path) else path, False, mode)
+        return opened
+
+    def OpenFolder(self, workingFolder: str, ownsFolder: bool, mode: str = 'r+'):
+        grid, geometry, header = mesh_file.ReadMesh(workingFolder, mode)
+        self.flowPaths = DomainMC.ReadFlowPaths(workingFolder, header, 'r')
+        self.nozzle = dict(header.get("metadata", {}).get("nozzle", {}))
+        self.workingFolder = workingFolder
+        self.ownsFolder = ownsFolder
+
+        self.x0 = geometry["x0"]
+        self.r0 = geometry["r0"]
+        self.width = geometry["width"]
+        self.height = geometry["height"]
+        self.vpoints, self.hpoints = grid.shape
+        steps = DomainMC.ReadSteps(workingFolder, header)
+        self.SetSteps(*(steps if steps is not None else DomainMC.UniformSteps(self.width, self.height, grid.shape)))
+
+        self.grid = grid
+        self.attributes = list(grid.fields)
+        self.memmaps = grid.fields
+        self.units = grid.units
+        self.staged = {}
+        self.bytesWritten = 0
+
+    def close(self):
+        if self.staged:
+            self.CommitMEM(flush=False)
+        for name in list(self.memmaps.opened):
+            if isinstance(self.memmaps.opened[name], np.memmap):
+                self.memmaps.opened[name].flush()
+        self.memmaps.opened.clear()
+        if self.ownsFolder:
+            shutil.rmtree(self.workingFolder, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def __getattribute__(self, name: str) -> Any:
         try:
@@ -515,7 +645,7 @@ class DomainMMAP(DomainMC):
                 return super().__getattribute__(name)
             
     def __setattr__(self, name: str, value: Any) -> None:
-        if name in ['attributes', 'memmaps', 'units', 'workingFolder', 'prefix'] or name in super().__dir__():
+        if name in ['attributes', 'memmaps', 'units', 'workingFolder', 'ownsFolder', 'grid', 'staged', 'bytesWritten'] or name in super().__dir__():
             super().__setattr__(name, value)
         else:
             if name in self.attributes:
@@ -529,36 +659,63 @@ class DomainMMAP(DomainMC):
             else:
                 super().__setattr__(name, value)
 
+    def toArrays(self) -> dict[str, np.memmap]:
+        # the live memmaps, no copies, writes to them land in the working folder
+        return {attr: self.memmaps[attr] for attr in self.attributes}
+
     def toDomain(self):
-        domain = DomainMC(self.x0, self.r0, self.width, self.height, self.xstep)
-        with alive_bar(self.vpoints*self.hpoints, title="Setting point data") as bar:
-            for i in range(self.vpoints):
-                for j in range(self.hpoints):
-                    for attr in self.attributes:
-                        if attr in self.units:
-                            domain.array[i,j].__setattr__(attr, Q_(self.memmaps[attr][i,j], self.units[attr]))
-                        elif isinstance(self.memmaps[attr][i,j], np.memmap):
-                            domain.array[i,j].__setattr__(attr, tuple(self.memmaps[attr][i,j]))
-                        else:
-                            domain.array[i,j].__setattr__(attr, self.memmaps[attr][i,j])
-                    bar()
-        return domain
+        grid = DomainGrid(self.vpoints, self.hpoints, {attr: np.array(self.memmaps[attr]) for attr in self.attributes})
+        grid.units.update(self.units)
+        return DomainMC.FromGrid(grid, self.x0, self.r0, self.width, self.height, self.flowPaths, self.nozzle, (self.xsteps, self.rsteps))
     
-    def setMEM(self, row, col, name, value):
+    def setMEM(self, row, col, name, value, flush: bool = True):
         if isinstance(value, pint.Quantity):
             self.memmaps[name][row, col] = value.to(Q_(self.units[name])).magnitude
         elif isinstance(value, Enum):
             self.memmaps[name][row, col] = value.value
         else:
             self.memmaps[name][row, col] = value
-        self.memmaps[name].flush()
+        if flush:
+            self.memmaps[name].flush()
+
+    def StageMEM(self, rows, cols, name, values):
+        # queue updates for CommitMEM, rows/cols/values can be scalars or matching arrays
+        if isinstance(values, pint.Quantity):
+            values = values.to(Q_(self.units[name])).magnitude
+        elif isinstance(values, Enum):
+            values = values.value
+        staged = self.staged.setdefault(name, ([], [], []))
+        staged[0].append(np.atleast_1d(rows))
+        staged[1].append(np.atleast_1d(cols))
+        staged[2].append(np.atleast_1d(values))
+
+    def CommitMEM(self, flush: bool = True):
+        # applies everything staged with one scatter per field and at most one flush per field. Returns the bytes of
+        # the memmap pages dirtied by the update, which is what the flush writes back to disk
+        written = 0
+        for name, (rows, cols, values) in self.staged.items():
+            rows = np.concatenate(rows)
+            cols = np.concatenate(cols)
+            memmap = self.memmaps[name]
+            memmap[rows, cols] = np.concatenate(values)
+
+            cellBytes = memmap.itemsize * int(np.prod(memmap.shape[2:], dtype=int))
+            offsets = np.ravel_multi_index((rows, cols), memmap.shape[:2]) * cellBytes
+            written += np.unique(offsets // mmap.PAGESIZE).size * mmap.PAGESIZE
+            if flush and isinstance(memmap, np.memmap):
+                memmap.flush()
+        self.staged = {}
+        self.bytesWritten += written
+        return written
+
+    def FlushMEM(self):
+        for name in self.attributes:
+            if isinstance(self.memmaps[name], np.memmap):
+                self.memmaps[name].flush()
 
     def plotTemp(self, fig):
         temps = self.temperature.magnitude.copy()
-        for i in range(self.vpoints):
-            for j in range(self.hpoints):
-                if self.material[i,j] in MaterialType.STATIC_TEMP:
-                    temps[i,j] = np.nan
+        temps[np.isin(self.material, list(MaterialType.STATIC_TEMP))] = np.nan
         ax = fig.axes[0]
         contf = ax.contourf(self.x, self.r, temps, 100, cmap='jet')
         fig.colorbar(contf, ax=ax)
@@ -569,10 +726,7 @@ class DomainMMAP(DomainMC):
 
     def plotPressDrop(self, fig):
         temps = self.pressure.magnitude.copy()
-        for i in range(self.vpoints):
-            for j in range(self.hpoints):
-                if self.material[i,j] not in MaterialType.COOLANT:
-                    temps[i,j] = np.nan
+        temps[~np.isin(self.material, list(MaterialType.COOLANT))] = np.nan
         ax = fig.axes[0]
         contf = ax.contourf(self.x, self.r, temps, 100, cmap='jet')
         fig.colorbar(contf, ax=ax)
@@ -594,10 +748,9 @@ class SparseDomain(DomainMC):
         self.height = domain.height
         self.hpoints = domain.hpoints
         self.vpoints = domain.vpoints
-        self.xstep = domain.xstep
-        self.rstep = domain.rstep
+        self.SetSteps(domain.xsteps, domain.rsteps)
 
-        self.attributes = list(DomainPoint(0, 0, 0).__dict__.keys())
+        self.attributes = list(GRID_FIELDS.keys())
         self.points = {}
         self.units = {}
         self.poi = poi
@@ -654,20 +807,6 @@ class SparseDomain(DomainMC):
             if isinstance(self.points[key], pint.Quantity):
                 self.points[key] = Q_(self.points[key].magnitude, self.units[key])
 
-def EvalMaterialProcess2(i, hsteps, pn, gridData, size, cowl, chamber, plug):
-    res = []
-
-    x0 = gridData[0]
-    xstep = gridData[1]
-    r0 = gridData[2]
-    rstep = gridData[3]
-
-    for j in range(hsteps):
-        point = (x0 + j*xstep, r0 - i*rstep)
-        material = AssignMaterial(point, size, np.array([]), cowl, chamber, plug)
-        res.append((i, j, material))
-    return res
-
 def AssignMaterial(point, size, coolant, cowl, chamber, plug):
     if material.isIntersect(point, coolant, size):
         return DomainMaterial.COOLANT
@@ -0,0 +1,66 @@
+from collections.abc import Sequence
+import numpy as np
+
+from cooling.material import ContourArray
+from nozzle.nozzle import ContourPoint
+
+# Cell sizes of graded meshes. The mesh stays a tensor product, every column has one width and every row one height,
+# so cells sharing a face always share its full length and the face resistances stay those of the uniform mesh with
+# each half taken over its own cell. The sizes come from zones, intervals of one axis that want cells no larger than a
+# given size, and grow geometrically away from them up to a coarse size.
+
+GROWTH = 1.2
+
+def WallZones(contours: Sequence[np.ndarray[ContourPoint]], fine: float, pad: float = 0.0):
+    # x and r zones that resolve every segment of the contours with cells of size fine normal to the segment. A
+    # segment at angle theta to the axis needs dx <= fine/sin(theta) and dr <= fine/cos(theta), so walls running
+    # along x only refine the rows they cross and the other way around. Returns two (n, 3) arrays of lo, hi, size
+    xZones, rZones = [], []
+    for contour in contours:
+        if len(contour) < 2:
+            continue
+        x, r = ContourArray(contour).T
+        dx, dr = np.abs(np.diff(x)), np.abs(np.diff(r))
+        length = np.hypot(dx, dr)
+        keep = length > 0
+        with np.errstate(divide='ignore'):
+            xSize = fine * length[keep] / dr[keep]
+            rSize = fine * length[keep] / dx[keep]
+        x0, x1, r0, r1 = x[:-1][keep], x[1:][keep], r[:-1][keep], r[1:][keep]
+        xZones.append(np.stack([np.minimum(x0, x1) - pad, np.maximum(x0, x1) + pad, xSize], axis=1))
+        rZones.append(np.stack([np.minimum(r0, r1) - pad, np.maximum(r0, r1) + pad, rSize], axis=1))
+    empty = np.zeros((0, 3))
+    return np.concatenate(xZones or [empty]), np.concatenate(rZones or [empty])
+
+def BoxZones(boxes: Sequence[tuple[float, float, float, float]], size: float):
+    # x and r zones of (xmin, xmax, rmin, rmax) boxes refined to size in both directions, the throat arc and the lip
+    boxArray = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    sizes = np.full((len(boxArray), 1), size)
+    return np.hstack([boxArray[:, :2], sizes]), np.hstack([boxArray[:, 2:], sizes])
+
+def CellSize(position: float, zones: np.ndarray, fine: float, coarse: float, growth: float):
+    # cells grow by growth per cell away from a zone, which makes the allowed size linear in the distance to it
+    distance = np.maximum(zones[:, 0] - position, 0) + np.maximum(position - zones[:, 1], 0)
+    return min(coarse, np.min(np.maximum(zones[:, 2], fine) + (growth - 1)*distance, initial=coarse))
+
+def GradedSteps(start: float, length: float, fine: float, coarse: float, zones: np.ndarray, growth: float = GROWTH):
+    # widths of the cells whose centers run from start to start + length, like a uniform axis of DomainMC. Cells are
+    # laid from start and the last partial cell is spread over all of them, so no cell ends up larger than asked
+    zones = np.asarray(zones, dtype=float).reshape(-1, 3)
+    steps = [CellSize(start, zones, fine, coarse, growth)]
+    edge = start + steps[0]/2
+    while sum(steps) - steps[0]/2 - steps[-1]/2 < length:
+        step = CellSize(edge, zones, fine, coarse, growth)
+        step = min(step, CellSize(edge + step, zones, fine, coarse, growth)) # the far edge can be nearer a zone
+        steps.append(step)
+        edge += step
+    stepArray = np.array(steps)
+    return stepArray * length / (stepArray.sum() - stepArray[0]/2 - stepArray[-1]/2)
+
+def CenterOffsets(steps: np.ndarray):
+    # distance of every cell center from the first one
+    return np.concatenate([[0], np.cumsum((steps[:-1] + steps[1:])/2)])
+
+def CellEdges(first: float, steps: np.ndarray):
+    # the steps.size + 1 cell edges of an axis whose first cell is centered on first
+    return first - steps[0]/2 + np.concatenate([[0], np.cumsum(steps)])
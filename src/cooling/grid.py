@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any
+import numpy as np
+import pint
+
+from cooling.material import DomainMaterial
+from general.units import Q_, unitReg
+
+@dataclass
+class GridField:
+    dtype: str
+    unit: str | None = None # None for unitless fields
+    default: Any = 0
+    depth: int = 0 # trailing dimension per cell, 0 for scalar fields
+    enum: type | None = None
+
+# Field layout of the cooling grid, one contiguous array per entry. Units are the storage units, every
+# Quantity written to the grid is converted to these.
+GRID_FIELDS: dict[str, GridField] = {
+    "x": GridField('float64'),
+    "r": GridField('float64'),
+    "area": GridField('float64', 'inch ** 2'),
+    "material": GridField('int8', default=DomainMaterial.FREE.value, enum=DomainMaterial),
+    "border": GridField('bool', default=False),
+    "temperature": GridField('float64', 'degR', Q_(70, unitReg.degF).to(unitReg.degR).magnitude),
+    "pressure": GridField('float64', 'psi', 12.1),
+    "velocity": GridField('float64', 'foot / second'),
+    "hydraulicDiameter": GridField('float64', 'inch'),
+    "previousFlow": GridField('int32', default=0, depth=2),
+    "flowHeight": GridField('float64', 'inch'),
+    "faceMaterial": GridField('int8', default=-1, depth=4, enum=DomainMaterial), # neighbor material across each face, indexed by Direction
+    "flowPath": GridField('int32', default=-1, depth=2), # (index into DomainMC.flowPaths, position along it) of coolant cells
+}
+
+class DomainGrid:
+    fields: dict[str, np.ndarray]
+    units: dict[str, str]
+    shape: tuple[int, int]
+
+    def __init__(self, vpoints: int, hpoints: int, fields: dict[str, np.ndarray] | None = None):
+        self.shape = (vpoints, hpoints)
+        self.fields = {} if fields is None else fields # any mapping works, meshes opened from disk map fields lazily
+        self.units = {name: spec.unit for name, spec in GRID_FIELDS.items() if spec.unit is not None}
+        self.AddMissingFields()
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        fields = self.__dict__.get('fields')
+        if fields is not None and name in fields:
+            return fields[name]
+        raise AttributeError(f"DomainGrid has no field {name}")
+
+    def FieldShape(self, name: str):
+        depth = GRID_FIELDS[name].depth
+        return self.shape if depth == 0 else (*self.shape, depth)
+
+    def AddMissingFields(self):
+        # grids saved before a field existed get it back at its default value, returns the names that were added
+        missing = [name for name in GRID_FIELDS if name not in self.fields]
+        for name in missing:
+            spec = GRID_FIELDS[name]
+            self.fields[name] = np.full(self.FieldShape(name), spec.default, dtype=spec.dtype)
+            if spec.unit is not None:
+                self.units[name] = spec.unit
+        return missing
+
+    def quantity(self, name: str) -> pint.Quantity:
+        return Q_(self.fields[name], self.units[name])
+
+    def set(self, name: str, index, value):
+        if isinstance(value, pint.Quantity):
+            value = value.to(self.units[name]).magnitude
+        elif isinstance(value, Enum):
+            value = value.value
+        self.fields[name][index] = value
+
+    def point(self, row: int, col: int):
+        return DomainPointView(self, row, col)
+
+    def ConvertUnits(self):
+        # move any field stored in foreign units (old pickles, hand built grids) back to the storage units
+        for name, unit in self.units.items():
+            storage = GRID_FIELDS[name].unit
+            if unit != storage:
+                self.fields[name] = Q_(self.fields[name], unit).to(storage).magnitude
+                self.units[name] = storage
+        return self
+
+    @staticmethod
+    def FromPoints(array: np.ndarray):
+        # build a grid from the legacy object array of DomainPoint
+        vpoints, hpoints = array.shape
+        grid = DomainGrid(vpoints, hpoints)
+        for name, spec in GRID_FIELDS.items():
+            if not hasattr(array[0, 0], name):
+                continue
+            values = [[getattr(point, name) for point in row] for row in array]
+            if spec.unit is not None:
+                values = [[v.to(spec.unit).magnitude for v in row] for row in values]
+            elif spec.enum is not None and spec.depth == 0:
+                values = [[v.value for v in row] for row in values]
+            grid.fields[name][:] = np.array(values, dtype=spec.dtype)
+        return grid
+
+class DomainPointView:
+    # thin per cell view into a DomainGrid, stands in for the old DomainPoint objects
+    __slots__ = ('grid', 'row', 'col')
+
+    def __init__(self, grid: DomainGrid, row: int, col: int):
+        self.grid = grid
+        self.row = row
+        self.col = col
+
+    def getState(self, state: str):
+        if state not in GRID_FIELDS:
+            raise AttributeError(f"DomainPoint has no attribute {state}")
+        return self.grid.fields[state][self.row, self.col]
+
+def _pointProperty(name: str):
+    spec = GRID_FIELDS[name]
+
+    def getter(self: DomainPointView):
+        value = self.grid.fields[name][self.row, self.col]
+        if spec.unit is not None:
+            return Q_(float(value), self.grid.units[name])
+        if spec.depth > 0:
+            return tuple(int(v) for v in value)
+        if spec.enum is not None:
+            return spec.enum(int(value))
+        return value.item()
+
+    def setter(self: DomainPointView, value):
+        self.grid.set(name, (self.row, self.col), value)
+
+    return property(getter, setter)
+
+for _name in GRID_FIELDS:
+    setattr(DomainPointView, _name, _pointProperty(_name))
+
+class GridPoints:
+    # array[i, j] style access kept for scripts written against the DomainPoint object array
+    def __init__(self, grid: DomainGrid):
+        self.grid = grid
+
+    @property
+    def shape(self):
+        return self.grid.shape
+
+    def __getitem__(self, index) -> DomainPointView:
+        row, col = index
+        return DomainPointView(self.grid, row, col)
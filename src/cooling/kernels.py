@@ -0,0 +1,350 @@
+from dataclasses import dataclass
+from enum import IntEnum
+import hashlib
+import numpy as np
+
+from cooling import cooling2d, mesh_file
+from cooling.cooling2d import BartzEvaluator
+from cooling.material import DomainMaterial, MaterialType
+from fluids.friction import DarcyFriction
+from fluids.properties import GetTable
+import general.design as DESIGN
+from general.units import Direction, Q_, unitReg
+
+# Unit free counterparts of the calc_cell/cooling2d resistor math, on plain float arrays. Everything inside is in
+# ft, lbm, degR and BTU, heat rates per hour (resistances in hr*degR/BTU like RESISTANCE_UNIT) and flow rates,
+# velocities and viscosities per second like the property tables. Grid fields come in with their storage units (inch,
+# psi) and are converted here, pint is only used once at import to turn the design inputs into these units.
+
+INCH = Q_(1, unitReg.inch).to(unitReg.foot).magnitude
+PER_SECOND = Q_(1, 1/unitReg.second).to(1/unitReg.hour).magnitude # per second to per hour
+PSF_TO_PSI = Q_(1, unitReg.pound / unitReg.foot / unitReg.second**2).to(unitReg.psi).magnitude # lbm/(ft s^2) to psi
+GRCOP_UNIT = Q_(1, unitReg.watt / (unitReg.meter * unitReg.degK)).to(unitReg.BTU / unitReg.foot / unitReg.hour / unitReg.degR).magnitude
+GRCOP_CP_UNIT = Q_(1, unitReg.joule / (unitReg.gram * unitReg.degK)).to(unitReg.BTU / unitReg.pound / unitReg.degR).magnitude
+GRCOP_DENSITY = Q_(8.79, unitReg.gram / unitReg.centimeter**3).to(unitReg.pound / unitReg.foot**3).magnitude
+
+R_MAX = 2e8 # faces with a resistance outside (R_MIN, R_MAX] are skipped, see ResistorSet.isUsed
+R_MIN = 2e-31
+R_ADIABATIC = 2e31
+
+MDOT_CHANNEL = cooling2d.mdotperchannel.to(unitReg.pound / unitReg.second).magnitude
+ROUGHNESS = cooling2d.epsilon.to(unitReg.foot).magnitude
+CHAMBER_PRESSURE = cooling2d.pressure_stagnation.to(unitReg.psi).magnitude
+CHANNELS = DESIGN.NumberofChannels
+LAND_WIDTH = DESIGN.landWidth.to(unitReg.foot).magnitude
+
+GEOMETRY_VERSION = 1 # bump when the factors FaceGeometry stores change meaning
+
+def CoolantProperties(temperature: np.ndarray, pressure: np.ndarray):
+    return GetTable(cooling2d.fuelname)(temperature, pressure)
+
+def ConductivityGrcop(temperature: np.ndarray):
+    T = np.minimum(np.asarray(temperature) * 5/9, 1000) # K
+    return (-9E-05*T**2 + 0.091*T + 327.88) * GRCOP_UNIT
+
+def SpecificHeatGrcop(temperature: np.ndarray):
+    # GRCop-42 follows copper, about 0.38 J/(g K) at room temperature rising to 0.45 at 1000 K. BTU/(lbm degR)
+    T = np.minimum(np.asarray(temperature) * 5/9, 1000) # K
+    return (0.353 + 1.0E-04*T) * GRCOP_CP_UNIT
+
+def ConductivityRP1(temperature: np.ndarray):
+    return CoolantProperties(temperature, np.full(np.shape(temperature), CHAMBER_PRESSURE))["conductivity"]
+
+def CoolantFlowTerms(temperature, pressure, area, hydraulicDiameter, deltaL):
+    # coolant_flow_terms, degR, psi, ft**2, ft, ft -> mdot*cp in BTU/(hr*degR) and the pressure drop in psi
+    properties = CoolantProperties(temperature, pressure)
+    mu, rho = properties["viscosity"], properties["density"]
+    Re = MDOT_CHANNEL*hydraulicDiameter/mu/area
+    f = DarcyFriction(Re, ROUGHNESS/hydraulicDiameter)
+    deltaP = f*deltaL/hydraulicDiameter*rho*(MDOT_CHANNEL/rho/area)**2/2 * PSF_TO_PSI
+    return MDOT_CHANNEL*properties["specificHeat"]*PER_SECOND, deltaP
+
+def CoolantConvection(temperature, pressure, area, hydraulicDiameter):
+    # internal_flow_convection, Gnielinski inside its range and Sieder & Tate (mu/mu_s = 1) outside. BTU/(ft**2 hr degR)
+    properties = CoolantProperties(temperature, pressure)
+    mu, k, Pr = properties["viscosity"], properties["conductivity"], properties["prandtl"]
+    Re = MDOT_CHANNEL/area*hydraulicDiameter/mu
+    f = DarcyFriction(Re, ROUGHNESS/hydraulicDiameter)
+
+    gnielinski = (Pr >= 0.5) & (Pr <= 2000) & (Re >= 3000) & (Re <= 5000000)
+    if not np.all(gnielinski):
+        print(f"Pr/Re is wack for {np.count_nonzero(~gnielinski)} coolant cells, using Sieder-Tate")
+    Nu = np.where(gnielinski, f/8*(Re - 1000)*Pr / (1 + 12.7*(f/8)**0.5 * (Pr**(2/3) - 1)), 0.027*Re**0.8*Pr**(1/3))
+    return Nu*k/hydraulicDiameter
+
+def RingArea(r, dr):
+    ro = (r + dr/2)*INCH
+    ri = (r - dr/2)*INCH
+    return np.pi*np.abs(ro**2 - ri**2)
+
+def CoolantConvectionArea(r, dr, dx, isHoriz, outer):
+    innerRadius = (r - dr/2)*INCH
+    outerRadius = (r + dr/2)*INCH
+    theta = 2*np.pi/CHANNELS - LAND_WIDTH/innerRadius
+    side = np.where(outer, 2*np.pi*outerRadius*theta*CHANNELS*dx*INCH, 2*np.pi*innerRadius*theta*CHANNELS*dx*INCH)
+    return np.where(isHoriz, (outerRadius**2 - innerRadius**2)*theta/2*CHANNELS, side)
+
+def CombustionConvectionArea(r, dr, dx, isHoriz, outer):
+    innerRadius = (r - dr/2)*INCH
+    outerRadius = (r + dr/2)*INCH
+    side = np.where(outer, 2*np.pi*outerRadius*dx*INCH, 2*np.pi*innerRadius*dx*INCH)
+    return np.where(isHoriz, np.pi*(outerRadius**2 - innerRadius**2), side)
+
+class ScaledField:
+    # field[index]*scale, the unit conversion is done on the cells asked for instead of the whole grid
+    def __init__(self, field: np.ndarray, scale: float):
+        self.field = field
+        self.scale = scale
+
+    def __getitem__(self, index):
+        return self.field[index]*self.scale
+
+class CellSteps:
+    # width (axis 1) or height (axis 0) of cells by flat grid index
+    def __init__(self, steps: np.ndarray, shape: tuple[int, int], axis: int):
+        self.steps = np.asarray(steps, dtype=float)
+        self.columns = shape[1]
+        self.axis = axis
+
+    def __getitem__(self, index):
+        return self.steps[np.asarray(index) % self.columns] if self.axis == 1 else self.steps[np.asarray(index) // self.columns]
+
+class CellState:
+    # flat float views of the grid fields the resistors read, in kernel units, indexed by flat grid index. dx and dr
+    # are the width and height of every cell in inch, constant on uniform meshes. Nothing is copied, so a block of
+    # cells only costs what it reads
+    def __init__(self, grid, xsteps: np.ndarray, rsteps: np.ndarray):
+        self.material = grid.material.ravel()
+        self.temperature = np.asarray(grid.temperature, dtype=float).ravel()
+        self.pressure = np.asarray(grid.pressure, dtype=float).ravel()
+        self.velocity = np.asarray(grid.velocity, dtype=float).ravel()
+        self.x = np.asarray(grid.x, dtype=float).ravel()
+        self.r = np.asarray(grid.r, dtype=float).ravel()
+        self.area = ScaledField(np.asarray(grid.area, dtype=float).ravel(), INCH**2)
+        self.hydraulicDiameter = ScaledField(np.asarray(grid.hydraulicDiameter, dtype=float).ravel(), INCH)
+        self.previousFlow = np.asarray(grid.previousFlow).reshape(-1, 2)
+        self.dx = CellSteps(xsteps, grid.shape, 1)
+        self.dr = CellSteps(rsteps, grid.shape, 0)
+
+    def Conductivity(self, cells: np.ndarray):
+        isWall = np.isin(self.material[cells], [m.value for m in MaterialType.WALL])
+        k = np.empty(cells.shape)
+        k[isWall] = ConductivityGrcop(self.temperature[cells[isWall]])
+        k[~isWall] = ConductivityRP1(self.temperature[cells[~isWall]])
+        return k
+
+def FaceRadius(state: CellState, sink, source):
+    # radius of the face between two cells of one column, the sink's edge towards the source
+    return state.r[sink] + np.where(state.r[source] > state.r[sink], 1, -1)*state.dr[sink]/2
+
+def ConductionFactor(state: CellState, sink, source, isHoriz):
+    # ConductionResistor times the conductivity of the sink, 1/ft. Axially the path is center to center, half of each
+    # cell's width, radially the log of the center radii, both hold across a change in cell size
+    L = state.dx[sink]*INCH
+    with np.errstate(divide='ignore', invalid='ignore'):
+        radial = np.log(np.maximum(state.r[source], state.r[sink]) / np.minimum(state.r[source], state.r[sink])) / (2*np.pi*L)
+    return np.where(isHoriz, (state.dx[sink] + state.dx[source])/2*INCH / RingArea(state.r[sink], state.dr[sink]), radial)
+
+def ConductionHalfFactor(state: CellState, sink, source, isHoriz, sinkSide: bool):
+    # center of one cell to the face it shares with the other, times the conductivity of that cell
+    cell = sink if sinkSide else source
+    L = state.dx[sink]*INCH
+    rWall = FaceRadius(state, sink, source)
+    rCell = state.r[cell]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        radial = np.log(np.maximum(rCell, rWall) / np.minimum(rCell, rWall)) / (2*np.pi*L)
+    return np.where(isHoriz, (state.dx[cell]/2*INCH) / RingArea(state.r[sink], state.dr[sink]), radial)
+
+class FaceTerm(IntEnum):
+    # what a term of a face resistance multiplies its geometric factor with
+    NONE = 0
+    CONDUCTION = 1 # factor/k of the term cell
+    COOLANT = 2 # 1/(h*factor), coolant film coefficient of the term cell
+    GAS = 3 # 1/(h*factor), hot gas film coefficient of the term cell against the wall cell
+    ADIABATIC = 4 # the factor is the resistance
+
+def HalfTerms(state: CellState, sink, source, isHoriz, sinkTop, halfMaterial, sinkSide: bool):
+    # kind, term cell, wall cell and factor of one half of the faces, see FaceGeometry
+    kind = np.full(sink.shape, FaceTerm.NONE, dtype=np.int8)
+    cell = np.where(sinkSide, sink, source)
+    wall = np.full(sink.shape, -1, dtype=np.int64)
+    factor = np.zeros(sink.shape)
+    solid = np.isin(halfMaterial, [m.value for m in MaterialType.SOLID])
+    fluid = np.isin(halfMaterial, [m.value for m in MaterialType.FLUID])
+    adiabatic = np.isin(halfMaterial, [m.value for m in MaterialType.ADIABATIC])
+    if np.any(~(solid | fluid | adiabatic)):
+        raise ValueError("Material not recognized")
+
+    kind[solid] = FaceTerm.CONDUCTION
+    factor[solid] = ConductionHalfFactor(state, sink[solid], source[solid], isHoriz[solid], sinkSide)
+
+    # ConvectionHalfResistor, the film is on the side of the fluid cell whichever half it was asked for
+    s, o = sink[fluid], source[fluid]
+    fluidSink = np.isin(state.material[s], [m.value for m in MaterialType.COOLANT | MaterialType.EXHAUST])
+    c = np.where(fluidSink, s, o)
+    outer = sinkTop[fluid] ^ fluidSink
+    isCoolant = np.isin(state.material[c], [m.value for m in MaterialType.COOLANT])
+    dx, dr = state.dx[c], state.dr[c]
+    cell[fluid] = c
+    wall[fluid] = np.where(isCoolant, -1, np.where(fluidSink, o, s)) # hot gas faces take the temperature of the wall on the other side
+    kind[fluid] = np.where(isCoolant, FaceTerm.COOLANT, FaceTerm.GAS)
+    factor[fluid] = np.where(isCoolant, CoolantConvectionArea(state.r[c], dr, dx, isHoriz[fluid], outer), CombustionConvectionArea(state.r[c], dr, dx, isHoriz[fluid], outer))
+
+    kind[adiabatic] = FaceTerm.ADIABATIC
+    factor[adiabatic] = R_ADIABATIC
+    return kind, cell, wall, factor
+
+def Conductance(R: np.ndarray):
+    used = ~((R > R_MAX) | (R <= R_MIN))
+    with np.errstate(divide='ignore'):
+        return np.where(used, 1/R, 0.0)
+
+@dataclass
+class FaceGeometry:
+    # the temperature independent part of the resistors of the cells rows, cols. Face i of cell[i] in direction face[i]
+    # has the resistance of its two terms added up, each a FaceTerm kind, the flat grid index of the cell whose
+    # conductivity or film coefficient it takes, the wall cell a hot gas term takes its wall temperature from and a
+    # geometric factor. Every area, log of radii and arc angle is in the factors, so evaluating the resistors only
+    # needs k, h and the coolant flow terms at the current state. Built once per mesh, see ForDomain
+    rows: np.ndarray
+    cols: np.ndarray
+    cell: np.ndarray
+    face: np.ndarray
+    kind: np.ndarray # (faces, 2)
+    termCell: np.ndarray # (faces, 2)
+    wall: np.ndarray # (faces, 2)
+    factor: np.ndarray # (faces, 2)
+    coolant: np.ndarray # coolant wall cells by their position in rows, cols
+    deltaL: np.ndarray # their distance to the upstream cell, ft
+
+    ARRAYS = ("rows", "cols", "cell", "face", "kind", "termCell", "wall", "factor", "coolant", "deltaL")
+
+    @staticmethod
+    def Build(domain, rows: np.ndarray, cols: np.ndarray):
+        grid = domain.grid
+        shape = grid.shape
+        state = CellState(grid, domain.xsteps, domain.rsteps)
+        material = state.material[rows*shape[1] + cols]
+        isBulk = material == DomainMaterial.COOLANT_BULK
+        isWall = np.isin(material, [m.value for m in MaterialType.WALL])
+        core = isWall & ~grid.border[rows, cols]
+
+        neighbors = domain.cells.NeighborTable(rows, cols)
+        cell, face = np.nonzero((neighbors >= 0) & ~isBulk[:, None])
+        sink = rows[cell]*shape[1] + cols[cell]
+        source = neighbors[cell, face]
+        isHoriz = (face == Direction.LEFT) | (face == Direction.RIGHT)
+        sinkTop = face == Direction.UPPER
+
+        kind = np.zeros((cell.size, 2), dtype=np.int8)
+        termCell = np.zeros((cell.size, 2), dtype=np.int64)
+        wall = np.full((cell.size, 2), -1, dtype=np.int64)
+        factor = np.zeros((cell.size, 2))
+        full = core[cell]
+        kind[full, 0] = FaceTerm.CONDUCTION
+        termCell[full, 0] = sink[full]
+        factor[full, 0] = ConductionFactor(state, sink[full], source[full], isHoriz[full])
+        half = ~full
+        faceMaterial = grid.faceMaterial.reshape(-1, 4)[sink[half], face[half]]
+        for side, (halfMaterial, sinkSide) in enumerate([(faceMaterial, False), (state.material[sink[half]], True)]):
+            terms = HalfTerms(state, sink[half], source[half], isHoriz[half], sinkTop[half], halfMaterial, sinkSide)
+            for array, values in zip((kind, termCell, wall, factor), terms):
+                array[half, side] = values
+
+        coolant = np.nonzero(np.isin(material, [m.value for m in MaterialType.COOLANT]) & ~isBulk)[0]
+        c = rows[coolant]*shape[1] + cols[coolant]
+        upstream = state.previousFlow[c, 0]*shape[1] + state.previousFlow[c, 1]
+        deltaL = np.sqrt((state.x[c] - state.x[upstream])**2 + (state.r[c] - state.r[upstream])**2)*INCH
+        return FaceGeometry(rows, cols, cell, face.astype(np.int8), kind, termCell, wall, factor, coolant, deltaL)
+
+    @staticmethod
+    def Fingerprint(domain, rows: np.ndarray, cols: np.ndarray):
+        # everything the factors are built from, the layout, borders, flow paths, cell sizes and the channel design
+        grid = domain.grid
+        digest = hashlib.sha1(repr((GEOMETRY_VERSION, grid.shape, domain.x0, domain.r0, CHANNELS, LAND_WIDTH)).encode())
+        for array in (grid.material, grid.faceMaterial, grid.border, grid.previousFlow, grid.x, grid.r, domain.xsteps, domain.rsteps, rows, cols):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def ForDomain(domain, rows: np.ndarray, cols: np.ndarray):
+        # the geometry stored with the mesh of a DomainMMAP when it was built for these cells, otherwise it is built
+        # and stored there for the next run on the mesh
+        path = getattr(domain, 'workingFolder', None)
+        fingerprint = FaceGeometry.Fingerprint(domain, rows, cols)
+        if path is not None:
+            header = mesh_file.ReadHeader(path)
+            if header.get("metadata", {}).get("faceGeometry") == fingerprint:
+                print("Using the face geometry stored with the mesh")
+                return FaceGeometry.FromArrays(mesh_file.ReadArrays(path, header, 'r'), "faceGeometry")
+        geometry = FaceGeometry.Build(domain, rows, cols)
+        if path is not None:
+            mesh_file.UpdateArrays(path, geometry.ToArrays("faceGeometry"), {"faceGeometry": fingerprint})
+        return geometry
+
+    def ToArrays(self, prefix: str):
+        return {f"{prefix}.{name}": getattr(self, name) for name in self.ARRAYS}
+
+    @staticmethod
+    def FromArrays(arrays: dict[str, np.ndarray], prefix: str, copy: bool = True):
+        # copy=False keeps the memmaps of a mesh, see parallel
+        return FaceGeometry(*((np.array if copy else np.asarray)(arrays[f"{prefix}.{name}"]) for name in FaceGeometry.ARRAYS))
+
+    def Block(self, start: int, stop: int):
+        # the geometry of the cells start:stop, their faces and coolant cells are numbered from start. Faces and
+        # coolant cells are sorted by cell, so this is slicing
+        faces = slice(*np.searchsorted(self.cell, [start, stop]))
+        coolant = slice(*np.searchsorted(self.coolant, [start, stop]))
+        return FaceGeometry(self.rows[start:stop], self.cols[start:stop], self.cell[faces] - start, self.face[faces], self.kind[faces],
+                            self.termCell[faces], self.wall[faces], self.factor[faces], self.coolant[coolant] - start, self.deltaL[coolant])
+
+    def Coefficients(self, domain):
+        # calc_cell.CellCoefficients for all the cells at once, returns the face conductances (n, 4) in BTU/(hr*degR),
+        # the coolant mdot*cp in BTU/(hr*degR) and the coolant pressure drop in psi. k and h are evaluated once per
+        # cell they are needed for, the hot gas one once per face since it depends on the wall temperature
+        state = CellState(domain.grid, domain.xsteps, domain.rsteps)
+        kind, cell, factor = self.kind, self.termCell, self.factor
+        R = np.zeros(kind.shape)
+        with np.errstate(divide='ignore'):
+            conduction = kind == FaceTerm.CONDUCTION
+            cells, inverse = np.unique(cell[conduction], return_inverse=True)
+            R[conduction] = factor[conduction] / state.Conductivity(cells)[inverse]
+
+            coolant = kind == FaceTerm.COOLANT
+            c, inverse = np.unique(cell[coolant], return_inverse=True)
+            h = CoolantConvection(state.temperature[c], state.pressure[c], state.area[c], state.hydraulicDiameter[c])
+            R[coolant] = 1 / (h[inverse]*factor[coolant])
+
+            gas = kind == FaceTerm.GAS
+            h = BartzEvaluator.ForDomain(domain)(state.temperature[self.wall[gas]], state.velocity[cell[gas]], state.temperature[cell[gas]])
+            R[gas] = 1 / (h*factor[gas])
+
+        adiabatic = kind == FaceTerm.ADIABATIC
+        R[adiabatic] = factor[adiabatic]
+
+        G = np.zeros((self.rows.size, 4))
+        G[self.cell, self.face] = Conductance(R[:, 0] + R[:, 1])
+
+        capacityRate = np.zeros(self.rows.size)
+        pressureDrop = np.zeros(self.rows.size)
+        c = self.rows[self.coolant]*domain.grid.shape[1] + self.cols[self.coolant]
+        capacityRate[self.coolant], pressureDrop[self.coolant] = CoolantFlowTerms(state.temperature[c], state.pressure[c], state.area[c], state.hydraulicDiameter[c], self.deltaL)
+        return G, capacityRate, pressureDrop
+
+    def HeatCapacity(self, domain):
+        # rho*cp*V of the cells in BTU/degR. Walls are the full ring of the cell, a coolant wall cell the channel volume
+        # since its upstream cell, the bulk cells riding on it have none of their own
+        state = CellState(domain.grid, domain.xsteps, domain.rsteps)
+        flat = self.rows*domain.grid.shape[1] + self.cols
+        capacity = np.zeros(self.rows.size)
+        isWall = np.isin(state.material[flat], [m.value for m in MaterialType.WALL])
+        w = flat[isWall]
+        capacity[isWall] = GRCOP_DENSITY*SpecificHeatGrcop(state.temperature[w])*RingArea(state.r[w], state.dr[w])*state.dx[w]*INCH
+        c = flat[self.coolant]
+        properties = CoolantProperties(state.temperature[c], state.pressure[c])
+        capacity[self.coolant] = properties["density"]*properties["specificHeat"]*state.area[c]*CHANNELS*self.deltaL
+        return capacity
+
+def CellCoefficientsArray(domain, rows: np.ndarray, cols: np.ndarray):
+    # one off FaceGeometry.Coefficients, builds the geometry and throws it away
+    return FaceGeometry.Build(domain, rows, cols).Coefficients(domain)
@@ -5,6 +5,7 @@ from icecream import ic
 from enum import IntEnum
 
 from nozzle.nozzle import ContourPoint
+from general.units import Direction
 
 class DomainMaterial(IntEnum):
     FREE = 0 
@@ -27,6 +28,26 @@ class MaterialType:
     SOLID = {DomainMaterial.COWL, DomainMaterial.PLUG}
     FLUID = {DomainMaterial.COOLANT, DomainMaterial.COOLANT_WALL, DomainMaterial.COOLANT_BULK, DomainMaterial.COOLANT_INLET, DomainMaterial.CHAMBER}
 
+OFF_DOMAIN = -1 # face code for a neighbor outside of the grid
+
+def FindBorders(materials: np.ndarray):
+    # a cell is a border when its up, down, left and right neighbors are not all the same material. Neighbors past the
+    # edge of the grid are clamped back onto the edge row/column
+    padded = np.pad(materials, 1, mode='edge')
+    up = padded[:-2, 1:-1]
+    down = padded[2:, 1:-1]
+    left = padded[1:-1, :-2]
+    right = padded[1:-1, 2:]
+    border = ~((up == down) & (down == left) & (left == right))
+
+    # neighbor material across each face, indexed by Direction, faces on the edge of the grid get OFF_DOMAIN
+    faces = np.full((*materials.shape, 4), OFF_DOMAIN, dtype=np.int8)
+    faces[:, 1:, Direction.LEFT] = materials[:, :-1]
+    faces[1:, :, Direction.UPPER] = materials[:-1, :]
+    faces[:-1, :, Direction.LOWER] = materials[1:, :]
+    faces[:, :-1, Direction.RIGHT] = materials[:, 1:]
+    return border, faces
+
 def isIntersect(Point, contour: np.ndarray[ContourPoint], domainSize: tuple[int, int]):
     if contour.size == 0:
         return False
@@ -58,6 +79,190 @@ def is_point_on_segment(Point, C, D):
 def ccw(A,B,C):
     return (C[1]-A[1]) * (B[0]-A[0]) > (B[1]-A[1]) * (C[0]-A[0])
 
+def ContourArray(contour: np.ndarray[ContourPoint]) -> np.ndarray:
+    return np.array([[p.x, p.r] for p in contour], dtype=float).reshape(-1, 2)
+
+def isIntersectArray(x: np.ndarray, r: np.ndarray, contour: np.ndarray[ContourPoint], domainSize: tuple[int, int], chunkSize: int = 2_000_000):
+    # batched isIntersect, every point is tested against every segment at once with the same float expressions
+    x = np.asarray(x, dtype=float)
+    r = np.asarray(r, dtype=float)
+    inside = np.zeros(x.shape, dtype=bool)
+    if contour.size == 0:
+        return inside
+
+    vertices = ContourArray(contour)
+    C = vertices
+    D = np.roll(vertices, -1, axis=0) # last segment closes the polygon back to the first point
+    onSegment = np.arange(len(C)) < len(C) - 1 # the on the line rule is only applied to the open contour segments
+
+    px = x.reshape(-1)
+    py = r.reshape(-1)
+    flatInside = inside.reshape(-1)
+    rows = max(1, chunkSize // len(C))
+    for start in range(0, px.size, rows):
+        Ax = px[start:start+rows, np.newaxis]
+        Ay = py[start:start+rows, np.newaxis]
+        By = Ay + domainSize[1]
+        Bx = Ax
+        Cx, Cy, Dx, Dy = C[:, 0], C[:, 1], D[:, 0], D[:, 1]
+
+        ccwACD = (Dy - Ay) * (Cx - Ax) > (Cy - Ay) * (Dx - Ax)
+        ccwBCD = (Dy - By) * (Cx - Bx) > (Cy - By) * (Dx - Bx)
+        ccwABC = (Cy - Ay) * (Bx - Ax) > (By - Ay) * (Cx - Ax)
+        ccwABD = (Dy - Ay) * (Bx - Ax) > (By - Ay) * (Dx - Ax)
+        check = np.count_nonzero((ccwACD != ccwBCD) & (ccwABC != ccwABD), axis=1)
+
+        collinear = (Dy - Cy) * (Ax - Cx) == (Ay - Cy) * (Dx - Cx)
+        withinBounds = (np.minimum(Cx, Dx) <= Ax) & (Ax <= np.maximum(Cx, Dx)) & (np.minimum(Cy, Dy) <= Ay) & (Ay <= np.maximum(Cy, Dy))
+        onTheLine = np.any(collinear & withinBounds & onSegment, axis=1)
+
+        flatInside[start:start+rows] = (np.mod(check, 2) == 1) | onTheLine
+    return inside
+
+def ClassifyPoints(x: np.ndarray, r: np.ndarray, contours: list[tuple[np.ndarray, DomainMaterial]], domainSize: tuple[int, int]):
+    # first contour a point falls in wins, same precedence as checking isIntersect contour by contour
+    x = np.asarray(x, dtype=float)
+    r = np.asarray(r, dtype=float)
+    materials = np.full(x.size, DomainMaterial.FREE.value, dtype=np.int8)
+    unassigned = np.arange(x.size)
+    for contour, mat in contours:
+        inside = isIntersectArray(x.reshape(-1)[unassigned], r.reshape(-1)[unassigned], contour, domainSize)
+        materials[unassigned[inside]] = mat.value
+        unassigned = unassigned[~inside]
+    return materials.reshape(x.shape)
+
+@dataclass
+class RasterResult:
+    inside: np.ndarray # cell centers inside the polygon, (rows, cols)
+    coverage: np.ndarray # fraction of each cell covered by the polygon, between 0 and 1
+
+def ScanlineCrossings(contour: np.ndarray[ContourPoint], rRows: np.ndarray):
+    # every crossing of the closed contour with the horizontal lines r = rRows, returned as (row index, x) sorted by row then x
+    rRows = np.asarray(rRows, dtype=float)
+    vertices = ContourArray(contour)
+    if vertices.size == 0:
+        return np.array([], dtype=int), np.array([], dtype=float)
+    C = vertices
+    D = np.roll(vertices, -1, axis=0)
+    C, D = C[C[:, 1] != D[:, 1]], D[C[:, 1] != D[:, 1]] # horizontal segments never cross a scanline
+
+    # half open rule rLow <= r < rHigh so a scanline through a vertex is counted once
+    rLow = np.minimum(C[:, 1], D[:, 1])
+    rHigh = np.maximum(C[:, 1], D[:, 1])
+    order = np.argsort(rRows)
+    rSorted = rRows[order]
+    first = np.searchsorted(rSorted, rLow, side='left')
+    last = np.searchsorted(rSorted, rHigh, side='left')
+    counts = last - first
+
+    segment = np.repeat(np.arange(len(C)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rowIdx = order[np.repeat(first, counts) + offsets]
+    r = rRows[rowIdx]
+    x = C[segment, 0] + (r - C[segment, 1]) * (D[segment, 0] - C[segment, 0]) / (D[segment, 1] - C[segment, 1])
+
+    sort = np.lexsort((x, rowIdx))
+    return rowIdx[sort], x[sort]
+
+def RowIntervals(contour: np.ndarray[ContourPoint], rRows: np.ndarray):
+    # even-odd pairing of the sorted crossings, each (row, xStart, xEnd) is a run inside the polygon
+    rowIdx, x = ScanlineCrossings(contour, rRows)
+    return rowIdx[0::2], x[0::2], x[1::2]
+
+def HorizontalEdgesOnRows(contour: np.ndarray[ContourPoint], rRows: np.ndarray):
+    vertices = ContourArray(contour)
+    if vertices.size == 0:
+        return np.array([], dtype=int), np.array([], dtype=float), np.array([], dtype=float)
+    C = vertices
+    D = np.roll(vertices, -1, axis=0)
+    flat = C[:, 1] == D[:, 1]
+    rows, segment = np.nonzero(np.asarray(rRows, dtype=float)[:, np.newaxis] == C[flat, 1])
+    C, D = C[flat][segment], D[flat][segment]
+    return rows, np.minimum(C[:, 0], D[:, 0]), np.maximum(C[:, 0], D[:, 0])
+
+def RowCrossings(contour: np.ndarray[ContourPoint], rRows: np.ndarray) -> list[np.ndarray]:
+    rowIdx, x = ScanlineCrossings(contour, rRows)
+    return np.split(x, np.searchsorted(rowIdx, np.arange(1, len(rRows))))
+
+def CellsOnContour(rowIdx: np.ndarray, x: np.ndarray, flatRows: np.ndarray, flatStart: np.ndarray, flatEnd: np.ndarray, x0: float, xstep: float, shape: tuple[int, int]):
+    # row and column of the cell centers on either side of every point x on row rowIdx (the crossings and the vertices
+    # lying on a row) and along every horizontal edge on a row, each cell once. Every center on the contour is among them
+    vpoints, hpoints = shape
+    first = np.floor((flatStart - x0) / xstep).astype(int)
+    counts = np.maximum(np.floor((flatEnd - x0) / xstep).astype(int) + 2 - first, 0)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    crossing = np.floor((x - x0) / xstep).astype(int)
+    rows = np.concatenate([rowIdx, rowIdx, np.repeat(flatRows, counts)])
+    cols = np.concatenate([crossing, crossing + 1, np.repeat(first, counts) + offsets])
+    keep = (cols >= 0) & (cols < hpoints)
+    return np.unravel_index(np.unique(np.ravel_multi_index((rows[keep], cols[keep]), shape)), shape)
+
+def RasterizeContour(contour: np.ndarray[ContourPoint], x0: float, xstep: float, hpoints: int, rRows: np.ndarray, rstep: float, domainSize: tuple[int, int], subRows: int = 4) -> RasterResult:
+    rRows = np.asarray(rRows, dtype=float)
+    vpoints = len(rRows)
+
+    # cell centers, filled run by run from the entry and exit crossing of each interval
+    rowIdx, x = ScanlineCrossings(contour, rRows)
+    rows, start, end = rowIdx[0::2], x[0::2], x[1::2]
+    colStart = np.clip(np.ceil((start - x0) / xstep), 0, hpoints).astype(int)
+    colEnd = np.clip(np.floor((end - x0) / xstep) + 1, 0, hpoints).astype(int)
+    colEnd = np.maximum(colEnd, colStart)
+    fill = np.zeros((vpoints, hpoints + 1), dtype=int)
+    np.add.at(fill, (rows, colStart), 1)
+    np.add.at(fill, (rows, colEnd), -1)
+    inside = np.cumsum(fill, axis=1)[:, :-1] > 0
+
+    # the centers next to the contour are settled by isIntersectArray, so a center on it follows the on the line rule
+    # of isIntersect, which leaves out the closing segment. Both methods then agree wherever the contour stays within
+    # the domain height above a cell, the length of the ray isIntersect casts
+    # peaks and troughs of the contour have no crossing under the half open rule, their vertices are added
+    vertices = ContourArray(contour)
+    vertexRows, vertex = np.nonzero(rRows[:, np.newaxis] == vertices[:, 1])
+    flatRows, flatStart, flatEnd = HorizontalEdgesOnRows(contour, rRows)
+    edgeRows, edgeCols = CellsOnContour(np.concatenate([rowIdx, vertexRows]), np.concatenate([x, vertices[vertex, 0]]), flatRows, flatStart, flatEnd,
+                                        x0, xstep, (vpoints, hpoints))
+    inside[edgeRows, edgeCols] = isIntersectArray(x0 + edgeCols * xstep, rRows[edgeRows], contour, domainSize)
+
+    # area coverage from subRows scanlines per row, the horizontal overlap of every run with each cell is exact
+    offsets = ((np.arange(subRows) + 0.5) / subRows - 0.5) * rstep
+    subR = (rRows[:, np.newaxis] + offsets).reshape(-1)
+    rows, start, end = RowIntervals(contour, subR)
+    rows = rows // subRows
+    edge0 = x0 - xstep / 2
+    start = np.clip(start, edge0, edge0 + hpoints * xstep)
+    end = np.clip(end, edge0, edge0 + hpoints * xstep)
+    keep = end > start
+    rows, start, end = rows[keep], start[keep], end[keep]
+
+    cellStart = np.minimum(((start - edge0) // xstep).astype(int), hpoints - 1)
+    cellEnd = np.minimum(((end - edge0) // xstep).astype(int), hpoints - 1)
+    covered = np.zeros((vpoints, hpoints + 1))
+    same = cellStart == cellEnd
+    np.add.at(covered, (rows[same], cellStart[same]), (end[same] - start[same]) / xstep)
+    rows, start, end, cellStart, cellEnd = rows[~same], start[~same], end[~same], cellStart[~same], cellEnd[~same]
+    np.add.at(covered, (rows, cellStart), (edge0 + (cellStart + 1) * xstep - start) / xstep)
+    np.add.at(covered, (rows, cellEnd), (end - (edge0 + cellEnd * xstep)) / xstep)
+    full = np.zeros((vpoints, hpoints + 1))
+    np.add.at(full, (rows, cellStart + 1), 1)
+    np.add.at(full, (rows, cellEnd), -1)
+    coverage = (covered + np.cumsum(full, axis=1))[:, :-1] / subRows
+
+    return RasterResult(inside, np.clip(coverage, 0, 1))
+
+def RasterizeMaterials(contours: list[tuple[np.ndarray, DomainMaterial]], x0: float, xstep: float, hpoints: int, rRows: np.ndarray, rstep: float, domainSize: tuple[int, int], subRows: int = 4):
+    # scanline counterpart of ClassifyPoints, returns the material array and the coverage of every contour
+    materials = np.full((len(rRows), hpoints), DomainMaterial.FREE.value, dtype=np.int8)
+    unassigned = np.ones(materials.shape, dtype=bool)
+    coverage = {}
+    for contour, mat in contours:
+        if contour.size == 0:
+            continue
+        raster = RasterizeContour(contour, x0, xstep, hpoints, rRows, rstep, domainSize, subRows)
+        materials[raster.inside & unassigned] = mat.value
+        unassigned &= ~raster.inside
+        coverage[mat] = raster.coverage
+    return materials, coverage
+
 def intersectPolyAt(polygon, point1, point2):
     Sx, Sy = point1
     Tx, Ty = point2
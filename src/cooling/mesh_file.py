@@ -0,0 +1,204 @@
+from collections.abc import MutableMapping
+import json
+import os
+import sys
+import numpy as np
+
+from cooling.grid import DomainGrid, GRID_FIELDS
+from cooling.material import DomainMaterial
+
+# On disk a mesh is a directory holding one raw little endian binary file per grid field plus header.json, which
+# records the grid origin and steps, the dtype, shape and unit of every field and the enum values used for materials.
+# Arrays that are not per cell (the coolant flow paths, the resistor geometry of kernels.FaceGeometry) are stored the
+# same way under "arrays", with whatever they need to be rebuilt under "metadata".
+MESH_FORMAT = "solaris-cooling-mesh"
+MESH_VERSION = 1
+MESH_SUFFIX = ".mesh"
+HEADER_NAME = "header.json"
+
+ENUMS = {"DomainMaterial": DomainMaterial}
+
+class FieldOpener:
+    def __init__(self, path: str, header: dict, mode: str):
+        self.path = path
+        self.header = header
+        self.mode = mode
+
+    def __call__(self, name: str) -> np.ndarray:
+        entry = self.header["fields"][name]
+        array = np.memmap(os.path.join(self.path, entry["file"]), dtype=np.dtype(entry["dtype"]), mode=self.mode, shape=tuple(entry["shape"]))
+        remap = EnumRemap(self.header, entry)
+        if remap is not None:
+            array = remap[array.astype(np.int64) + 1].astype(array.dtype)
+        return array
+
+class LazyFields(MutableMapping):
+    # field dictionary of a grid opened from disk, a field is only mapped the first time it is used
+    def __init__(self, opener: FieldOpener, names: list[str]):
+        self.opener = opener
+        self.names = list(names)
+        self.opened = {}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self.opened:
+            if name not in self.names:
+                raise KeyError(name)
+            self.opened[name] = self.opener(name)
+        return self.opened[name]
+
+    def __setitem__(self, name: str, value: np.ndarray):
+        if name not in self.names:
+            self.names.append(name)
+        self.opened[name] = value
+
+    def __delitem__(self, name: str):
+        self.names.remove(name)
+        self.opened.pop(name, None)
+
+    def __contains__(self, name) -> bool:
+        return name in self.names
+
+    def __iter__(self):
+        return iter(list(self.names))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+def EnumRemap(header: dict, entry: dict):
+    # lookup table from the stored enum values to the current ones, None when they already agree. Index is value + 1
+    # so the -1 OFF_DOMAIN face code maps to itself
+    enumName = entry.get("enum")
+    if enumName is None:
+        return None
+    stored = header["enums"][enumName]
+    current = {member.name: member.value for member in ENUMS[enumName]}
+    if stored == current:
+        return None
+    table = np.arange(-1, max(stored.values()) + 1)
+    for name, value in stored.items():
+        if name not in current:
+            raise ValueError(f"Mesh uses {enumName}.{name} which no longer exists")
+        table[value + 1] = current[name]
+    return table
+
+def MeshPath(filename: str) -> str:
+    return filename if filename.endswith(MESH_SUFFIX) else filename + MESH_SUFFIX
+
+def isMesh(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, HEADER_NAME))
+
+def WriteMesh(path: str, grid: DomainGrid, geometry: dict, arrays: dict[str, np.ndarray] | None = None, metadata: dict | None = None):
+    os.makedirs(path, exist_ok=True)
+    header = {
+        "format": MESH_FORMAT,
+        "version": MESH_VERSION,
+        "geometry": {key: float(value) for key, value in geometry.items()},
+        "shape": list(grid.shape),
+        "fields": {},
+        "enums": {name: {member.name: member.value for member in enum} for name, enum in ENUMS.items()},
+        "arrays": {},
+        "metadata": {} if metadata is None else metadata,
+    }
+
+    for name in grid.fields:
+        WriteField(path, name, grid.fields[name])
+        header["fields"][name] = FieldEntry(name, grid.fields[name], grid.units.get(name))
+
+    for name, array in ({} if arrays is None else arrays).items():
+        array = np.asarray(array)
+        WriteField(path, f"array.{name}", array)
+        header["arrays"][name] = ArrayEntry(name, array)
+
+    # header goes last so a half written mesh is never picked up as a valid one
+    WriteHeader(path, header)
+
+def WriteHeader(path: str, header: dict):
+    # written next to the old header and swapped in, a reader sees either the old or the new one
+    temporary = os.path.join(path, HEADER_NAME + ".tmp")
+    with open(temporary, 'w') as f:
+        json.dump(header, f, indent=2)
+    os.replace(temporary, os.path.join(path, HEADER_NAME))
+
+def UpdateMesh(path: str, fields: dict[str, np.ndarray], metadata: dict | None = None):
+    # rewrites only the given fields of an existing mesh and merges metadata into its header. Every file is swapped in
+    # whole, so a run killed part way leaves each field as either the old or the new one
+    header = ReadHeader(path)
+    for name, field in fields.items():
+        entry = header["fields"][name]
+        if list(field.shape) != entry["shape"]:
+            raise ValueError(f"{name} is {field.shape}, the mesh holds {tuple(entry['shape'])}")
+        target = os.path.join(path, entry["file"])
+        np.ascontiguousarray(field, dtype=np.dtype(entry["dtype"])).tofile(target + ".tmp")
+        os.replace(target + ".tmp", target)
+    if metadata:
+        header.setdefault("metadata", {}).update(metadata)
+    WriteHeader(path, header)
+
+def UpdateArrays(path: str, arrays: dict[str, np.ndarray], metadata: dict | None = None):
+    # adds or replaces arrays of an existing mesh, swapped in like UpdateMesh does with fields
+    header = ReadHeader(path)
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        entry = ArrayEntry(name, array)
+        target = os.path.join(path, entry["file"])
+        np.ascontiguousarray(array, dtype=np.dtype(entry["dtype"])).tofile(target + ".tmp")
+        os.replace(target + ".tmp", target)
+        header.setdefault("arrays", {})[name] = entry
+    if metadata:
+        header.setdefault("metadata", {}).update(metadata)
+    WriteHeader(path, header)
+
+def ArrayEntry(name: str, array: np.ndarray) -> dict:
+    return {"file": f"array.{name}.bin", "dtype": np.dtype(array.dtype).newbyteorder('<').str, "shape": list(array.shape)}
+
+def FieldEntry(name: str, field: np.ndarray, unit: str | None) -> dict:
+    dtype = np.dtype(field.dtype).newbyteorder('<')
+    entry = {"file": f"{name}.bin", "dtype": dtype.str, "shape": list(field.shape), "unit": unit}
+    spec = GRID_FIELDS.get(name)
+    if spec is not None and spec.enum is not None:
+        entry["enum"] = spec.enum.__name__
+    return entry
+
+def WriteField(path: str, name: str, field: np.ndarray):
+    # field may be a memmap of the very file it is written to when a mesh is saved where it was loaded from, it is
+    # written next to it and swapped in so the mapping keeps reading the old file until it is closed
+    dtype = np.dtype(field.dtype).newbyteorder('<')
+    target = os.path.join(path, f"{name}.bin")
+    np.ascontiguousarray(field, dtype=dtype).tofile(target + ".tmp")
+    os.replace(target + ".tmp", target)
+
+def ReadHeader(path: str) -> dict:
+    with open(os.path.join(path, HEADER_NAME), 'r') as f:
+        header = json.load(f)
+    if header.get("format") != MESH_FORMAT:
+        raise ValueError(f"{path} is not a cooling mesh")
+    if header["version"] > MESH_VERSION:
+        raise ValueError(f"{path} is mesh version {header['version']}, this code reads up to version {MESH_VERSION}")
+    return header
+
+def ReadMesh(path: str, mode: str = 'c'):
+    # mode is the np.memmap mode, 'r' read only, 'r+' writes go to the file, 'c' writes stay in memory
+    header = ReadHeader(path)
+    vpoints, hpoints = header["shape"]
+    fields = LazyFields(FieldOpener(path, header, mode), header["fields"].keys())
+    grid = DomainGrid(vpoints, hpoints, fields)
+    grid.units.update({name: entry["unit"] for name, entry in header["fields"].items() if entry["unit"] is not None})
+    return grid, header["geometry"], header
+
+def ReadArrays(path: str, header: dict, mode: str = 'c') -> dict[str, np.ndarray]:
+    arrays = {}
+    for name, entry in header.get("arrays", {}).items():
+        if 0 in entry["shape"]: # np.memmap refuses empty files
+            arrays[name] = np.zeros(entry["shape"], dtype=np.dtype(entry["dtype"]))
+        else:
+            arrays[name] = np.memmap(os.path.join(path, entry["file"]), dtype=np.dtype(entry["dtype"]), mode=mode, shape=tuple(entry["shape"]))
+    return arrays
+
+def main():
+    # python -m cooling.mesh_file old.msh.z [...] converts joblib meshes to the columnar format next to them
+    from cooling.domain import DomainMC
+    for filename in sys.argv[1:]:
+        DomainMC.ImportLegacyFile(filename.removesuffix('.msh.z'))
+
+if __name__ == "__main__":
+    main()
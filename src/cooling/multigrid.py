@@ -0,0 +1,125 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, gmres, bicgstab, splu
+
+from cooling.material import MaterialType
+from cooling.network import ThermalNetwork
+
+# Aggregation multigrid for the resistor network. Coarse levels merge 2x2 blocks of cells of the same material, so a
+# coarse cell never averages across a cowl/coolant or plug/coolant interface, and the coarse operators are the Galerkin
+# products R A P of the fine one. A V-cycle with symmetric Gauss-Seidel smoothing is used as the preconditioner of a
+# Krylov solve, which keeps the iteration count roughly flat as ds shrinks.
+
+def Aggregate(rows: np.ndarray, cols: np.ndarray, groups: np.ndarray):
+    # returns the aggregate of every cell and the row, col and group of every aggregate
+    keys = np.stack([rows // 2, cols // 2, groups], axis=1)
+    unique, aggregate = np.unique(keys, axis=0, return_inverse=True)
+    return aggregate.ravel(), unique[:, 0], unique[:, 1], unique[:, 2]
+
+def SpectralRadius(A: sparse.csr_matrix, invDiag: np.ndarray, iterations: int = 20):
+    # power iteration estimate of rho(D^-1 A)
+    x = np.random.default_rng(0).random(A.shape[0])
+    rho = 0.0
+    for _ in range(iterations):
+        y = invDiag * (A @ x)
+        norm = np.linalg.norm(y)
+        if norm == 0:
+            return 0.0
+        rho = norm / np.linalg.norm(x)
+        x = y / norm
+    return rho
+
+def SmoothedProlongation(A: sparse.csr_matrix, aggregate: np.ndarray, groups: np.ndarray, smooth: np.ndarray):
+    # piecewise constant interpolation from the aggregates, smoothed with one damped Jacobi step of A filtered down to
+    # the connections between smoothed cells of the same group. The filtered diagonal is lumped so constants stay in its
+    # null space. Cells with smooth False (the upwinded coolant) keep the piecewise constant rows
+    n = A.shape[0]
+    tentative = sparse.csr_matrix((np.ones(n), (np.arange(n), aggregate)), shape=(n, aggregate.max() + 1))
+    entries = A.tocoo()
+    keep = (entries.row != entries.col) & (groups[entries.row] == groups[entries.col]) & smooth[entries.row] & smooth[entries.col]
+    filtered = sparse.csr_matrix((entries.data[keep], (entries.row[keep], entries.col[keep])), shape=A.shape)
+    diagonal = -np.asarray(filtered.sum(axis=1)).ravel()
+    filtered = (filtered + sparse.diags(diagonal)).tocsr()
+    invDiag = np.divide(1, diagonal, out=np.zeros(n), where=diagonal > 0)
+
+    rho = SpectralRadius(filtered, invDiag)
+    if rho == 0:
+        return tentative
+    return (tentative - 4 / (3 * rho) * sparse.diags(invDiag) @ (filtered @ tentative)).tocsr()
+
+class MultigridLevel:
+    def __init__(self, A: sparse.csr_matrix, P: sparse.csr_matrix):
+        self.A = A
+        self.P = P
+        self.R = P.T.tocsr()
+        # Gauss-Seidel sweeps are triangular solves, natural ordering keeps SuperLU from permuting them
+        self.lower = splu(sparse.tril(A).tocsc(), permc_spec='NATURAL', diag_pivot_thresh=0)
+        self.upper = splu(sparse.triu(A).tocsc(), permc_spec='NATURAL', diag_pivot_thresh=0)
+
+class MultigridSolver:
+    levels: list[MultigridLevel]
+
+    def __init__(self, rows: np.ndarray, cols: np.ndarray, groups: np.ndarray, coarseSize: int = 100, maxLevels: int = 12,
+                 krylov: str = 'gmres', rtol: float = 1e-8, maxiter: int = 500):
+        # the aggregation only depends on the cell layout, the operators are rebuilt for every matrix in Setup
+        self.aggregates = []
+        self.groups = []
+        while rows.size > coarseSize and len(self.aggregates) < maxLevels:
+            aggregate, coarseRows, coarseCols, coarseGroups = Aggregate(rows, cols, groups)
+            if coarseRows.size == rows.size:
+                break
+            self.aggregates.append(aggregate)
+            self.groups.append(groups)
+            rows, cols, groups = coarseRows, coarseCols, coarseGroups
+
+        self.krylov = krylov
+        self.rtol = rtol
+        self.maxiter = maxiter
+        self.levels = []
+        self.iterations = 0
+
+    @staticmethod
+    def ForNetwork(network: ThermalNetwork, **kwargs):
+        return MultigridSolver(network.rows, network.cols, network.material.astype(np.int64), **kwargs)
+
+    def Setup(self, A: sparse.csr_matrix):
+        self.levels = []
+        A = A.tocsr()
+        for aggregate, groups in zip(self.aggregates, self.groups):
+            smooth = ~np.isin(groups, [m.value for m in MaterialType.COOLANT])
+            level = MultigridLevel(A, SmoothedProlongation(A, aggregate, groups, smooth))
+            self.levels.append(level)
+            A = (level.R @ A @ level.P).tocsr()
+        self.coarse = splu(A.tocsc())
+
+    def VCycle(self, b: np.ndarray, depth: int = 0):
+        if depth == len(self.levels):
+            return self.coarse.solve(b)
+        level = self.levels[depth]
+        x = level.lower.solve(b)
+        x += level.P @ self.VCycle(level.R @ (b - level.A @ x), depth + 1)
+        x += level.upper.solve(b - level.A @ x)
+        return x
+
+    def Solve(self, A: sparse.csr_matrix, rhs: np.ndarray, x0: np.ndarray | None = None):
+        self.Setup(A)
+        M = LinearOperator(A.shape, matvec=self.VCycle)
+        self.iterations = 0
+
+        def Count(*args):
+            self.iterations += 1
+
+        if self.krylov == 'gmres':
+            x, info = gmres(A, rhs, x0=x0, M=M, rtol=self.rtol, restart=30, maxiter=self.maxiter, callback=Count, callback_type='pr_norm')
+        elif self.krylov == 'bicgstab':
+            x, info = bicgstab(A, rhs, x0=x0, M=M, rtol=self.rtol, maxiter=self.maxiter, callback=Count)
+        else:
+            raise ValueError(f"Unknown Krylov method {self.krylov}")
+        if info > 0:
+            print(f"Multigrid {self.krylov} stopped at {self.iterations} iterations without reaching {self.rtol}")
+        elif info < 0:
+            raise ValueError(f"Multigrid {self.krylov} broke down")
+        return x
+
+    def __call__(self, A: sparse.csr_matrix, rhs: np.ndarray, x0: np.ndarray | None = None):
+        return self.Solve(A, rhs, x0)
@@ -0,0 +1,282 @@
+from dataclasses import dataclass
+import hashlib
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+from cooling import calc_cell, mesh_file
+from cooling.coolant import CoolantCircuits
+from cooling.domain import DomainMMAP
+from cooling.kernels import FaceGeometry
+from cooling.material import DomainMaterial, MaterialType
+from cooling.parallel import BlockCellCoefficients, BlockCoefficients, OpenPool
+
+def ActiveCells(domain: DomainMMAP):
+    # cells CalculateCell updates, everything else keeps its temperature and pressure
+    materials = domain.grid.material
+    static = np.isin(materials, [m.value for m in MaterialType.STATIC_TEMP])
+    static |= domain.grid.r - domain.rsteps[:, np.newaxis]/2 <= 0
+    return np.nonzero(~static)
+
+ACTIVE_INDEX_VERSION = 1
+
+@dataclass
+class ActiveIndex:
+    # the cells the network solves for, numbered in grid order, and the fixed cells their equations read. Faces and
+    # upstream cells are slots into a state vector of the active values, then the fixed values, then one zero for no
+    # cell (see ThermalNetwork.State), so nothing past the index needs the rest of the grid
+    rows: np.ndarray # int32
+    cols: np.ndarray
+    neighbors: np.ndarray # (cells, 4) slots in Direction order, int32
+    upstream: np.ndarray # slot of the previousFlow cell of coolant cells, the zero slot for the others
+    fixed: np.ndarray # flat grid index of every fixed cell an active cell reads
+
+    ARRAYS = ("rows", "cols", "neighbors", "upstream", "fixed")
+
+    @staticmethod
+    def Build(domain: DomainMMAP):
+        shape = domain.grid.shape
+        rows, cols = ActiveCells(domain)
+        flat = rows * shape[1] + cols
+        isCoolant = np.isin(domain.grid.material[rows, cols], [m.value for m in MaterialType.COOLANT])
+        previous = domain.grid.previousFlow[rows, cols]
+        upstream = np.where(isCoolant, previous[:, 0] * shape[1] + previous[:, 1], -1)
+        targets = np.concatenate([domain.cells.NeighborTable(rows, cols), upstream[:, np.newaxis]], axis=1)
+
+        # flat is sorted, active targets are found by bisection instead of a grid sized lookup table
+        position = np.minimum(np.searchsorted(flat, targets), max(flat.size - 1, 0))
+        isActive = (targets >= 0) & (flat[position] == targets) if flat.size else np.zeros(targets.shape, dtype=bool)
+        isFixed = (targets >= 0) & ~isActive
+        fixed = np.unique(targets[isFixed])
+        slots = np.full(targets.shape, flat.size + fixed.size, dtype=np.int32)
+        slots[isActive] = position[isActive]
+        slots[isFixed] = flat.size + np.searchsorted(fixed, targets[isFixed])
+        return ActiveIndex(rows.astype(np.int32), cols.astype(np.int32), slots[:, :4].copy(), slots[:, 4].copy(), fixed)
+
+    @staticmethod
+    def Fingerprint(domain: DomainMMAP):
+        grid = domain.grid
+        digest = hashlib.sha1(repr((ACTIVE_INDEX_VERSION, grid.shape)).encode())
+        for array in (grid.material, grid.r, grid.previousFlow, domain.rsteps):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def ForDomain(domain: DomainMMAP):
+        # the index stored with the mesh of a DomainMMAP when its layout is unchanged, otherwise built and stored
+        path = getattr(domain, 'workingFolder', None)
+        fingerprint = ActiveIndex.Fingerprint(domain)
+        if path is not None:
+            header = mesh_file.ReadHeader(path)
+            if header.get("metadata", {}).get("activeIndex") == fingerprint:
+                print("Using the active cell index stored with the mesh")
+                arrays = mesh_file.ReadArrays(path, header, 'r')
+                return ActiveIndex(*(np.array(arrays[f"activeIndex.{name}"]) for name in ActiveIndex.ARRAYS))
+        index = ActiveIndex.Build(domain)
+        if path is not None:
+            mesh_file.UpdateArrays(path, {f"activeIndex.{name}": getattr(index, name) for name in ActiveIndex.ARRAYS}, {"activeIndex": fingerprint})
+        return index
+
+def CellBatch(domain: DomainMMAP, cells: list[tuple[int, int]]):
+    return [calc_cell.CellCoefficients(domain, row, col) for row, col in cells]
+
+# the outputs of the resistor evaluation in a CellPool, name, shape per cell and dtype
+COEFFICIENT_OUTPUTS = [("G", (4,), np.float64), ("capacityRate", (), np.float64), ("pressureDrop", (), np.float64)]
+
+class ThermalNetwork:
+    # the cooling grid as a resistor network over the active cells. Every active cell gets the equation CalculateCell
+    # iterates towards,
+    #   wall:         sum G_f (T - T_f) = 0
+    #   coolant wall: sum G_f (T - T_f) + mdot*cp (T - T_up) = 0,  P = P_up - dP
+    #   coolant bulk: T = T_up,  P = P_up
+    # with the conductances G frozen at the current state, so one sparse solve gives the field the point iteration would
+    # converge to for those conductances. Fixed cells enter through the right hand side. With workers > 1 the resistors
+    # of large networks are evaluated in a parallel.CellPool attached to the working folder of the domain, close()
+    # shuts it down.
+    # Temperatures and pressures are vectors over the active cells (Load reads them from the domain), the fixed cells
+    # are read once and held in fixedTemperature and fixedPressure
+    def __init__(self, domain: DomainMMAP, workers: int = 1, blockSize: int | None = None):
+        self.shape = domain.grid.shape
+        index = ActiveIndex.ForDomain(domain)
+        self.rows, self.cols = index.rows, index.cols
+        self.size = self.rows.size
+        self.flat = self.rows.astype(np.int64) * self.shape[1] + self.cols
+        self.neighbors = index.neighbors
+        self.upstream = index.upstream
+        self.fixed = index.fixed
+        # flat grid index of every slot, -1 for the zero slot
+        self.slotFlat = np.concatenate([self.flat, self.fixed, [-1]])
+
+        self.material = domain.grid.material[self.rows, self.cols].copy()
+        self.isBulk = self.material == DomainMaterial.COOLANT_BULK
+        self.isCoolant = np.isin(self.material, [m.value for m in MaterialType.COOLANT])
+
+        # checkerboard colors of the wall cells, cells of one color only touch cells of the other
+        isWall = ~self.isCoolant
+        self.wallColors = [np.nonzero(isWall & ((self.rows + self.cols) % 2 == color))[0] for color in (0, 1)]
+
+        self.Load(domain)
+        self.circuits = CoolantCircuits(self)
+
+        # areas, radii and lengths of the resistors, only k and h change between updates
+        self.geometry = FaceGeometry.ForDomain(domain, self.rows, self.cols)
+
+        self.G = np.zeros((self.size, 4))
+        self.capacityRate = np.zeros(self.size)
+        self.pressureDrop = np.zeros(self.size)
+
+        self.pool = OpenPool(domain, self.size, workers, blockSize)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def Load(self, domain: DomainMMAP):
+        # active cell temperatures and pressures in the domain, the fixed cells are read again on the way
+        self.fixedTemperature = np.array(np.asarray(domain.memmaps["temperature"]).reshape(-1)[self.fixed], dtype=float)
+        self.fixedPressure = np.array(np.asarray(domain.memmaps["pressure"]).reshape(-1)[self.fixed], dtype=float)
+        return (np.array(domain.memmaps["temperature"][self.rows, self.cols], dtype=float),
+                np.array(domain.memmaps["pressure"][self.rows, self.cols], dtype=float))
+
+    def State(self, values: np.ndarray, fixed: np.ndarray):
+        # active values, fixed values and the zero slot, what neighbors and upstream index
+        return np.concatenate([values, fixed, [0.0]])
+
+    def Grid(self, domain: DomainMMAP, name: str, values: np.ndarray):
+        # a full grid copy of a domain field with the active cells set to values, for output
+        field = np.array(domain.memmaps[name])
+        field[self.rows, self.cols] = values
+        return field
+
+    def BatchCount(self, batchSize: int = 64):
+        return -(-self.size // batchSize)
+
+    def Update(self, domain: DomainMMAP):
+        # re-evaluates the resistors at the temperatures and pressures currently in the domain, all cells at once with
+        # the float kernels, block by block in the pool when there is one
+        if self.pool is None:
+            self.G, self.capacityRate, self.pressureDrop = self.geometry.Coefficients(domain)
+        else:
+            self.G, self.capacityRate, self.pressureDrop = self.pool.Map(BlockCoefficients, self.size, COEFFICIENT_OUTPUTS)
+
+    def UpdateCells(self, domain: DomainMMAP, bar=None, batchSize: int = 64):
+        # Update through the pint calc_cell path one cell at a time, kept as the reference for the kernels
+        if self.pool is not None:
+            self.G, self.capacityRate, self.pressureDrop = self.pool.Map(BlockCellCoefficients, self.size, COEFFICIENT_OUTPUTS)
+            return
+        cells = list(zip(self.rows.tolist(), self.cols.tolist()))
+        batches = [cells[i:i + batchSize] for i in range(0, len(cells), batchSize)]
+        outputs = (CellBatch(domain, batch) for batch in batches)
+
+        i = 0
+        for output in outputs:
+            for G, capacityRate, pressureDrop in output:
+                self.G[i] = G
+                self.capacityRate[i] = capacityRate
+                self.pressureDrop[i] = pressureDrop
+                i += 1
+            if bar is not None:
+                bar()
+
+    def Link(self, rowIndex: np.ndarray, target: np.ndarray, weight: np.ndarray, fixed: np.ndarray):
+        # off diagonal terms -weight*x[target] for target slots, moved to the right hand side with the fixed values
+        # when the target is a fixed cell
+        rowIndex, target, weight = rowIndex.ravel(), target.ravel(), weight.ravel()
+        use = (target < self.size + self.fixed.size) & (weight != 0)
+        rowIndex, target, weight = rowIndex[use], target[use], weight[use]
+        free = target < self.size
+        matrix = (rowIndex[free], target[free], -weight[free])
+        rhs = np.bincount(rowIndex[~free], weight[~free] * fixed[target[~free] - self.size], minlength=self.size)
+        return matrix, rhs
+
+    def System(self, diagonal: np.ndarray, links: list, rhs: np.ndarray, fixed: np.ndarray):
+        rows = [np.arange(self.size)]
+        cols = [np.arange(self.size)]
+        data = [diagonal]
+        for rowIndex, target, weight in links:
+            (r, c, d), b = self.Link(rowIndex, target, weight, fixed)
+            rows.append(r)
+            cols.append(c)
+            data.append(d)
+            rhs = rhs + b
+        A = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=(self.size, self.size))
+        return A, rhs
+
+    def TemperatureSystem(self, temperature: np.ndarray):
+        # temperature of the active cells in degR
+        G = np.where(self.isBulk[:, None], 0, self.G)
+        capacityRate = np.where(self.isCoolant & ~self.isBulk, self.capacityRate, 0)
+        diagonal = G.sum(axis=1) + capacityRate
+        coupledUp = np.where(self.isBulk, 1.0, capacityRate)
+        diagonal = np.where(self.isBulk, 1.0, diagonal)
+
+        # a cell with every face skipped has no equation left, hold it where it is
+        isolated = self.Isolated()
+        diagonal = np.where(isolated, 1.0, diagonal)
+        rhs = np.where(isolated, temperature, 0.0)
+
+        faceRows = np.repeat(np.arange(self.size), 4)
+        links = [(faceRows, self.neighbors, G), (np.arange(self.size), self.upstream, coupledUp)]
+        return self.System(diagonal, links, rhs, self.fixedTemperature)
+
+    def Isolated(self):
+        # non bulk cells with every face skipped and no coolant flow
+        return ~self.isBulk & (self.G.sum(axis=1) + np.where(self.isCoolant, self.capacityRate, 0) == 0)
+
+    def PressureSystem(self, pressure: np.ndarray):
+        # pressure of the active cells in psi, wall cells keep theirs
+        diagonal = np.ones(self.size)
+        rhs = np.where(self.isCoolant, -np.where(self.isBulk, 0, self.pressureDrop), pressure)
+        links = [(np.arange(self.size), self.upstream, self.isCoolant.astype(float))]
+        return self.System(diagonal, links, rhs, self.fixedPressure)
+
+    def SolveTemperature(self, temperature: np.ndarray, linearSolver=None):
+        # returns the new active cell temperatures. linearSolver(A, rhs, x0) replaces the sparse LU solve
+        A, rhs = self.TemperatureSystem(temperature)
+        if linearSolver is None:
+            return spsolve(A.tocsc(), rhs)
+        return linearSolver(A, rhs, temperature)
+
+    def SolvePressure(self, pressure: np.ndarray):
+        A, rhs = self.PressureSystem(pressure)
+        return spsolve(A.tocsc(), rhs)
+
+    def Residual(self, temperature: np.ndarray):
+        # heat imbalance of every active cell in BTU/hr with the current conductances
+        state = self.State(temperature, self.fixedTemperature)
+        residual = (self.G * (state[self.neighbors] - temperature[:, None])).sum(axis=1)
+        residual += np.where(self.isCoolant & ~self.isBulk, self.capacityRate * (state[self.upstream] - temperature), 0)
+        return np.where(self.isBulk, 0, residual)
+
+    def HeatFlow(self, temperature: np.ndarray):
+        # heat passing through every active cell in BTU/hr, half the sum of the magnitudes of the flows the residual
+        # adds up. The scale a residual is relative to
+        state = self.State(temperature, self.fixedTemperature)
+        flow = np.abs(self.G * (state[self.neighbors] - temperature[:, None])).sum(axis=1)
+        flow += np.where(self.isCoolant & ~self.isBulk, np.abs(self.capacityRate * (state[self.upstream] - temperature)), 0)
+        return np.where(self.isBulk, 0, flow / 2)
+
+    def Relax(self, temperature: np.ndarray, pressure: np.ndarray, omega: float = 1.8):
+        # one red-black SOR sweep over the wall cells, then the coolant is marched down its circuits. Works in place on
+        # the active cell vectors, returns the largest relative temperature change
+        T = self.State(temperature, self.fixedTemperature)
+        P = self.State(pressure, self.fixedPressure)
+        sumG = self.G.sum(axis=1)
+
+        for cells in self.wallColors:
+            cells = cells[sumG[cells] > 0]
+            target = (self.G[cells] * T[self.neighbors[cells]]).sum(axis=1) / sumG[cells]
+            T[cells] = (1 - omega) * T[cells] + omega * target
+
+        self.circuits.March(self, T, P)
+        change = np.max(np.abs(T[:self.size] - temperature)/temperature, initial=0)
+        temperature[:] = T[:self.size]
+        pressure[:] = P[:self.size]
+        return change
@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+
+from cooling import calc_cell, mesh_file
+from cooling.domain import DomainMMAP
+from cooling.kernels import FaceGeometry
+
+# Worker processes for the per cell work of a DomainMMAP. The grid fields are already published as memmaps in the
+# working folder of the domain, so every worker attaches to that folder read only once when it starts, and a task is
+# only a contiguous block start:stop of the active cells of the network. Results are written by the workers into
+# output memmaps in the same folder and come back as arrays in cell order, nothing per cell is pickled either way.
+# Writes the parent commits to the domain (CommitMEM) land in the files the workers map, the next task sees them.
+
+PARALLEL_CELLS = 50000 # below this many active cells one process evaluating everything at once is faster
+BLOCKS_PER_WORKER = 4 # more blocks than workers evens out blocks of cheap and expensive cells
+
+_attached = {} # the domain, geometry and output memmaps of this worker process
+
+def Attach(path: str):
+    _attached.clear()
+    _attached["domain"] = DomainMMAP.OpenMesh(path, 'r')
+    _attached["outputs"] = {}
+
+def AttachedGeometry(domain: DomainMMAP):
+    # the FaceGeometry the network stored with the mesh, mapped again when it was rebuilt since the last task
+    header = mesh_file.ReadHeader(domain.workingFolder)
+    fingerprint = header.get("metadata", {}).get("faceGeometry")
+    if fingerprint is None:
+        raise ValueError(f"{domain.workingFolder} holds no face geometry, build the ThermalNetwork before the pool runs on it")
+    if _attached.get("fingerprint") != fingerprint:
+        _attached["geometry"] = FaceGeometry.FromArrays(mesh_file.ReadArrays(domain.workingFolder, header, 'r'), "faceGeometry", copy=False)
+        _attached["fingerprint"] = fingerprint
+    return _attached["geometry"]
+
+def OutputBuffer(spec: tuple):
+    filename, dtype, shape = spec
+    if spec not in _attached["outputs"]:
+        _attached["outputs"][spec] = np.memmap(filename, dtype=dtype, mode='r+', shape=shape)
+    return _attached["outputs"][spec]
+
+def Run(task, start: int, stop: int, outputs: list[tuple]):
+    results = task(_attached["domain"], start, stop)
+    for spec, result in zip(outputs, results):
+        OutputBuffer(spec)[start:stop] = result
+
+def BlockCoefficients(domain: DomainMMAP, start: int, stop: int):
+    # FaceGeometry.Coefficients of a block, what ThermalNetwork.Update evaluates
+    return AttachedGeometry(domain).Block(start, stop).Coefficients(domain)
+
+def BlockCellCoefficients(domain: DomainMMAP, start: int, stop: int):
+    # the same through the pint calc_cell path, one cell at a time
+    geometry = AttachedGeometry(domain)
+    output = [calc_cell.CellCoefficients(domain, row, col) for row, col in zip(geometry.rows[start:stop].tolist(), geometry.cols[start:stop].tolist())]
+    return np.array([G for G, _, _ in output]).reshape(-1, 4), np.array([c for _, c, _ in output]), np.array([p for _, _, p in output])
+
+class CellPool:
+    def __init__(self, domain: DomainMMAP, workers: int, blockSize: int | None = None):
+        # blockSize is the number of cells per task, by default every worker gets BLOCKS_PER_WORKER blocks
+        self.folder = domain.workingFolder
+        self.workers = workers
+        self.blockSize = blockSize
+        self.buffers = {}
+        self.executor = ProcessPoolExecutor(workers, initializer=Attach, initargs=(self.folder,))
+
+    def Blocks(self, size: int):
+        blockSize = self.blockSize or max(1, -(-size // (self.workers*BLOCKS_PER_WORKER)))
+        return [(start, min(start + blockSize, size)) for start in range(0, size, blockSize)]
+
+    def Buffer(self, name: str, dtype, shape: tuple):
+        spec = (os.path.join(self.folder, f"pool.{name}.bin"), np.dtype(dtype).str, shape)
+        if spec not in self.buffers:
+            self.buffers[spec] = np.memmap(spec[0], dtype=dtype, mode='w+', shape=shape)
+        return spec, self.buffers[spec]
+
+    def Map(self, task, size: int, outputs: list[tuple[str, tuple, type]]):
+        # runs task(domain, start, stop) on every block of range(size), the arrays it returns go into outputs, one
+        # (name, trailing shape, dtype) each. Returns the filled outputs
+        buffers = [self.Buffer(name, dtype, (size, *shape)) for name, shape, dtype in outputs]
+        specs = [spec for spec, _ in buffers]
+        futures = [self.executor.submit(Run, task, start, stop, specs) for start, stop in self.Blocks(size)]
+        for future in futures:
+            future.result()
+        return tuple(np.array(buffer) for _, buffer in buffers)
+
+    def close(self):
+        self.executor.shutdown()
+        for spec in self.buffers:
+            self.buffers[spec]._mmap.close()
+            os.remove(spec[0])
+        self.buffers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class WorkerGroup:
+    # processes that keep state between tasks, unlike the CellPool every task names the worker it runs on. For work
+    # that is set up once and then repeated on the same data, like the block factorizations of decomposition
+    def __init__(self, workers: int):
+        self.executors = [ProcessPoolExecutor(1) for _ in range(workers)]
+
+    def Run(self, task, arguments: list[tuple]):
+        # task(*arguments[i]) on worker i, returns the results in worker order
+        futures = [executor.submit(task, *args) for executor, args in zip(self.executors, arguments)]
+        return [future.result() for future in futures]
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+def OpenPool(domain: DomainMMAP, cells: int, workers: int, blockSize: int | None = None):
+    # a pool when it pays off for this many cells, otherwise None and the caller evaluates in process
+    if workers <= 1 or cells < PARALLEL_CELLS or getattr(domain, 'workingFolder', None) is None:
+        return None
+    print(f"Evaluating {cells} cells on {workers} workers")
+    return CellPool(domain, workers, blockSize)
@@ -0,0 +1,107 @@
+from dataclasses import dataclass, field
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, gmres, splu
+
+from cooling import mesh_file
+from cooling.domain import DomainMMAP
+from cooling.network import ThermalNetwork
+
+# Time stepping of the resistor network over a burn. Every active cell follows
+#   C dT/dt = b - A T
+# with A T = b the steady TemperatureSystem of ThermalNetwork and C the heat capacity of the cell, so a run long enough
+# ends on the field AnalyzeMCDirect converges to. Cells without capacity (coolant bulk cells, cells with every face
+# skipped) keep their algebraic equation. The coolant pressure stays the steady one of the current resistors.
+
+HOUR = 3600.0 # seconds, the conductances are per hour
+
+@dataclass
+class TransientSettings:
+    theta: float = 1.0 # 1 backward Euler, 0.5 Crank-Nicolson
+    dt: float = 1e-3 # first step, s
+    dtMin: float = 1e-5 # s
+    dtMax: float = 1.0 # s
+    tolerance: float = 2.0 # degR, largest local error of a step. Steps are halved above it and doubled below a quarter
+    propertyChange: float = 0.02 # relative temperature change since the resistors were evaluated that re-evaluates them
+    krylov: int = 10 # GMRES iterations on a stale factorization before it is redone
+
+@dataclass
+class TransientResult:
+    times: list[float] = field(default_factory=list) # s
+    temperatures: list[np.ndarray] = field(default_factory=list) # full grid snapshots, degR
+    history: list[tuple[float, float, float]] = field(default_factory=list) # time, step and hottest wall cell after every step
+
+class TransientSolver:
+    # the resistors and capacities are evaluated by Refresh when the temperatures drifted by more than propertyChange
+    # since they were, a new step size only rebuilds C/dt + theta A. The factorization of that matrix is kept as the
+    # preconditioner of a short GMRES and only redone when that stops converging within krylov iterations. Rows whose
+    # own time constant C/A_ii is shorter than the step take backward Euler whatever theta is, Crank-Nicolson would
+    # ring on them
+    def __init__(self, network: ThermalNetwork, settings: TransientSettings):
+        self.network = network
+        self.settings = settings
+        self.dt = None
+        self.reference = None
+        self.lu = None
+        self.factored = False
+        self.refreshes = 0
+        self.factorizations = 0
+
+    def isStale(self, temperature: np.ndarray):
+        if self.reference is None:
+            return True
+        return np.max(np.abs(temperature - self.reference)/self.reference, initial=0) > self.settings.propertyChange
+
+    def Refresh(self, domain: DomainMMAP, temperature: np.ndarray, dt: float):
+        # temperature of the active cells in degR, it must be what the domain holds, the resistors are read from it
+        network = self.network
+        network.Update(domain)
+        self.A, self.b = network.TemperatureSystem(temperature)
+        self.capacity = np.where(network.isBulk | network.Isolated(), 0.0, network.geometry.HeatCapacity(domain))
+        self.reference = temperature.copy()
+        self.refreshes += 1
+        self.Resize(dt)
+
+    def Resize(self, dt: float):
+        self.inertia = self.capacity / (dt / HOUR)
+        stiff = self.inertia < self.A.diagonal()
+        self.theta = np.where((self.capacity > 0) & ~stiff, self.settings.theta, 1.0)
+        self.M = (sparse.diags(self.inertia) + sparse.diags(self.theta) @ self.A).tocsr()
+        self.dt = dt
+        self.factored = False
+        if self.lu is None:
+            self.Factor()
+
+    def Factor(self):
+        self.lu = splu(self.M.tocsc())
+        self.factored = True
+        self.factorizations += 1
+
+    def Solve(self, rhs: np.ndarray):
+        if self.factored:
+            return self.lu.solve(rhs)
+        x, info = gmres(self.M, rhs, x0=self.lu.solve(rhs), M=LinearOperator(self.M.shape, matvec=self.lu.solve), rtol=1e-8,
+                        restart=self.settings.krylov, maxiter=1)
+        if info != 0:
+            self.Factor()
+            return self.lu.solve(rhs)
+        return x
+
+    def Step(self, T: np.ndarray) -> np.ndarray:
+        # active cell temperatures one step of the refreshed size on
+        return self.Solve(self.inertia*T + self.b - (1 - self.theta)*(self.A @ T))
+
+def LocalError(T: np.ndarray, Told: np.ndarray, Tprevious: np.ndarray | None, ratio: float):
+    # half the gap between the step and the straight line through the last two, the leading error term of a first
+    # order step. The first step has no line and is measured against no change at all
+    predicted = Told if Tprevious is None else Told + ratio*(Told - Tprevious)
+    return np.max(np.abs(T - predicted), initial=0)/2
+
+def WriteSnapshots(path: str, domain: DomainMMAP, result: TransientResult, settings: TransientSettings):
+    # the mesh at path gets the snapshots as arrays, the whole mesh is written with the first one
+    path = mesh_file.MeshPath(path)
+    if len(result.times) == 1 or not mesh_file.isMesh(path):
+        print(f"Writing transient mesh {path}")
+        domain.toDomain().DumpFile(path)
+    mesh_file.UpdateArrays(path, {"snapshot.time": np.array(result.times), "snapshot.temperature": np.stack(result.temperatures)},
+                           {"transient": {"theta": settings.theta, "snapshots": len(result.times)}})
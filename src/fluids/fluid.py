@@ -1,9 +1,9 @@
 import numpy as np
 import pyromat as pm
-from rocketprops.rocket_prop import get_prop
 
 from general.units import Q_, unitReg
 import general.design as DESIGN
+from fluids.properties import GetTable, PropertySource, PROPERTY_NAMES, PROPERTY_UNITS, TABLE_GRIDS
 
 # -------------- Pyromat Shit -------------- #
 pm.config['unit_pressure'] = 'psi'
@@ -136,43 +136,36 @@ def PROPFLOWS(Film_Cooling,oxImpingeAngle, fuelInitalImpingeAngle, filmImpingeAn
 
 
 
-# Function to retrieve fluid properties using RocketProps defaults (English Engineering units)
+# Function to retrieve fluid properties, interpolated from the tabulated RocketProps data (English Engineering units).
+# Temperature and pressure may be arrays, every property then comes back as an array of the same shape
 def get_fluid_properties(name, temperature_R, pressure_psi):
-    # Ensure inputs are in the correct units for RocketProps methods
-    temperature = Q_(temperature_R.magnitude, unitReg.degR)
-    
-    pressure = Q_(pressure_psi.magnitude, unitReg.psi)
-    
-    # Create an fluid object
-    fluid = get_prop(name)
-    
-    # Retrieve dynamic properties from RocketProps at the given temperature and pressure
-    viscosity_poise = Q_(fluid.ViscAtTdegR(temperature.magnitude), unitReg.poise)  # Viscosity in poise
-    viscosity = viscosity_poise.to(unitReg.pound / unitReg.foot / unitReg.second)  # Convert to lb/ft·s using .to()
-    
-    specific_heat_p = Q_(fluid.CpAtTdegR(temperature.magnitude), unitReg.BTU / unitReg.pound / unitReg.degR)  # Cp in BTU/lbm-R
-    thermal_conductivity = Q_(fluid.CondAtTdegR(temperature.magnitude), unitReg.BTU / unitReg.foot / unitReg.hour / unitReg.degR)  # Thermal conductivity
-    
-    # Density (lbm/ft³) using compressed specific gravity and accurate water density
-    specific_gravity = fluid.SG_compressed(temperature.magnitude, pressure.magnitude)  # Specific gravity in g/ml
-    water_density = Q_(1, unitReg.gram / unitReg.milliliter).to(unitReg.pound / unitReg.foot**3)  # Density of water in lbm/ft³
-    density = specific_gravity * water_density  # Convert specific gravity to density for RP-1 in lbm/ft³
-    
-    # Calculate Prandtl number (dimensionless)
-    prandtl = (viscosity * specific_heat_p / thermal_conductivity).to('dimensionless')
-    
+    # Ensure inputs are in the correct units for the property tables
+    temperature = temperature_R.to(unitReg.degR).magnitude
+    pressure = pressure_psi.to(unitReg.psi).magnitude
+
+    if name in TABLE_GRIDS:
+        properties = GetTable(name)(temperature, pressure)
+    else:
+        properties = dict(zip(PROPERTY_NAMES, np.vectorize(PropertySource(name))(temperature, pressure)))
+
+    viscosity = Q_(properties["viscosity"], PROPERTY_UNITS["viscosity"])  # lb/ft·s
+    specific_heat_p = Q_(properties["specificHeat"], PROPERTY_UNITS["specificHeat"])  # Cp in BTU/lbm-R
+    thermal_conductivity = Q_(properties["conductivity"], PROPERTY_UNITS["conductivity"])  # Thermal conductivity
+    density = Q_(properties["density"], PROPERTY_UNITS["density"])  # lbm/ft³
+    prandtl = Q_(properties["prandtl"], unitReg.dimensionless)
+
     # Estimate gamma (Cp/Cv) assuming Cv ~ Cp/1.25 if no direct Cv is available
     specific_heat_v = specific_heat_p / 1.25
     gamma = specific_heat_p / specific_heat_v
     
     # Coefficient of thermal expansion (1/°R) as an approximation
-    alpha = Q_(1 / (temperature.magnitude * 60), 1 / unitReg.degR)
+    alpha = Q_(1 / (temperature * 60), 1 / unitReg.degR)
     
     # Thermal diffusivity (ft²/s)
     thermal_diffusivity = thermal_conductivity / (density * specific_heat_p) * unitReg.foot**2 / unitReg.second
 
     # Surface Tension (lbf/ft)
-    SurfaceTens = Q_(fluid.SurfAtTdegR(temperature.magnitude), unitReg.pound_force / unitReg.foot)
+    SurfaceTens = Q_(properties["surfaceTension"], unitReg.pound_force / unitReg.foot)
     
     # Return all properties in English Engineering units
     return (viscosity, specific_heat_p, gamma, thermal_conductivity, density, prandtl, alpha, thermal_diffusivity, SurfaceTens)
@@ -4,6 +4,9 @@ from scipy.optimize import fsolve
 from icecream import ic
 
 from general.units import Q_, unitReg
+
+HARMONIC_THETA = 5500 # degR, characteristic vibration temperature of SimpleHarmonicGamma
+
 @dataclass
 class SpHeatRatio:
     def __init__(self, gamma):
@@ -74,6 +77,19 @@ class Gas:
             T = self.stagTemp * (1 + gammaNext[2] * mach**2)
             gammaNext = self.SimpleHarmonicGamma(T)
         return gammaNext
+
+    def getVariableGammaArray(self, mach: np.ndarray) -> np.ndarray:
+        # getVariableGamma for an array of Mach numbers, every element stops iterating once it has converged
+        mach = np.asarray(mach, dtype=float)
+        T0 = self.stagTemp.to(unitReg.degR).magnitude
+        gammaPrev = np.full(mach.shape, float(self.gammaTyp.g))
+        gammaNext = self.HarmonicGammaArray(T0 * (1 + (gammaPrev - 1)/2 * mach**2))
+        active = np.abs(gammaNext - gammaPrev) > 1e-6
+        while np.any(active):
+            gammaPrev[active] = gammaNext[active]
+            gammaNext[active] = self.HarmonicGammaArray(T0 * (1 + (gammaPrev[active] - 1)/2 * mach[active]**2))
+            active[active] = np.abs(gammaNext[active] - gammaPrev[active]) > 1e-6
+        return gammaNext
     
     def getChokedArea(self, mdot):
         gamma1 = self.getVariableGamma(1)
@@ -82,10 +98,15 @@ class Gas:
         return a/b
 
     def SimpleHarmonicGamma(self, temp: float):
-        THETA = Q_(5500, unitReg.degR)
+        THETA = Q_(HARMONIC_THETA, unitReg.degR)
         tr = THETA/temp
         return SpHeatRatio(1 + (self.gammaTyp - 1)/(1 + (self.gammaTyp - 1)*((tr)**2)*(np.exp(tr))/(np.exp(tr) - 1)**2))
 
+    def HarmonicGammaArray(self, temp: np.ndarray) -> np.ndarray:
+        # SimpleHarmonicGamma on plain temperatures in degR
+        tr = HARMONIC_THETA/np.asarray(temp, dtype=float)
+        return 1 + (self.gammaTyp.g - 1)/(1 + (self.gammaTyp.g - 1)*tr**2*np.exp(tr)/np.expm1(tr)**2)
+
 def PrandtlMeyerFunction(M, gamma):
     a = np.sqrt((gamma+1)/(gamma-1))
     b = np.arctan(np.sqrt((gamma-1)/(gamma+1)*(M**2-1)))
@@ -123,4 +144,82 @@ def MachToVelocity(mach, gas: Gas):
     gamma = gas.getVariableGamma(mach)
     temp = gas.stagTemp * StagTempRatio(mach, gas)
     ic(temp)
-    return mach * np.sqrt(gamma * temp * gas.Rgas)
\ No newline at end of file
+    return mach * np.sqrt(gamma * temp * gas.Rgas)
+
+# Isentropic relations on arrays. The inverses start from a table of the forward relation sampled once per gamma and
+# finish with a few Newton steps on the exact relation, in log Mach so the small Mach end of the subsonic branch behaves
+ISENTROPIC_MACH_RANGE = (1e-4, 1e3)
+ISENTROPIC_TABLE_POINTS = 512
+ISENTROPIC_NEWTON_STEPS = 4
+
+def GammaValue(gamma):
+    return gamma.g if isinstance(gamma, SpHeatRatio) else float(gamma)
+
+def IsentropicTempRatio(mach, gamma):
+    # T/T0, gamma may be an array matching mach
+    return 1/(1 + (np.asarray(gamma, dtype=float) - 1)/2*np.asarray(mach, dtype=float)**2)
+
+def IsentropicPressRatio(mach, gamma):
+    # P/P0
+    gamma = np.asarray(gamma, dtype=float)
+    return IsentropicTempRatio(mach, gamma)**(gamma/(gamma - 1))
+
+def AreaRatio(mach, gamma: float):
+    # A/A*, Isentropic1DExpansion on arrays
+    mach = np.asarray(mach, dtype=float)
+    return 1/mach*((1 + (gamma - 1)/2*mach**2)*2/(gamma + 1))**((gamma + 1)/(2*(gamma - 1)))
+
+class IsentropicTable:
+    def __init__(self, gamma: float):
+        self.gamma = gamma
+        low, high = np.log(ISENTROPIC_MACH_RANGE)
+        self.subsonic = np.linspace(low, 0, ISENTROPIC_TABLE_POINTS)
+        self.supersonic = np.linspace(0, high, ISENTROPIC_TABLE_POINTS)
+        # log A/A* falls along the subsonic branch, np.interp wants it rising
+        self.subsonicArea = np.log(AreaRatio(np.exp(self.subsonic[::-1]), gamma))
+        self.supersonicArea = np.log(AreaRatio(np.exp(self.supersonic), gamma))
+        self.prandtlMeyer = PrandtlMeyerFunction(np.exp(self.supersonic), gamma)
+
+    def MachFromAreaRatio(self, areaRatio, supersonic: bool = False):
+        # ratios at or below 1 are the throat
+        target = np.log(np.maximum(np.asarray(areaRatio, dtype=float), 1))
+        if supersonic:
+            logMach = np.interp(target, self.supersonicArea, self.supersonic)
+        else:
+            logMach = np.interp(target, self.subsonicArea, self.subsonic[::-1])
+        g2 = (self.gamma - 1)/2
+        for _ in range(ISENTROPIC_NEWTON_STEPS):
+            mach = np.exp(logMach)
+            slope = (mach**2 - 1)/(1 + g2*mach**2) # d ln(A/A*) / d ln M
+            step = np.divide(np.log(AreaRatio(mach, self.gamma)) - target, slope, out=np.zeros_like(mach), where=slope != 0)
+            logMach = logMach - step
+            logMach = np.maximum(logMach, 0) if supersonic else np.minimum(logMach, 0)
+        return np.exp(logMach)
+
+    def MachFromPrandtlMeyer(self, nu):
+        # nu in radians, 0 at Mach 1
+        nu = np.maximum(np.asarray(nu, dtype=float), 0)
+        logMach = np.interp(nu, self.prandtlMeyer, self.supersonic)
+        g2 = (self.gamma - 1)/2
+        for _ in range(ISENTROPIC_NEWTON_STEPS):
+            mach = np.exp(logMach)
+            slope = np.sqrt(mach**2 - 1)/(1 + g2*mach**2) # d nu / d ln M
+            step = np.divide(PrandtlMeyerFunction(mach, self.gamma) - nu, slope, out=np.zeros_like(mach), where=slope != 0)
+            logMach = np.maximum(logMach - step, 0)
+        return np.exp(logMach)
+
+_isentropicTables: dict[float, IsentropicTable] = {}
+
+def GetIsentropicTable(gamma) -> IsentropicTable:
+    gamma = GammaValue(gamma)
+    if gamma not in _isentropicTables:
+        _isentropicTables[gamma] = IsentropicTable(gamma)
+    return _isentropicTables[gamma]
+
+def MachFromAreaRatio(areaRatio, gamma, supersonic: bool = False):
+    # inverse of Isentropic1DExpansion on either branch, vectorized
+    return GetIsentropicTable(gamma).MachFromAreaRatio(areaRatio, supersonic)
+
+def MachFromPrandtlMeyer(nu, gamma):
+    # inverse of PrandtlMeyerFunction, vectorized
+    return GetIsentropicTable(gamma).MachFromPrandtlMeyer(nu)
@@ -0,0 +1,200 @@
+from functools import lru_cache
+import hashlib
+import json
+import os
+import numpy as np
+from rocketprops.rocket_prop import get_prop
+
+from general.units import Q_, unitReg
+
+# Tabulated transport properties. Each fluid is sampled once on a uniform temperature x pressure grid and looked up by
+# bilinear interpolation, the tables are cached on disk so the sampling only happens the first time a grid is used.
+# Values are stored in the units get_fluid_properties returns.
+PROPERTY_UNITS = {
+    "viscosity": "pound / foot / second",
+    "specificHeat": "BTU / pound / degR",
+    "conductivity": "BTU / foot / hour / degR",
+    "density": "pound / foot ** 3",
+    "prandtl": "dimensionless",
+    "surfaceTension": "force_pound / foot",
+}
+PROPERTY_NAMES = tuple(PROPERTY_UNITS)
+
+# next to src/ whatever the working directory, so scripts and tests share the tables. Set it to move the cache
+CACHE_FOLDER = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", "..", "cache"))
+TABLE_VERSION = 1
+
+# temperature (degR) and pressure (psi) ranges sampled per fluid, start, stop, points. RP-1 is held to the liquid
+# range rocketprops fits, freezing point to critical point, past Tc its compressed density goes negative
+TABLE_GRIDS = {
+    "RP-1": ((409.67, 1217.67, 809), (10, 2000, 200)),
+    "Air": ((300, 3000, 541), (1, 500, 100)),
+}
+
+def RocketPropsSource(name: str):
+    fluid = get_prop(name)
+    if fluid is None:
+        raise ValueError(f"rocketprops does not know {name}")
+    poise = Q_(1, unitReg.poise).to(PROPERTY_UNITS["viscosity"]).magnitude
+    water = Q_(1, unitReg.gram / unitReg.milliliter).to(PROPERTY_UNITS["density"]).magnitude
+
+    def Sample(temperature: float, pressure: float):
+        viscosity = fluid.ViscAtTdegR(temperature) * poise
+        specificHeat = fluid.CpAtTdegR(temperature)
+        conductivity = fluid.CondAtTdegR(temperature)
+        density = fluid.SG_compressed(temperature, pressure) * water
+        # conductivity is per hour, viscosity per second
+        prandtl = viscosity * specificHeat / conductivity * 3600
+        return viscosity, specificHeat, conductivity, density, prandtl, fluid.SurfAtTdegR(temperature)
+    return Sample
+
+def AirSource():
+    # rocketprops has no air. Ideal gas density, cubic cp fit (Cengel A-2c, 273-1800 K) and Sutherland's law for the
+    # viscosity and conductivity
+    R = Q_(53.35, unitReg.foot * unitReg.force_pound / unitReg.pound / unitReg.degR)
+    molarMass = 28.97
+
+    def Sample(temperature: float, pressure: float):
+        T = temperature / 1.8
+        cpMolar = 28.11 + 0.1967e-2*T + 0.4802e-5*T**2 - 1.966e-9*T**3 # kJ/kmol/K
+        specificHeat = Q_(cpMolar / molarMass, unitReg.kJ / unitReg.kg / unitReg.K).to(PROPERTY_UNITS["specificHeat"]).magnitude
+        viscosity = Q_(1.716e-5 * (T/273.15)**1.5 * (273.15 + 110.4)/(T + 110.4), unitReg.Pa * unitReg.s).to(PROPERTY_UNITS["viscosity"]).magnitude
+        conductivity = Q_(0.0241 * (T/273.15)**1.5 * (273.15 + 194)/(T + 194), unitReg.W / unitReg.m / unitReg.K).to(PROPERTY_UNITS["conductivity"]).magnitude
+        density = (Q_(pressure, unitReg.psi) / (R * Q_(temperature, unitReg.degR))).to(PROPERTY_UNITS["density"]).magnitude
+        prandtl = viscosity * specificHeat / conductivity * 3600
+        return viscosity, specificHeat, conductivity, density, prandtl, 0.0
+    return Sample
+
+@lru_cache
+def PropertySource(name: str):
+    if name == "Air":
+        return AirSource()
+    return RocketPropsSource(name)
+
+class PropertyTable:
+    name: str
+    temperature: np.ndarray # degR
+    pressure: np.ndarray # psi
+    values: np.ndarray # (property, temperature, pressure)
+
+    def __init__(self, name: str, temperature: np.ndarray, pressure: np.ndarray, values: np.ndarray):
+        self.name = name
+        self.temperature = temperature
+        self.pressure = pressure
+        self.values = values
+        self.T0, self.dT, self.nT = float(temperature[0]), float(temperature[1] - temperature[0]), temperature.size
+        self.P0, self.dP, self.nP = float(pressure[0]), float(pressure[1] - pressure[0]), pressure.size
+        self.rows = values.tolist() # nested lists for the scalar path, indexing numpy scalars is slower than the math
+        self.offTable = 0 # points looked up so far that fell off the table and were clamped to its edge
+        self.scalarReported = False # the scalar path runs per cell, it only reports its first point off the table
+
+    @staticmethod
+    def Build(name: str, temperatureGrid: tuple, pressureGrid: tuple):
+        temperature = np.linspace(*temperatureGrid)
+        pressure = np.linspace(*pressureGrid)
+        sample = PropertySource(name)
+        values = np.empty((len(PROPERTY_NAMES), temperature.size, pressure.size))
+        for i, T in enumerate(temperature):
+            for j, P in enumerate(pressure):
+                values[:, i, j] = sample(float(T), float(P))
+        return PropertyTable(name, temperature, pressure, values)
+
+    def Save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, temperature=self.temperature, pressure=self.pressure, values=self.values)
+
+    @staticmethod
+    def Load(name: str, path: str):
+        data = np.load(path)
+        return PropertyTable(name, data["temperature"], data["pressure"], data["values"])
+
+    def Lookup(self, temperature, pressure) -> np.ndarray:
+        # bilinear interpolation over arrays of degR and psi, returns (property, *shape). Points off the table are
+        # clamped to its edge, counted in offTable and reported
+        T = np.asarray(temperature, dtype=float)
+        P = np.asarray(pressure, dtype=float)
+        x = (T - self.T0) / self.dT
+        y = (P - self.P0) / self.dP
+        off = int(np.count_nonzero((T < self.temperature[0]) | (T > self.temperature[-1]) | (P < self.pressure[0]) | (P > self.pressure[-1])))
+        if off:
+            self.offTable += off
+            print(f"{off} {self.name} property lookups are off the table ({self.temperature[0]:g}-{self.temperature[-1]:g} degR, "
+                  f"{self.pressure[0]:g}-{self.pressure[-1]:g} psi), using its edge")
+        x = np.clip(x, 0, self.nT - 1)
+        y = np.clip(y, 0, self.nP - 1)
+        i = np.minimum(x.astype(np.int64), self.nT - 2)
+        j = np.minimum(y.astype(np.int64), self.nP - 2)
+        fx = x - i
+        fy = y - j
+        v = self.values
+        return ((1 - fx)*(1 - fy)*v[:, i, j] + fx*(1 - fy)*v[:, i + 1, j] + (1 - fx)*fy*v[:, i, j + 1] + fx*fy*v[:, i + 1, j + 1])
+
+    def LookupScalar(self, temperature: float, pressure: float) -> list[float]:
+        # one point, reported the first time one falls off the table and only counted in offTable after that
+        x = (temperature - self.T0) / self.dT
+        y = (pressure - self.P0) / self.dP
+        if not (self.temperature[0] <= temperature <= self.temperature[-1] and self.pressure[0] <= pressure <= self.pressure[-1]):
+            if not self.scalarReported:
+                print(f"{self.name} property lookup at {temperature:g} degR, {pressure:g} psi is off the table, using its edge")
+                self.scalarReported = True
+            self.offTable += 1
+        x = min(max(x, 0), self.nT - 1)
+        y = min(max(y, 0), self.nP - 1)
+        i = min(int(x), self.nT - 2)
+        j = min(int(y), self.nP - 2)
+        fx = x - i
+        fy = y - j
+        w00, w10, w01, w11 = (1 - fx)*(1 - fy), fx*(1 - fy), (1 - fx)*fy, fx*fy
+        return [p[i][j]*w00 + p[i + 1][j]*w10 + p[i][j + 1]*w01 + p[i + 1][j + 1]*w11 for p in self.rows]
+
+    def __call__(self, temperature, pressure):
+        if np.ndim(temperature) == 0 and np.ndim(pressure) == 0:
+            return dict(zip(PROPERTY_NAMES, self.LookupScalar(float(temperature), float(pressure))))
+        return dict(zip(PROPERTY_NAMES, self.Lookup(temperature, pressure)))
+
+    def AccuracyReport(self, samples: int = 400, seed: int = 0):
+        # compares the interpolated values against the source at random points inside the table, where the
+        # interpolation error is largest. Returns the max and mean relative error of every property
+        rng = np.random.default_rng(seed)
+        T = rng.uniform(self.temperature[0], self.temperature[-1], samples)
+        P = rng.uniform(self.pressure[0], self.pressure[-1], samples)
+        sample = PropertySource(self.name)
+        exact = np.array([sample(float(t), float(p)) for t, p in zip(T, P)]).T
+        table = self.Lookup(T, P)
+        error = np.abs(table - exact) / np.where(exact == 0, 1, np.abs(exact))
+        report = {name: {"max": float(error[k].max()), "mean": float(error[k].mean())} for k, name in enumerate(PROPERTY_NAMES)}
+        for name, err in report.items():
+            print(f"{self.name} {name}: max rel error {err['max']:.2e}, mean {err['mean']:.2e}")
+        return report
+
+_tables: dict[str, PropertyTable] = {}
+
+def CachePath(name: str, temperatureGrid: tuple, pressureGrid: tuple, folder: str | None = None):
+    # the grid and the table version are part of the file name, changing either builds a new table. folder defaults
+    # to CACHE_FOLDER
+    folder = CACHE_FOLDER if folder is None else folder
+    key = json.dumps([TABLE_VERSION, name, temperatureGrid, pressureGrid])
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    return os.path.join(folder, f"{name}-{digest}.npz")
+
+def GetTable(name: str, folder: str | None = None) -> PropertyTable:
+    if name in _tables:
+        return _tables[name]
+    temperatureGrid, pressureGrid = TABLE_GRIDS[name]
+    path = CachePath(name, temperatureGrid, pressureGrid, folder)
+    if os.path.isfile(path):
+        table = PropertyTable.Load(name, path)
+    else:
+        print(f"Building {name} property table")
+        table = PropertyTable.Build(name, temperatureGrid, pressureGrid)
+        table.Save(path)
+    _tables[name] = table
+    return table
+
+def main():
+    # python -m fluids.properties builds the tables and prints their accuracy
+    for name in TABLE_GRIDS:
+        GetTable(name).AccuracyReport()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from cooling.domain import DomainMC
+from cooling.material import DomainMaterial
+from fluids import properties
+from fluids.properties import PropertyTable
+
+# Fixtures shared by the tests, the strip domain is the smallest mesh holding every kind of cell the network treats
+
+@pytest.fixture(autouse=True)
+def coarseTable(monkeypatch):
+    # a coarse RP-1 table keeps the test from building the full one
+    monkeypatch.setitem(properties._tables, "RP-1", PropertyTable.Build("RP-1", (409.67, 1217.67, 41), (10, 2000, 11)))
+
+GRADED_STEPS = (np.linspace(0.05, 0.15, 11), np.array([0.1, 0.08, 0.05, 0.04, 0.03, 0.02, 0.03, 0.05, 0.08, 0.1, 0.12]))
+
+def StripDomain(steps=None):
+    # chamber gas over a cowl, a cooling channel two cells tall fed from the left, then the plug and free air
+    domain = DomainMC(0, 4, 1, 1, .1) if steps is None else DomainMC.FromSteps(0, 4, *steps)
+    layout = [DomainMaterial.CHAMBER]*2 + [DomainMaterial.COWL]*3 + [DomainMaterial.COOLANT_WALL, DomainMaterial.COOLANT_BULK, DomainMaterial.COOLANT_WALL] + [DomainMaterial.PLUG]*2 + [DomainMaterial.FREE]
+    grid = domain.grid
+    grid.material[:] = np.array([m.value for m in layout])[:, None]
+    grid.material[5:8, 0] = DomainMaterial.COOLANT_INLET
+    grid.material[6, 1] = DomainMaterial.COOLANT_WALL # bulk cells ride on a wall cell
+
+    rows, cols = np.indices(grid.shape)
+    grid.temperature[:] = 700 + 3*rows + 5*cols
+    grid.temperature[:2] = 5200 + 20*cols[:2]
+    grid.velocity[:2] = 1500 + 300*cols[:2]
+    grid.pressure[:] = 250 - 2*cols
+    coolant = (grid.material >= DomainMaterial.COOLANT) & (grid.material <= DomainMaterial.COOLANT_BULK)
+    grid.area[coolant] = 0.0625
+    grid.hydraulicDiameter[coolant] = 0.25
+    grid.previousFlow[..., 0] = rows
+    grid.previousFlow[..., 1] = np.maximum(cols - 1, 0)
+    grid.previousFlow[6, 2:, 0] = 5 # bulk cells follow the wall cell above them
+    grid.previousFlow[6, 2:, 1] = cols[6, 2:]
+    domain.AssignBorders()
+    return domain
+
+@pytest.fixture
+def stripDomain():
+    # StripDomain(steps), steps (column widths, row heights) grade it
+    return StripDomain
+
+@pytest.fixture
+def gradedSteps():
+    return GRADED_STEPS
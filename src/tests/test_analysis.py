@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from cooling import analysis, convergence
+from cooling.convergence import ConvergenceCriteria
+from cooling.domain import DomainMMAP
+
+def test_sor_default_matches_direct(stripDomain):
+    # SOR with its default stop against a direct solve converged far past it, within half a degree
+    with DomainMMAP(stripDomain()) as domain:
+        analysis.AnalyzeMCDirect(domain, convPlot=False, criteria=ConvergenceCriteria(temperatureChange=1e-10), checkpoint=None)
+        direct = np.array(domain.memmaps["temperature"])
+    with DomainMMAP(stripDomain()) as domain:
+        history = analysis.AnalyzeMC(domain, convPlot=False, checkpoint=None)
+        relaxed = np.array(domain.memmaps["temperature"])
+
+    assert len(history) < 20000
+    np.testing.assert_allclose(relaxed, direct, rtol=0, atol=0.5)
+
+def Run(domain, checkpoint, iterations, resume=False):
+    # stops on the iteration count only
+    criteria = ConvergenceCriteria(temperatureChange=0, maxIterations=iterations)
+    history = analysis.AnalyzeMCDirect(domain, convPlot=False, criteria=criteria, checkpoint=checkpoint, resume=resume)
+    return history, np.array(domain.memmaps["temperature"]), np.array(domain.memmaps["pressure"])
+
+def test_resume_picks_up_checkpoint(tmp_path, stripDomain):
+    # two iterations, then two more resumed from the checkpoint, land where four straight ones do
+    checkpoint = str(tmp_path / "checkpoint")
+    with DomainMMAP(stripDomain()) as domain:
+        straight, temperature, pressure = Run(domain, None, 4)
+    with DomainMMAP(stripDomain()) as domain:
+        first, checkpointTemperature, _ = Run(domain, checkpoint, 2)
+    assert len(first) == 2
+
+    with DomainMMAP(stripDomain()) as domain:
+        state = convergence.CheckpointState(checkpoint, domain)
+        assert state["iteration"] == 2 and state["history"] == first
+        assert not np.array_equal(domain.memmaps["temperature"], checkpointTemperature)
+        history, resumedTemperature, resumedPressure = Run(domain, checkpoint, 4, resume=True)
+        assert convergence.CheckpointState(checkpoint, domain)["iteration"] == 4
+    assert history == straight
+    np.testing.assert_allclose(resumedTemperature, temperature, rtol=1e-12)
+    np.testing.assert_allclose(resumedPressure, pressure, rtol=1e-12)
+
+def test_checkpoint_of_another_mesh_is_not_resumed(tmp_path, stripDomain, gradedSteps):
+    # the same shape, extent and material layout but other cell sizes or flow directions is another mesh
+    checkpoint = str(tmp_path / "checkpoint")
+    with DomainMMAP(stripDomain()) as domain:
+        Run(domain, checkpoint, 1)
+
+    regraded = stripDomain((gradedSteps[0], np.full(11, .1)))
+    assert (regraded.width, regraded.height) == pytest.approx((1, 1))
+    rerouted = stripDomain()
+    rerouted.grid.previousFlow[6, 3] = (7, 2)
+    for other in (regraded, rerouted):
+        with DomainMMAP(other) as domain:
+            start = np.array(domain.memmaps["temperature"])
+            assert convergence.ResumeCheckpoint(checkpoint, domain) is None
+            np.testing.assert_array_equal(domain.memmaps["temperature"], start)
@@ -0,0 +1,124 @@
+import numpy as np
+
+from cooling.cellindex import CellIndex
+from general.units import Direction
+
+def Uniform(x0=0.3, xstep=.1, r0=4, rstep=.05, shape=(12, 15)):
+    return CellIndex(x0, np.full(shape[1], xstep), r0, np.full(shape[0], rstep))
+
+def test_locate_matches_uniform_formula():
+    # the division CoordsToCell always did, points on the inner cell edges and past the last ones included
+    cells = Uniform()
+    rng = np.random.default_rng(0)
+    x = np.concatenate([rng.uniform(.26, 1.9, 300), .3 + (np.arange(1, 16) - .5)*.1])
+    r = np.concatenate([rng.uniform(3.3, 4.02, 300), 4 - (np.arange(1, 13) - .5)*.05, rng.uniform(3.3, 4.02, 3)])
+    for xi, ri in zip(x, r):
+        assert cells.Locate(xi, ri) == (int((4 - ri + .05/2)/.05), int((xi - .3 + .1/2)/.1))
+    rows, cols = cells.LocateArray(x, r)
+    assert list(zip(rows.tolist(), cols.tolist())) == [cells.Locate(xi, ri) for xi, ri in zip(x, r)]
+    # the division truncated towards zero, the cell before the first was cell 0
+    assert cells.Locate(.24, 4.03) == (-1, -1)
+    assert cells.LocateArray(np.array([.24, .1]), np.array([4.03, 4.1]))[1].tolist() == [-1, -2]
+
+def test_locate_on_graded_axis(gradedSteps):
+    cells = CellIndex(0, gradedSteps[0], 4, gradedSteps[1])
+    rng = np.random.default_rng(1)
+    x, r = rng.uniform(-.02, 1.02, 500), rng.uniform(3.39, 4.04, 500)
+    for xi, ri in zip(x, r):
+        row, col = cells.Locate(xi, ri)
+        xmin, xmax, rmin, rmax = cells.Box(row, col)
+        assert xmin <= xi < xmax and rmin < ri <= rmax
+        assert cells.Contains((xi, ri), row, col)
+    rows, cols = cells.LocateArray(x, r)
+    assert list(zip(rows.tolist(), cols.tolist())) == [cells.Locate(xi, ri) for xi, ri in zip(x, r)]
+
+    # a point on a column edge goes right, on a row edge down, like the uniform formula; past the ends is off the mesh
+    xEdges, rEdges = cells.cols.edgeList, [-edge for edge in cells.rows.edgeList]
+    for col, edge in enumerate(xEdges):
+        assert cells.Locate(edge, 3.9)[1] == col
+    for row, edge in enumerate(rEdges):
+        assert cells.Locate(.5, edge)[0] == row
+    assert cells.Locate(xEdges[0] - 1e-9, rEdges[0] + 1e-9) == (-1, -1)
+    assert not cells.OnMesh(*cells.Locate(xEdges[-1], rEdges[-1]))
+
+def ClipSegment(point1, point2, box):
+    # parameters along the segment where it enters and leaves a closed box, None when it misses
+    xmin, xmax, rmin, rmax = box
+    t0, t1 = 0.0, 1.0
+    for start, delta, lo, hi in [(point1[0], point2[0] - point1[0], xmin, xmax), (point1[1], point2[1] - point1[1], rmin, rmax)]:
+        if delta == 0:
+            if not lo <= start <= hi:
+                return None
+            continue
+        a, b = sorted([(lo - start)/delta, (hi - start)/delta])
+        t0, t1 = max(t0, a), min(t1, b)
+    return (t0, t1) if t0 <= t1 else None
+
+def test_traverse_against_clipping(gradedSteps):
+    # every cell the segment runs through is listed once, in order, and nothing it only grazes
+    rng = np.random.default_rng(2)
+    for cells in (Uniform(), CellIndex(0, gradedSteps[0], 4, gradedSteps[1])):
+        xEdges, rEdges = cells.cols.edgeList, [-edge for edge in cells.rows.edgeList]
+        for _ in range(200):
+            point1, point2 = rng.uniform(-.1, 1.9, 2), rng.uniform(3.3, 4.1, 2)
+            point1, point2 = (point1[0], point2[0]), (point1[1], point2[1])
+            if rng.random() < .3: # snap to the grid lines
+                point1 = (xEdges[rng.integers(len(xEdges))], point1[1])
+                point2 = (point2[0], rEdges[rng.integers(len(rEdges))])
+            traversed = cells.Traverse(point1, point2)
+            assert len(set(traversed)) == len(traversed)
+            steps = np.abs(np.diff(np.array(traversed).reshape(-1, 2), axis=0))
+            assert np.all(steps <= 1) and np.all(steps.sum(axis=1) >= 1)
+
+            entries = []
+            for row in range(cells.shape[0]):
+                for col in range(cells.shape[1]):
+                    clip = ClipSegment(point1, point2, cells.Box(row, col))
+                    if clip is not None and clip[1] - clip[0] > 1e-6:
+                        mid = [a + (clip[0] + clip[1])/2*(b - a) for a, b in zip(point1, point2)]
+                        xmin, xmax, rmin, rmax = cells.Box(row, col)
+                        if xmin < mid[0] < xmax and rmin < mid[1] < rmax:
+                            assert (row, col) in traversed
+                            entries.append((clip[0], (row, col)))
+                    elif (row, col) in traversed:
+                        assert clip is not None
+            order = [cell for _, cell in sorted(entries)]
+            assert [cell for cell in traversed if cell in order] == order
+
+def test_traverse_grid_lines_and_corners():
+    # along a row edge the cells below, along a column edge the cells to the right, an end on an edge brings in the
+    # cell past it
+    cells = Uniform(0, .125, 4, .125, (10, 10))
+    assert cells.Traverse((.0625, 3.5625), (.4375, 3.5625)) == [(4, 1), (4, 2), (4, 3), (4, 4)]
+    assert cells.Traverse((.3125, 3.9), (.3125, 3.6)) == [(1, 3), (2, 3), (3, 3)]
+    assert cells.Traverse((.1, 3.9), (.3125, 3.6875)) == [(1, 1), (2, 2), (3, 3)]
+    # through the corners on the diagonal, not the cells beside them, in either direction and when the edges round
+    for step in (.125, .1, .07):
+        cells = Uniform(0, step, 4, step, (10, 10))
+        diagonal = [(0, 0), (1, 1), (2, 2), (3, 3)]
+        assert cells.Traverse((0, 4), (3*step, 4 - 3*step)) == diagonal
+        assert cells.Traverse((3*step, 4 - 3*step), (0, 4)) == diagonal[::-1]
+    # pieces off the mesh are dropped
+    assert cells.Traverse((-.5, 3.99), (.1, 3.99)) == [(0, 0), (0, 1)]
+    assert cells.Traverse((2, 5), (2.1, 5.1)) == []
+
+def test_neighbors(gradedSteps):
+    cells = CellIndex(0, gradedSteps[0][:5], 4, gradedSteps[1][:4])
+    rows, cols = np.indices(cells.shape)
+    rows, cols = rows.ravel(), cols.ravel()
+    table = cells.NeighborTable(rows, cols)
+    assert table.shape == (rows.size, 4)
+    for k, (row, col) in enumerate(zip(rows.tolist(), cols.tolist())):
+        xmin, xmax, rmin, rmax = cells.Box(row, col)
+        xmid, rmid = (xmin + xmax)/2, (rmin + rmax)/2
+        # a point just across each face
+        across = {Direction.LEFT: (xmin - 1e-6, rmid), Direction.UPPER: (xmid, rmax + 1e-6),
+                  Direction.LOWER: (xmid, rmin - 1e-6), Direction.RIGHT: (xmax + 1e-6, rmid)}
+        for direction, point in across.items():
+            expected = cells.Locate(*point)
+            if not cells.OnMesh(*expected):
+                assert cells.Neighbor(row, col, direction) is None and table[k, direction] == -1
+            else:
+                assert cells.Neighbor(row, col, direction) == expected
+                assert table[k, direction] == expected[0]*cells.shape[1] + expected[1]
+    assert np.count_nonzero(table == -1) == 2*(cells.shape[0] + cells.shape[1])
@@ -0,0 +1,24 @@
+import numpy as np
+
+from cooling.domain import CoolingChannel, DomainMC
+from general.units import Q_, unitReg
+from nozzle.nozzle import ContourPoint
+
+def Channel(rUpper, rLower):
+    x = np.linspace(0, .95, 5)
+    return CoolingChannel(np.array([ContourPoint(xi, rUpper) for xi in x]), np.array([ContourPoint(xi, rLower) for xi in x]))
+
+def test_assign_coolant_flow_again_replaces_path():
+    # a script laying down the same circuit twice ends up with one path, another circuit still gets its own
+    domain = DomainMC(0, 4, 1, 1, .1)
+    domain.AssignCoolantFlow(Channel(3.75, 3.55), True, Q_(400, unitReg.psi))
+    first = domain.flowPaths[0]
+    domain.AssignCoolantFlow(Channel(3.75, 3.55), True, Q_(400, unitReg.psi))
+    assert len(domain.flowPaths) == 1
+    np.testing.assert_array_equal(domain.flowPaths[0].wallCells, first.wallCells)
+
+    domain.AssignCoolantFlow(Channel(3.35, 3.15), False, Q_(400, unitReg.psi))
+    assert len(domain.flowPaths) == 2
+    assert set(np.unique(domain.grid.flowPath[..., 0])) == {-1, 0, 1}
+    for index, path in enumerate(domain.flowPaths):
+        assert np.all(domain.grid.flowPath[path.wallCells[:, 0], path.wallCells[:, 1], 0] == index)
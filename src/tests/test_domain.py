@@ -0,0 +1,47 @@
+import mmap
+import numpy as np
+
+from cooling.domain import DomainMC, DomainMMAP
+from cooling.material import DomainMaterial
+from general.units import Q_, unitReg
+
+def test_commit_scatters_staged_values():
+    # 201 x 201 float64 fields span about 80 pages, the staged cells touch only a few of them
+    with DomainMMAP(DomainMC(0, 4, 10, 10, .05)) as domain:
+        hpoints = domain.hpoints
+        rows, cols = np.array([0, 0, 100, 200]), np.array([0, 3, 7, 200])
+        domain.StageMEM(rows, cols, 'temperature', np.array([500., 600., 700., 800.]))
+        domain.StageMEM(150, 20, 'temperature', 900.)
+        domain.StageMEM(5, 5, 'pressure', Q_(2, unitReg.MPa))
+        domain.StageMEM(5, 5, 'material', DomainMaterial.PLUG)
+        written = domain.CommitMEM()
+
+        temperature = domain.memmaps["temperature"]
+        np.testing.assert_array_equal(temperature[rows, cols], [500., 600., 700., 800.])
+        assert temperature[150, 20] == 900. and temperature[1, 1] == 529.67 # untouched default
+        assert domain.memmaps["pressure"][5, 5] == Q_(2, unitReg.MPa).to(unitReg.psi).magnitude
+        assert domain.memmaps["material"][5, 5] == DomainMaterial.PLUG
+        assert domain.staged == {}
+
+        temperaturePages = np.unique(((np.append(rows, 150) * hpoints + np.append(cols, 20)) * 8) // mmap.PAGESIZE).size
+        assert written == (temperaturePages + 2) * mmap.PAGESIZE # one page each for the pressure and the material
+        assert domain.bytesWritten == written
+
+        # the fields on disk carry the commit
+        reopened = DomainMMAP.OpenMesh(domain.workingFolder, 'r')
+        assert reopened.grid.temperature[100, 7] == 700. and reopened.grid.material[5, 5] == DomainMaterial.PLUG
+
+def test_commit_without_flush(monkeypatch):
+    flushed = []
+    monkeypatch.setattr(np.memmap, "flush", lambda self: flushed.append(self.filename))
+    with DomainMMAP(DomainMC(0, 4, 1, 1, .1)) as domain:
+        domain.StageMEM(np.array([1, 2]), np.array([3, 4]), 'temperature', np.array([610., 620.]))
+        written = domain.CommitMEM(flush=False)
+        assert flushed == []
+        np.testing.assert_array_equal(domain.memmaps["temperature"][[1, 2], [3, 4]], [610., 620.])
+        assert written == mmap.PAGESIZE and domain.bytesWritten == written and domain.staged == {}
+
+        domain.StageMEM(0, 0, 'temperature', 640.)
+        assert domain.CommitMEM() == mmap.PAGESIZE
+        assert len(flushed) == 1 and flushed[0].endswith("temperature.bin")
+        assert domain.bytesWritten == 2 * mmap.PAGESIZE
@@ -0,0 +1,33 @@
+import warnings
+import numpy as np
+from scipy.optimize import fsolve
+
+from fluids import friction
+
+def test_colebrook_matches_fsolve():
+    rng = np.random.default_rng(0)
+    Re = 10**rng.uniform(np.log10(friction.LAMINAR_RE), 5, 200)
+    roughness = np.concatenate([np.zeros(20), 10**rng.uniform(-6, -1.5, 180)])
+    f = friction.Colebrook(Re, roughness)
+    for i in range(Re.size):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected, _, ier, _ = fsolve(lambda f: -2*np.log10(roughness[i]/3.7 + 2.51/(Re[i]*np.sqrt(f))) - 1/np.sqrt(f), 0.05, full_output=True)
+        if ier == 1: # fsolve wanders into negative f from 0.05 at high Re
+            assert abs(f[i] - expected[0]) <= 1e-10*expected[0]
+        assert abs(friction.ColebrookScalar(Re[i], roughness[i]) - f[i]) <= 1e-14*f[i]
+
+def test_colebrook_residual():
+    Re = np.logspace(3.5, 8, 50)
+    roughness = np.logspace(-7, -1.5, 50)
+    f = friction.Colebrook(Re, roughness)
+    np.testing.assert_allclose(-2*np.log10(roughness/3.7 + 2.51/(Re*np.sqrt(f))), 1/np.sqrt(f), rtol=1e-13)
+    f = friction.SmoothPipe(Re)
+    np.testing.assert_allclose(1.930*np.log10(Re*np.sqrt(f)) - 0.537, 1/np.sqrt(f), rtol=1e-13)
+
+def test_laminar_branch():
+    Re = np.array([500., 2299., 2300., 1e5])
+    f = friction.DarcyFriction(Re, 1e-4)
+    np.testing.assert_allclose(f[:2], 64/Re[:2])
+    assert f[2] == friction.ColebrookScalar(2300., 1e-4)
+    assert friction.DarcyFrictionScalar(500., 1e-4) == 64/500.
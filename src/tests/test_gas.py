@@ -0,0 +1,30 @@
+import numpy as np
+from scipy.optimize import brentq
+
+from fluids import gas
+import general.design as DESIGN
+
+def test_area_ratio_inverse():
+    gamma = gas.SpHeatRatio(1.2)
+    for supersonic, bracket in [(False, (1e-9, 1.0)), (True, (1.0, 1e4))]:
+        areaRatio = np.geomspace(1.001, 2000, 60)
+        mach = gas.MachFromAreaRatio(areaRatio, gamma, supersonic)
+        np.testing.assert_allclose(gas.Isentropic1DExpansion(mach, gamma), areaRatio, rtol=1e-13)
+        expected = [brentq(lambda M: gas.Isentropic1DExpansion(M, gamma) - A, *bracket, xtol=1e-15, rtol=1e-14) for A in areaRatio[::10]]
+        np.testing.assert_allclose(mach[::10], expected, rtol=1e-10)
+    assert np.all(gas.MachFromAreaRatio(np.array([0.5, 1.0]), gamma) == 1)
+
+def test_prandtl_meyer_inverse():
+    nu = np.linspace(0, 1.6, 80)
+    mach = gas.MachFromPrandtlMeyer(nu, 1.25)
+    assert mach[0] == 1 and np.all(np.diff(mach) > 0)
+    np.testing.assert_allclose(gas.PrandtlMeyerFunction(mach, 1.25), nu, atol=1e-13)
+
+def test_ratios_match_variable_gamma():
+    exhaust = DESIGN.exhaustGas
+    mach = np.array([0.02, 0.3, 0.8, 1.0, 2.0])
+    gamma = exhaust.getVariableGammaArray(mach)
+    for i, M in enumerate(mach):
+        assert gamma[i] == exhaust.getVariableGamma(M).g
+        assert abs(gas.IsentropicTempRatio(M, gamma[i]) - gas.StagTempRatio(M, exhaust)) <= 1e-15
+        assert abs(gas.IsentropicPressRatio(M, gamma[i]) - gas.StagPressRatio(M, exhaust)) <= 1e-15
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from scipy.sparse.linalg import gmres, spsolve
+
+from cooling import cooling2d, kernels, parallel
+from cooling.decomposition import BlockSolver
+from cooling.multigrid import MultigridSolver
+from cooling.domain import DomainMMAP
+from cooling.network import ThermalNetwork
+import general.design as DESIGN
+from general.units import Q_, unitReg
+
+# The float kernels against the pint calc_cell/cooling2d path they replace, both read the same property table so the
+# only difference left is the unit handling
+
+@pytest.mark.parametrize("graded", [False, True], ids=["uniform", "graded"])
+def test_cell_coefficients_match_pint(graded, stripDomain, gradedSteps):
+    with DomainMMAP(stripDomain(gradedSteps if graded else None)) as domain:
+        network = ThermalNetwork(domain)
+        network.Update(domain)
+        G, capacityRate, pressureDrop = network.G.copy(), network.capacityRate.copy(), network.pressureDrop.copy()
+        network.UpdateCells(domain)
+
+    assert np.count_nonzero(G) > 0 and np.count_nonzero(capacityRate) > 0
+    np.testing.assert_allclose(G, network.G, rtol=1e-12, atol=0)
+    np.testing.assert_allclose(capacityRate, network.capacityRate, rtol=1e-12, atol=0)
+    np.testing.assert_allclose(pressureDrop, network.pressureDrop, rtol=1e-12, atol=0)
+
+def test_cell_pool_matches_serial(monkeypatch, stripDomain):
+    monkeypatch.setattr(parallel, "PARALLEL_CELLS", 0)
+    with DomainMMAP(stripDomain()) as domain:
+        network = ThermalNetwork(domain)
+        network.Update(domain)
+        with ThermalNetwork(domain, workers=2, blockSize=7) as pooled:
+            assert pooled.pool is not None
+            pooled.Update(domain)
+            np.testing.assert_allclose(pooled.G, network.G, rtol=1e-14, atol=0)
+            np.testing.assert_allclose(pooled.capacityRate, network.capacityRate, rtol=1e-14, atol=0)
+            np.testing.assert_allclose(pooled.pressureDrop, network.pressureDrop, rtol=1e-14, atol=0)
+            pooled.UpdateCells(domain)
+            np.testing.assert_allclose(pooled.G, network.G, rtol=1e-12, atol=0)
+
+def test_block_solver_matches_direct(stripDomain):
+    with DomainMMAP(stripDomain()) as domain:
+        network = ThermalNetwork(domain)
+        network.Update(domain)
+        temperature, _ = network.Load(domain)
+        solver = BlockSolver.ForNetwork(network, workers=2, blockCells=network.size//5)
+        blocked = network.SolveTemperature(temperature, solver)
+        solver.close()
+        direct = network.SolveTemperature(temperature)
+
+    owned = np.concatenate([block.cells[:block.owned] for block in solver.blocks])
+    assert len(solver.blocks) >= 5 and np.array_equal(np.sort(owned), np.arange(network.size))
+    np.testing.assert_allclose(blocked, direct, rtol=1e-7)
+
+def test_multigrid_matches_direct(stripDomain):
+    # a strip wide enough for two coarse levels under the default coarseSize
+    with DomainMMAP(stripDomain((np.full(41, .1), np.full(11, .1)))) as domain:
+        network = ThermalNetwork(domain)
+        network.Update(domain)
+        temperature, _ = network.Load(domain)
+    A, rhs = network.TemperatureSystem(temperature)
+    solver = MultigridSolver.ForNetwork(network)
+    multigrid = solver(A, rhs, temperature)
+
+    iterations = []
+    plain, info = gmres(A, rhs, x0=temperature, rtol=solver.rtol, restart=30, maxiter=solver.maxiter, callback=iterations.append, callback_type='pr_norm')
+    assert len(solver.aggregates) >= 1 and len(solver.levels) == len(solver.aggregates)
+    assert info == 0 and solver.iterations < len(iterations)
+    np.testing.assert_allclose(multigrid, spsolve(A.tocsc(), rhs), rtol=1e-7)
+
+def test_film_coefficients_match_pint():
+    T = np.array([600., 750., 900.])
+    P = np.array([300., 250., 200.])
+    h = kernels.CoolantConvection(T, P, np.full(3, 0.0625*kernels.INCH**2), np.full(3, 0.25*kernels.INCH))
+    for i in range(3):
+        expected = cooling2d.internal_flow_convection(Q_(T[i], unitReg.degR), Q_(P[i], unitReg.psi), Q_(0.0625, unitReg.inch**2), Q_(0.25, unitReg.inch))
+        assert h[i] == pytest.approx(expected.magnitude, rel=1e-12)
+
+def BartzReference(gasTemp, velocity, wallTemp, radiusThroat, radiusLip):
+    # the Bartz correlation as combustion_convection wrote it with pint before the evaluator
+    gamma = DESIGN.exhaustGas.SimpleHarmonicGamma(gasTemp).g
+    Mach = velocity / np.sqrt(gamma * cooling2d.R_gas * gasTemp).to(unitReg.foot / unitReg.second)
+    mu = cooling2d.viscosity_stagnation.to(unitReg.pound / (unitReg.foot * unitReg.second))
+    P_0 = cooling2d.pressure_stagnation.to(unitReg.pound_force / unitReg.ft**2)
+    A_star = DESIGN.chokeArea.to(unitReg.ft**2)
+    D_star = (4 * A_star / (2 * np.pi * (radiusThroat + radiusLip))).to(unitReg.ft)
+    A = cooling2d.calculate_nozzle_area(A_star, Mach, gamma).to(unitReg.ft**2)
+    stretch = 1 + (gamma - 1) / 2 * Mach**2
+    sigma = 1 / ((0.5 * wallTemp / cooling2d.temperature_stagnation * stretch + 0.5)**(0.8 - 0.2 * 0.6) * stretch**(0.2 * 0.6))
+    g_c = Q_(32.174, unitReg.pound * unitReg.ft / (unitReg.pound_force * unitReg.s**2))
+    h_g = (0.026 / D_star**0.2 * mu**0.2 / cooling2d.Prandtl_stagnation**0.6 * cooling2d.specific_heat_stagnation * (P_0 / (cooling2d.cstar * g_c))**0.8 *
+           (D_star / Q_(0.1, unitReg.inch).to(unitReg.ft))**0.1 * (A_star / A)**0.9 * sigma)
+    return h_g.to(unitReg.BTU / (unitReg.foot**2) / unitReg.hour / unitReg.degR).magnitude
+
+def test_bartz_matches_pint():
+    Tg = np.array([4000., 5000., 5800.])
+    V = np.array([500., 3000., 6000.])
+    Tw = np.array([900., 1200., 1500.])
+    throat, lip = Q_(3.283, unitReg.inch), Q_(3.369, unitReg.inch)
+    h = cooling2d.BartzEvaluator(throat, lip)(Tw, V, Tg)
+    for i in range(3):
+        expected = BartzReference(Q_(Tg[i], unitReg.degR), Q_(V[i], unitReg.foot/unitReg.second), Q_(Tw[i], unitReg.degR), throat, lip)
+        assert h[i] == pytest.approx(expected, rel=1e-12)
+
+def test_conductivity_matches_pint():
+    T = np.array([500., 1000., 2500.])
+    np.testing.assert_allclose(kernels.ConductivityGrcop(T), [cooling2d.conduction_grcop(Q_(t, unitReg.degR)).magnitude for t in T], rtol=1e-12)
+    T = T[:2]
+    np.testing.assert_allclose(kernels.ConductivityRP1(T), [cooling2d.conduction_rp1(Q_(t, unitReg.degR)).magnitude for t in T], rtol=1e-12)
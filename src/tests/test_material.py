@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from cooling import material
+from cooling.domain import AssignMaterial, DomainMC
+from cooling.material import DomainMaterial
+from nozzle.nozzle import ContourPoint
+
+def Box(x0, x1, r0, r1):
+    return np.array([ContourPoint(x, r) for x, r in [(x0, r0), (x1, r0), (x1, r1), (x0, r1)]])
+
+def test_define_materials_ignores_coolant_contour():
+    # the coolant contour is passed along but cells are only classified against cowl, chamber and plug
+    cowl, coolant, chamber, plug = Box(0, 1, 3.55, 4), Box(.2, .8, 3.65, 3.85), Box(0, 1, 3.25, 3.55), Box(0, 1, 3, 3.25)
+    domain = DomainMC(0, 4, 1, 1, .1)
+    domain.DefineMaterials(cowl, coolant, chamber, plug, method='exact')
+    ignored = DomainMC(0, 4, 1, 1, .1)
+    ignored.DefineMaterials(cowl, np.array([]), chamber, plug, method='exact')
+
+    assert not np.any(domain.grid.material == DomainMaterial.COOLANT)
+    assert np.array_equal(domain.grid.material, ignored.grid.material)
+    inCoolant = (domain.grid.x > .2) & (domain.grid.x < .8) & (domain.grid.r > 3.65) & (domain.grid.r < 3.85)
+    assert np.any(inCoolant) and np.all(domain.grid.material[inCoolant] == DomainMaterial.COWL)
+
+def RandomPolygon(rng, center):
+    # star shaped polygon with vertices on a 1/8 in lattice, so lattice points land on its vertices and edges
+    angles = np.sort(rng.random(rng.integers(3, 12))) * 2 * np.pi
+    radius = 0.5 + rng.random(angles.size)
+    x = np.round((center[0] + radius * np.cos(angles)) * 8) / 8
+    r = np.round((center[1] + radius * np.sin(angles)) * 8) / 8
+    return np.array([ContourPoint(xi, ri) for xi, ri in zip(x, r)]), x, r
+
+def TestPoints(rng, x, r):
+    # random points, the vertices, the middle of every segment including the closing one and lattice points
+    lattice = np.round(rng.uniform(-2, 2, (2, 200)) * 8) / 8
+    return (np.concatenate([rng.uniform(-2, 2, 300), x, (x + np.roll(x, -1)) / 2, lattice[0]]),
+            np.concatenate([rng.uniform(-2, 2, 300), r, (r + np.roll(r, -1)) / 2, lattice[1]]))
+
+def test_batched_classifier_matches_isintersect():
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        contour, x, r = RandomPolygon(rng, (0, 0))
+        px, pr = TestPoints(rng, x, r)
+        expected = [material.isIntersect((a, b), contour, (4, 4)) for a, b in zip(px, pr)]
+        np.testing.assert_array_equal(material.isIntersectArray(px, pr, contour, (4, 4)), expected)
+
+def test_classify_points_matches_assign_material():
+    # overlapping polygons, the first one a point falls in wins like the baseline AssignMaterial
+    rng = np.random.default_rng(1)
+    for _ in range(10):
+        cowl, chamber, plug = (RandomPolygon(rng, center)[0] for center in [(-.3, 0), (0, .3), (.3, 0)])
+        px, pr = TestPoints(rng, *RandomPolygon(rng, (0, 0))[1:])
+        contours = [(cowl, DomainMaterial.COWL), (chamber, DomainMaterial.CHAMBER), (plug, DomainMaterial.PLUG)]
+        expected = [AssignMaterial((a, b), (4, 4), np.array([]), cowl, chamber, plug) for a, b in zip(px, pr)]
+        np.testing.assert_array_equal(material.ClassifyPoints(px, pr, contours, (4, 4)), expected)
+
+def StarPolygon(rng, lattice: float | None):
+    # simple polygon around (0.5, 3.5), vertices snapped to multiples of lattice when given
+    count = rng.integers(3, 25)
+    angles = (np.arange(count) + .8 * rng.random(count)) * 2 * np.pi / count
+    radius = .1 + .35 * rng.random(count)
+    x, r = .5 + radius * np.cos(angles), 3.5 + radius * np.sin(angles)
+    if lattice is not None:
+        x, r = np.round(x / lattice) * lattice, np.round(r / lattice) * lattice
+    return np.array([ContourPoint(xi, ri) for xi, ri in zip(x, r)]), x, r
+
+def test_scanline_matches_exact():
+    # cell centers on the contours, the closing segments of the boxes included, land where the exact classifier puts them
+    cowl, chamber = Box(0, 1, 3.55, 4), Box(0, 1, 3.25, 3.55)
+    plug = np.array([ContourPoint(x, r) for x, r in [(0, 3), (1, 3), (1, 3.1), (.5, 3.25), (0, 3.2)]])
+    exact, scanline = DomainMC(0, 4, 1, 1, .05), DomainMC(0, 4, 1, 1, .05)
+    assert exact.DefineMaterials(cowl, np.array([]), chamber, plug, method='exact') is None
+    coverage = scanline.DefineMaterials(cowl, np.array([]), chamber, plug, method='scanline')
+    np.testing.assert_array_equal(scanline.grid.material, exact.grid.material)
+    assert set(coverage) == {DomainMaterial.COWL, DomainMaterial.CHAMBER, DomainMaterial.PLUG}
+
+    rng = np.random.default_rng(2)
+    for i in range(40):
+        contour, _, _ = StarPolygon(rng, [None, .05, .025, .0125][i % 4])
+        ds = 1 / int(rng.integers(10, 60))
+        hpoints = int(round(1 / ds)) + 1
+        x, r = np.meshgrid(np.arange(hpoints) * ds, 4 - np.arange(hpoints) * ds)
+        raster = material.RasterizeContour(contour, 0, ds, hpoints, r[:, 0], ds, (1, 1))
+        np.testing.assert_array_equal(raster.inside, material.isIntersectArray(x, r, contour, (1, 1)))
+
+def test_coverage_sums_to_polygon_area():
+    # exact when every vertex lies between sub-scanlines, otherwise off by the sub-scanline sampling of the corners
+    rng = np.random.default_rng(3)
+    for lattice, rtol in [(.0125, 1e-12), (None, 1e-2)]:
+        for _ in range(10):
+            contour, x, r = StarPolygon(rng, lattice)
+            area = 0.5 * abs(np.dot(x, np.roll(r, -1)) - np.dot(r, np.roll(x, -1)))
+            raster = material.RasterizeContour(contour, 0, .05, 21, 4 - np.arange(21) * .05, .05, (1, 1))
+            assert np.all((raster.coverage >= 0) & (raster.coverage <= 1))
+            assert raster.coverage.sum() * .05**2 == pytest.approx(area, rel=rtol)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from cooling.coolant import FlowPath
+from cooling.domain import DomainMC
+from cooling.material import DomainMaterial
+
+def test_dump_over_loaded_mesh(tmp_path, stripDomain, gradedSteps):
+    # saving a mesh back where it was loaded from rewrites the files its fields and arrays are still mapped from
+    filename = str(tmp_path / "strip")
+    domain = stripDomain(gradedSteps)
+    domain.AddFlowPath(FlowPath.FromGrid(domain.grid, [(5, col) for col in range(domain.hpoints)], True))
+    domain.DumpFile(filename)
+
+    loaded = DomainMC.LoadFile(filename)
+    loaded.grid.temperature[...] += 100
+    loaded.grid.material[0, 0] = DomainMaterial.FREE
+    loaded.flowPaths[0].area[:] = 0.125
+    loaded.DumpFile(filename)
+    expected = {name: np.array(loaded.grid.fields[name]) for name in loaded.grid.fields}
+
+    reloaded = DomainMC.LoadFile(filename)
+    assert set(reloaded.grid.fields) == set(expected)
+    for name, field in expected.items():
+        np.testing.assert_array_equal(reloaded.grid.fields[name], field, err_msg=name)
+    np.testing.assert_array_equal(reloaded.grid.temperature, domain.grid.temperature + 100)
+    assert reloaded.grid.material[0, 0] == DomainMaterial.FREE
+    np.testing.assert_array_equal(reloaded.xsteps, domain.xsteps)
+    np.testing.assert_array_equal(reloaded.rsteps, domain.rsteps)
+    assert len(reloaded.flowPaths) == 1 and reloaded.flowPaths[0].upperWall
+    for name in FlowPath.ARRAYS:
+        np.testing.assert_array_equal(getattr(reloaded.flowPaths[0], name), getattr(loaded.flowPaths[0], name), err_msg=name)
+    assert np.all(reloaded.flowPaths[0].area == 0.125)
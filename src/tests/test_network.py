@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from cooling.cellindex import FACE_OFFSETS
+from cooling.domain import DomainMMAP
+from cooling.material import DomainMaterial, MaterialType
+from cooling.network import ActiveIndex, ThermalNetwork
+
+@pytest.mark.parametrize("graded", [False, True])
+def test_slots_match_grid_lookups(stripDomain, gradedSteps, graded):
+    # reading the state vector through the slots gives what reading the grid around every active cell did
+    with DomainMMAP(stripDomain(gradedSteps if graded else None)) as domain:
+        grid = domain.grid
+        shape = grid.shape
+        index = ActiveIndex.Build(domain)
+        flat = index.rows.astype(np.int64)*shape[1] + index.cols
+        zeroSlot = flat.size + index.fixed.size
+        temperature = np.array(grid.temperature).ravel()
+        state = np.concatenate([temperature[flat], temperature[index.fixed], [0.0]])
+        slotFlat = np.concatenate([flat, index.fixed, [-1]])
+        isActive = np.zeros(shape, dtype=bool)
+        isActive[index.rows, index.cols] = True
+
+        expectedFixed = set()
+        for k, (row, col) in enumerate(zip(index.rows.tolist(), index.cols.tolist())):
+            for direction, (dRow, dCol) in enumerate(FACE_OFFSETS.tolist()):
+                nRow, nCol = row + dRow, col + dCol
+                if not (0 <= nRow < shape[0] and 0 <= nCol < shape[1]):
+                    assert index.neighbors[k, direction] == zeroSlot and state[index.neighbors[k, direction]] == 0
+                    continue
+                assert slotFlat[index.neighbors[k, direction]] == nRow*shape[1] + nCol
+                assert state[index.neighbors[k, direction]] == grid.temperature[nRow, nCol]
+                if not isActive[nRow, nCol]:
+                    expectedFixed.add(nRow*shape[1] + nCol)
+
+            if grid.material[row, col] in MaterialType.COOLANT:
+                upRow, upCol = grid.previousFlow[row, col]
+                assert slotFlat[index.upstream[k]] == upRow*shape[1] + upCol
+                assert state[index.upstream[k]] == grid.temperature[upRow, upCol]
+                if not isActive[upRow, upCol]:
+                    expectedFixed.add(upRow*shape[1] + upCol)
+            else:
+                assert index.upstream[k] == zeroSlot
+        assert set(index.fixed.tolist()) == expectedFixed
+
+        # the FREE row below the plug is read through fixed slots, its faces carry no heat
+        isFree = np.isin(slotFlat[index.neighbors], np.flatnonzero(grid.material == DomainMaterial.FREE))
+        assert np.any(isFree)
+        with ThermalNetwork(domain) as network:
+            network.Update(domain)
+            assert np.all(network.G[isFree] < 1e-20)
+
+def test_index_reused_until_layout_changes(stripDomain, monkeypatch):
+    builds = []
+    build = ActiveIndex.Build
+    monkeypatch.setattr(ActiveIndex, "Build", staticmethod(lambda domain: builds.append(1) or build(domain)))
+    with DomainMMAP(stripDomain()) as domain:
+        first = ActiveIndex.ForDomain(domain)
+        domain.memmaps["temperature"][:] += 50 # fields other than the layout leave the index alone
+        reused = ActiveIndex.ForDomain(domain)
+        assert len(builds) == 1
+        for name in ActiveIndex.ARRAYS:
+            np.testing.assert_array_equal(getattr(reused, name), getattr(first, name), err_msg=name)
+
+        domain.memmaps["material"][3, 4] = DomainMaterial.FREE
+        rebuilt = ActiveIndex.ForDomain(domain)
+        assert len(builds) == 2 and rebuilt.rows.size == first.rows.size - 1
+        assert ActiveIndex.ForDomain(domain).rows.size == rebuilt.rows.size and len(builds) == 2
+
+        domain.memmaps["previousFlow"][6, 3] = (7, 2)
+        ActiveIndex.ForDomain(domain)
+        assert len(builds) == 3
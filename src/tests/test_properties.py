@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from fluids import properties
+
+def test_accuracy_report_on_coarse_table():
+    # 41 x 11 points over the RP-1 range, surface tension bends hardest near the top of the table
+    table = properties.GetTable("RP-1")
+    report = table.AccuracyReport(samples=200)
+    assert set(report) == set(properties.PROPERTY_NAMES)
+    for name, error in report.items():
+        assert 0 < error["mean"] < 5e-3, name
+        assert error["mean"] <= error["max"] < (0.1 if name == "surfaceTension" else 0.02), name
+
+    # on the table points the interpolation gives back the stored values
+    T, P = np.meshgrid(table.temperature, table.pressure, indexing='ij')
+    np.testing.assert_allclose(table.Lookup(T, P), table.values, rtol=1e-12)
+    assert table.offTable == 0
+
+def test_off_table_lookups_are_counted(capsys):
+    table = properties.GetTable("RP-1")
+    edge = table.Lookup(np.array([409.67, 1217.67]), np.array([10., 2000.]))
+    clamped = table.Lookup(np.array([300., 1500., 800.]), np.array([10., 2000., 3000.]))
+    np.testing.assert_array_equal(clamped[:, :2], edge)
+    assert table.offTable == 3
+    assert "3 RP-1 property lookups are off the table" in capsys.readouterr().out
+
+    assert table(300., 10.)["density"] == pytest.approx(edge[properties.PROPERTY_NAMES.index("density"), 0], rel=1e-12)
+    table(1500., 2000.)
+    assert table.offTable == 5
+    assert capsys.readouterr().out.count("off the table") == 1 # the scalar path reports its first point only
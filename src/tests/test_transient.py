@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from cooling import analysis
+from cooling.convergence import ConvergenceCriteria
+from cooling.domain import DomainMMAP
+from cooling.transient import TransientSettings
+
+@pytest.mark.parametrize("theta", [1.0, 0.5], ids=["euler", "crank-nicolson"])
+def test_transient_settles_on_steady_state(theta, stripDomain):
+    with DomainMMAP(stripDomain()) as domain:
+        analysis.AnalyzeMCDirect(domain, convPlot=False, criteria=ConvergenceCriteria(temperatureChange=1e-9), checkpoint=None)
+        steady = np.array(domain.memmaps["temperature"])
+    with DomainMMAP(stripDomain()) as domain:
+        result = analysis.AnalyzeMCTransient(domain, 60.0, [0.0, 60.0], TransientSettings(theta=theta, dtMax=5.0, propertyChange=1e-3),
+                                             initialTemperature=530, output=None)
+        final = np.array(domain.memmaps["temperature"])
+
+    assert result.times == [0.0, 60.0]
+    np.testing.assert_array_equal(result.temperatures[1], final)
+    heated = result.history[0][2]
+    assert 530 < heated < result.history[-1][2]
+    np.testing.assert_allclose(final, steady, rtol=1e-3)